@@ -8,6 +8,68 @@ import socket
 import sys
 from os import path
 from agavecli import auth, clients, files, systems, tenants
+from agavecli.utils import OUTPUT_FORMATS
+
+
+def size(value):
+    """ Parse a number of bytes, with an optional K, M, or G suffix (i.e., 4M)
+    """
+    multipliers = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    multiplier = multipliers.get(value[-1:].upper(), 1)
+    if multiplier != 1:
+        value = value[:-1]
+    try:
+        nbytes = int(float(value) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid size: {0}".format(value))
+    if nbytes <= 0:
+        raise argparse.ArgumentTypeError("size must be positive: {0}".format(value))
+    return nbytes
+
+
+def signed(parse):
+    """ Parse a value with an optional + or - prefix (i.e., +1G) into (sign, value)
+    """
+    def parse_signed(value):
+        sign = value[:1] if value[:1] in ("+", "-") else ""
+        return sign, parse(value[len(sign):])
+    return parse_signed
+
+
+def days(value):
+    """ Parse a number of days
+    """
+    try:
+        ndays = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid number of days: {0}".format(value))
+    if ndays < 0:
+        raise argparse.ArgumentTypeError("number of days must not be negative: {0}".format(value))
+    return ndays
+
+
+def positive_int(value):
+    """ Parse a number that must be at least 1
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid number: {0}".format(value))
+    if number <= 0:
+        raise argparse.ArgumentTypeError("number must be positive: {0}".format(value))
+    return number
+
+
+def non_negative_int(value):
+    """ Parse a number that must be at least 0
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid number: {0}".format(value))
+    if number < 0:
+        raise argparse.ArgumentTypeError("number must not be negative: {0}".format(value))
+    return number
 
 # Parser and subparsers definition.
 parent_parser = argparse.ArgumentParser(add_help=False)
@@ -17,6 +79,16 @@ parent_parser.add_argument(
     default=path.expanduser("~"),
     help="Location of Agave database (only provide the directory). Default to homedir (~/).")
 
+# Options of the commands that list things.
+output_parser = argparse.ArgumentParser(add_help=False)
+output_parser.add_argument(
+    "-o",
+    "--output",
+    choices=OUTPUT_FORMATS,
+    default="table",
+    help="""Print a table for humans (table), or one record per line for other programs,
+    as JSON Lines (jsonl), CSV (csv) or TSV (tsv) (default: table).""")
+
 main_parser = argparse.ArgumentParser()
 
 commands_subparsers = main_parser.add_subparsers(
@@ -52,7 +124,7 @@ tenant_init_parser.add_argument(
 tenant_ls_parser = tenant_action_subparser.add_parser(
     "ls",
     help="List all available tenants from the Agave central database.",
-    parents=[parent_parser])
+    parents=[parent_parser, output_parser])
 
 
 ###############################################################################
@@ -93,7 +165,7 @@ client_create_parser.add_argument(
 client_ls_parser = client_action_subparser.add_parser(
     "ls",
     help="List all Agave clients registered to the authenticated user.",
-    parents=[parent_parser])
+    parents=[parent_parser, output_parser])
 
 
 # client rm command.
@@ -161,7 +233,8 @@ systems_action_subparser = system_command_parser.add_subparsers(
 
 # system ls command.
 system_ls_parser = systems_action_subparser.add_parser(
-    "ls", help="List all Agave systems available to the authenticated user.", parents=[parent_parser])
+    "ls", help="List all Agave systems available to the authenticated user.",
+    parents=[parent_parser, output_parser])
 
 system_ls_parser.add_argument(
     "-s", "--storage",
@@ -195,7 +268,7 @@ fs_action_subparser = fs_command_parser.add_subparsers(
 # fs ls command.
 fs_ls_parser = fs_action_subparser.add_parser(
     "ls", 
-    help="List all files on a remote Agave system.", parents=[parent_parser])
+    help="List all files on a remote Agave system.", parents=[parent_parser, output_parser])
 
 fs_command_parser.add_argument(
     "-e",
@@ -206,6 +279,58 @@ fs_command_parser.add_argument(
 fs_ls_parser.add_argument(
     "-l", dest="long", action="store_true", help="Long format.")
 
+fs_ls_parser.add_argument(
+    "--page-size",
+    dest="page_size",
+    type=positive_int,
+    default=1000,
+    help="""Number of entries requested at a time. Each page is printed as soon as
+    it arrives (default: 1000).""")
+
+fs_ls_parser.add_argument(
+    "-R", "--recursive",
+    action="store_true",
+    help="List subdirectories recursively, breadth first.")
+
+fs_ls_parser.add_argument(
+    "-j", "--jobs",
+    type=positive_int,
+    default=8,
+    help="Number of directories listed concurrently with -R (default: 8).")
+
+fs_ls_parser.add_argument(
+    "--no-cache",
+    dest="use_cache",
+    action="store_false",
+    help="Always ask Agave for the listing, instead of using a recent cached one.")
+
+fs_ls_parser.add_argument(
+    "--cache-ttl",
+    dest="cache_ttl",
+    type=float,
+    default=60,
+    help="Seconds a listing is cached for (default: 60).")
+
+fs_ls_parser.add_argument(
+    "--sort",
+    choices=["name", "size", "mtime"],
+    default=None,
+    help="""Sort entries by name, size (largest first) or modification time (most
+    recent first), instead of printing them in the order of the service.""")
+
+fs_ls_parser.add_argument(
+    "--top",
+    type=positive_int,
+    default=None,
+    help="""Only print the first N entries of the sorted listing (sorted by name
+    unless --sort is given).""")
+
+fs_ls_parser.add_argument(
+    "--checkpoint",
+    default=None,
+    help="""Save the progress of a recursive listing in this file, and resume from it
+    if it exists.""")
+
 fs_ls_parser.add_argument(
     "syspath",
     help="System ID and path (i.e., hpc-stampede2-user/apps).")
@@ -225,6 +350,111 @@ fs_mkdir_parser.add_argument(
     "syspath",
     help="System ID and path (i.e., hpc-stampede2-user/apps creates apps/ dir).")
 
+# fs du command.
+fs_du_parser = fs_action_subparser.add_parser(
+    "du",
+    help="Show the disk usage of a directory tree on a remote Agave system.",
+    parents=[parent_parser, output_parser])
+
+fs_du_parser.add_argument(
+    "-e",
+    "--endpoint",
+    default="files/v2/listings/system",
+    help="Files-listings service endpoint for Agave (default: files/v2/listings/system).")
+
+fs_du_parser.add_argument(
+    "-s", "--summarize",
+    action="store_true",
+    help="Only show the total.")
+
+fs_du_parser.add_argument(
+    "-d", "--max-depth",
+    dest="max_depth",
+    type=non_negative_int,
+    default=None,
+    help="Only show directories this many levels below the path, or less.")
+
+fs_du_parser.add_argument(
+    "-j", "--jobs",
+    type=positive_int,
+    default=8,
+    help="Number of directories listed concurrently (default: 8).")
+
+fs_du_parser.add_argument(
+    "--no-cache",
+    dest="use_cache",
+    action="store_false",
+    help="Always ask Agave for listings, instead of using recent cached ones.")
+
+fs_du_parser.add_argument(
+    "--cache-ttl",
+    dest="cache_ttl",
+    type=float,
+    default=60,
+    help="Seconds listings are cached for (default: 60).")
+
+fs_du_parser.add_argument(
+    "syspath",
+    help="""System ID and path (i.e., hpc-stampede2-user/project or
+    agave://hpc-stampede2-user/project). Sizes are printed in bytes.""")
+
+# fs find command.
+fs_find_parser = fs_action_subparser.add_parser(
+    "find",
+    help="Search for files on a remote Agave system, in a local index.",
+    parents=[parent_parser, output_parser])
+
+fs_find_parser.add_argument(
+    "-e",
+    "--endpoint",
+    default="files/v2/listings/system",
+    help="Files-listings service endpoint for Agave (default: files/v2/listings/system).")
+
+fs_find_parser.add_argument(
+    "-name",
+    dest="name",
+    default=None,
+    help="Name matches this pattern (i.e., '*.nc', quoted so the shell leaves it alone).")
+
+fs_find_parser.add_argument(
+    "-type",
+    dest="entry_type",
+    choices=["f", "d"],
+    default=None,
+    help="Entry is a file (f) or a directory (d).")
+
+fs_find_parser.add_argument(
+    "-size",
+    dest="size",
+    type=signed(size),
+    default=None,
+    help="Size is larger than (+N), smaller than (-N) or exactly N bytes, i.e., +1G.")
+
+fs_find_parser.add_argument(
+    "-mtime",
+    dest="mtime",
+    type=signed(days),
+    default=None,
+    help="""Modified more than (+N), less than (-N) or exactly N days ago,
+    i.e., -7.""")
+
+fs_find_parser.add_argument(
+    "-u", "--update",
+    action="store_true",
+    help="""Refresh the index before searching, listing again only the directories
+    that changed. A tree is indexed the first time it is searched.""")
+
+fs_find_parser.add_argument(
+    "-j", "--jobs",
+    type=positive_int,
+    default=8,
+    help="Number of directories listed concurrently when indexing (default: 8).")
+
+fs_find_parser.add_argument(
+    "syspath",
+    help="""System ID and path to search under (i.e., hpc-stampede2-user/project or
+    agave://hpc-stampede2-user/project).""")
+
 # fs rm command.
 fs_rm_parser = fs_action_subparser.add_parser(
     "rm",
@@ -251,18 +481,192 @@ fs_cp_parser.add_argument(
     default="files/v2/media/system",
     help="Files-media service endpoint for Agave (default: files/v2/media/system).")
 
+fs_cp_parser.add_argument(
+    "-L",
+    "--listings-endpoint",
+    dest="listings_endpoint",
+    default="files/v2/listings/system",
+    help="Files-listings service endpoint for Agave (default: files/v2/listings/system).")
+
+fs_cp_parser.add_argument(
+    "-m", "--mode",
+    choices=["stream", "tempfile", "import"],
+    default="stream",
+    help="""How to copy files between remote systems: pipe the download into the
+    upload through memory (stream), download to a temporary file first
+    (tempfile), or have Agave import the file into the destination system
+    (import) (default: stream).""")
+
+fs_cp_parser.add_argument(
+    "-H",
+    "--history-endpoint",
+    dest="history_endpoint",
+    default="files/v2/history/system",
+    help="Files-history service endpoint for Agave, used to follow imports (default: files/v2/history/system).")
+
+fs_cp_parser.add_argument(
+    "--poll-interval",
+    dest="poll_interval",
+    type=float,
+    default=5,
+    help="Seconds between checks on the status of an import (default: 5).")
+
+fs_cp_parser.add_argument(
+    "-c", "--continue",
+    dest="resume",
+    action="store_true",
+    help="Resume interrupted downloads instead of starting them over.")
+
+fs_cp_parser.add_argument(
+    "-s", "--segments",
+    type=positive_int,
+    default=1,
+    help="""Download a large file in this many byte ranges at once, over
+    separate connections (default: 1).""")
+
+fs_cp_parser.add_argument(
+    "--chunk-size",
+    dest="chunk_size",
+    type=size,
+    default=1024 * 1024,
+    help="Number of bytes read and written at a time, i.e., 4M (default: 1M).")
+
+fs_cp_parser.add_argument(
+    "--limit-rate",
+    dest="limit_rate",
+    type=size,
+    default=None,
+    help="""Limit the bandwidth used by all transfers together to this many bytes
+    per second, i.e., 500K or 10M (default: no limit).""")
+
+fs_cp_parser.add_argument(
+    "--verify",
+    action="store_true",
+    help="""Check the checksum of copied files against the checksum reported by
+    the files service, when there is one.""")
+
+fs_cp_parser.add_argument(
+    "-b", "--bundle",
+    choices=["tar", "gzip", "zstd"],
+    default=None,
+    help="""Upload a local directory as a single archive of this format, made on
+    the fly (i.e., dir.tar.gz), or unpack a remote archive of this format
+    into a local directory as it is downloaded. Much faster than copying
+    many small files one by one (zstd needs the zstandard package).""")
+
+fs_cp_parser.add_argument(
+    "-f", "--from-file",
+    dest="manifest",
+    help="""Copy every origin and destination pair listed in this file (one pair
+    per line, separated by a tab, '-' to read from stdin) instead of the
+    ones given as arguments.""")
+
+fs_cp_parser.add_argument(
+    "--retries",
+    type=non_negative_int,
+    default=3,
+    help="Number of times to retry a failed copy listed in a --from-file manifest (default: 3).")
+
+fs_cp_parser.add_argument(
+    "-r", "--recursive",
+    action="store_true",
+    help="Copy directories recursively.")
+
+fs_cp_parser.add_argument(
+    "-j", "--jobs",
+    type=positive_int,
+    default=4,
+    help="Number of files to transfer concurrently (default: 4).")
+
 fs_cp_parser.add_argument(
     "origin",
-    help="File to be copied. Use the prefix 'agave://' if moving files within Agave.")
+    nargs="?",
+    help="""File to be copied. Use the prefix 'agave://' if moving files within Agave.
+    Remote files may be selected with wildcards in the last component of the
+    path (i.e., 'agave://system/run42/*.h5', quoted so the shell leaves it
+    alone), they are then copied into the destination directory.""")
 
 fs_cp_parser.add_argument(
     "destination",
+    nargs="?",
     help="""Path to copy file to. Use the prefix 'agave://' if moving files within Agave. 
     
     To move a file from a directory to another do: ... cp /path/file.ext /newpath/ 
     (notice the destination ends with a forwards slash to denote a directory).
 
     To move a file from a directory and give it a new name: ... cp /path/file.ext /newpath/newname.ext
+
+    To copy a directory into another one do: ... cp -r /path/dir /newpath/
+    (the copy is made in /newpath/dir/).
+    """)
+
+# fs sync command.
+fs_sync_parser = fs_action_subparser.add_parser(
+    "sync",
+    help="Mirror a directory to or from a remote Agave system.", parents=[parent_parser])
+
+fs_sync_parser.add_argument(
+    "-e",
+    "--endpoint",
+    default="files/v2/media/system",
+    help="Files-media service endpoint for Agave (default: files/v2/media/system).")
+
+fs_sync_parser.add_argument(
+    "-L",
+    "--listings-endpoint",
+    dest="listings_endpoint",
+    default="files/v2/listings/system",
+    help="Files-listings service endpoint for Agave (default: files/v2/listings/system).")
+
+fs_sync_parser.add_argument(
+    "--delete",
+    action="store_true",
+    help="Delete files and directories from the destination that are not in the origin.")
+
+fs_sync_parser.add_argument(
+    "-n", "--dry-run",
+    dest="dry_run",
+    action="store_true",
+    help="Print what would be done, without doing it.")
+
+fs_sync_parser.add_argument(
+    "--chunk-size",
+    dest="chunk_size",
+    type=size,
+    default=1024 * 1024,
+    help="Number of bytes read and written at a time, i.e., 4M (default: 1M).")
+
+fs_sync_parser.add_argument(
+    "--limit-rate",
+    dest="limit_rate",
+    type=size,
+    default=None,
+    help="""Limit the bandwidth used by all transfers together to this many bytes
+    per second, i.e., 500K or 10M (default: no limit).""")
+
+fs_sync_parser.add_argument(
+    "--verify",
+    action="store_true",
+    help="""Also copy files whose checksum differs from the checksum reported by
+    the files service, and check the checksum of copied files.""")
+
+fs_sync_parser.add_argument(
+    "-j", "--jobs",
+    type=positive_int,
+    default=4,
+    help="Number of files to transfer concurrently (default: 4).")
+
+fs_sync_parser.add_argument(
+    "origin",
+    help="Directory to mirror. Use the prefix 'agave://' for a remote directory.")
+
+fs_sync_parser.add_argument(
+    "destination",
+    help="""Directory to update. Use the prefix 'agave://' for a remote directory.
+
+    Exactly one of origin and destination has to be remote. The contents of
+    origin are mirrored into destination: files that are missing, differ in
+    size, or are older than in origin are copied.
     """)
 
 
@@ -293,7 +697,8 @@ def main(args=None):
             tenants.tenant_init(hosturl, tenant_name, agavedb)
         # tenant ls command.
         elif args.tenant_actioncmd == "ls":
-            tenants.tenant_list(hosturl)
+            output = args.output
+            tenants.tenant_list(hosturl, output)
     # client command.
     elif args.commands_cmd == "client":
         # client create command.
@@ -303,7 +708,8 @@ def main(args=None):
             clients.client_create(agavedb, endpoint, client_name, description)
         # client ls command.
         elif args.client_actioncmd == "ls":
-            clients.client_list(agavedb, endpoint)
+            output = args.output
+            clients.client_list(agavedb, endpoint, output)
         # client rm command.
         elif args.client_actioncmd == "rm":
             client_name = args.client_name
@@ -321,27 +727,115 @@ def main(args=None):
         if args.systems_actioncmd == "ls":
             print_execution = args.execution
             print_storage   = args.storage
-            systems.system_list(agavedb, endpoint, token_endpoint, print_execution, print_storage)
+            output          = args.output
+            systems.system_list(agavedb, endpoint, token_endpoint, print_execution, print_storage,
+                                output)
     # fs command.
     elif args.commands_cmd == "fs":
         # fs ls command.
         if args.fs_actioncmd == "ls":
             syspath     = args.syspath
             long_format = args.long
-            files.files_list(agavedb, token_endpoint, endpoint, syspath, long_format)
+            page_size   = args.page_size
+            recursive   = args.recursive
+            jobs        = args.jobs
+            checkpoint  = args.checkpoint
+            use_cache   = args.use_cache
+            cache_ttl   = args.cache_ttl
+            sort        = args.sort
+            top         = args.top
+            output      = args.output
+            files.files_list(agavedb, token_endpoint, endpoint, syspath, long_format,
+                             page_size, recursive, jobs, checkpoint, use_cache, cache_ttl,
+                             sort, top, output)
+        # fs du command.
+        elif args.fs_actioncmd == "du":
+            syspath     = args.syspath
+            summarize   = args.summarize
+            max_depth   = args.max_depth
+            jobs        = args.jobs
+            use_cache   = args.use_cache
+            cache_ttl   = args.cache_ttl
+            output      = args.output
+            files.files_du(agavedb, token_endpoint, endpoint, syspath, summarize, max_depth,
+                           jobs, use_cache, cache_ttl, output)
+        # fs find command.
+        elif args.fs_actioncmd == "find":
+            syspath     = args.syspath
+            name        = args.name
+            entry_type  = {"f": "file", "d": "dir", None: None}[args.entry_type]
+            size_test   = args.size
+            mtime_test  = args.mtime
+            update      = args.update
+            jobs        = args.jobs
+            output      = args.output
+            files.files_find(agavedb, token_endpoint, endpoint, syspath, name, entry_type,
+                             size_test, mtime_test, update, jobs, output)
         # fs mkdir command.
         elif args.fs_actioncmd == "mkdir":
             syspath = args.syspath
-            files.files_mkdir(agavedb, token_endpoint, endpoint, syspath)
+            try:
+                files.files_mkdir(agavedb, token_endpoint, endpoint, syspath)
+            finally:
+                files.invalidate_listings(agavedb, syspath)
         # fs rm command.
         elif args.fs_actioncmd == "rm":
             syspath = args.syspath
-            files.files_remove(agavedb, token_endpoint, endpoint, syspath)
+            try:
+                files.files_remove(agavedb, token_endpoint, endpoint, syspath)
+            finally:
+                files.invalidate_listings(agavedb, syspath)
         # fs cp command.
         elif args.fs_actioncmd == "cp":
             origin      = args.origin
             destination = args.destination
-            files.files_copy(agavedb, token_endpoint, endpoint, origin, destination)
+            recursive   = args.recursive
+            jobs        = args.jobs
+            listings_endpoint = args.listings_endpoint
+            mode        = args.mode
+            history_endpoint = args.history_endpoint
+            poll_interval    = args.poll_interval
+            resume      = args.resume
+            segments    = args.segments
+            chunk_size  = args.chunk_size
+            verify      = args.verify
+            limit_rate  = args.limit_rate
+            manifest    = args.manifest
+            retries     = args.retries
+            bundle      = args.bundle
+            if manifest is not None:
+                files.files_copy_manifest(agavedb, token_endpoint, endpoint, manifest, jobs,
+                                          retries, mode, history_endpoint, poll_interval,
+                                          chunk_size, verify, limit_rate)
+            elif origin is None or destination is None:
+                fs_cp_parser.error("origin and destination are required (or use --from-file)")
+            else:
+                try:
+                    files.files_copy(agavedb, token_endpoint, endpoint, origin, destination,
+                                     recursive, jobs, listings_endpoint, mode,
+                                     history_endpoint, poll_interval, resume, segments,
+                                     chunk_size, verify, limit_rate, bundle)
+                finally:
+                    if "agave://" in destination[:8]:
+                        files.invalidate_listings(agavedb, destination)
+        # fs sync command.
+        elif args.fs_actioncmd == "sync":
+            origin      = args.origin
+            destination = args.destination
+            listings_endpoint = args.listings_endpoint
+            delete      = args.delete
+            dry_run     = args.dry_run
+            jobs        = args.jobs
+            chunk_size  = args.chunk_size
+            verify      = args.verify
+            limit_rate  = args.limit_rate
+            try:
+                files.files_sync(agavedb, token_endpoint, endpoint, origin, destination,
+                                 listings_endpoint, delete, dry_run, jobs, chunk_size, verify,
+                                 limit_rate)
+            finally:
+                if "agave://" in destination[:8] and not dry_run:
+                    files.invalidate_listings(agavedb, destination)
 
 if __name__ == "__main__":
     args = main_parser.parse_args()
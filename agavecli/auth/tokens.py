@@ -8,7 +8,8 @@ import requests
 import sys
 import time
 from os import path
-from ..utils import get_access_token, get_agave_context, handle_bad_response_status_code
+from ..utils import AgaveClient, get_agave_context, handle_bad_response_status_code, \
+        save_agave_context
 
 
 
@@ -29,8 +30,8 @@ def token_create(agavedb, endpoint):
         key      = agave_context["current"]["apikey"]
         secret   = agave_context["current"]["apisecret"] 
         params   = {"pretty": "true"}
-        endpoint = "{0}{1}".format(agave_context["current"]["baseurl"], endpoint)
-        resp = requests.post(endpoint, data=data, params=params, auth=(key, secret))
+        client   = AgaveClient(agave_context["current"]["baseurl"])
+        resp = client.post(endpoint, data=data, params=params, auth=(key, secret))
     except requests.exceptions.MissingSchema as err:
         print(err, file=sys.stderr)
         sys.exit(1)
@@ -48,8 +49,7 @@ def token_create(agavedb, endpoint):
     agave_context["current"]["expires_at"] = time.strftime("%a %b %-d %H:%M:%S %Z %Y", time.localtime(expires_at))
 
     # Save data to Agave database.
-    with open("{}/agave.json".format(agavedb), "w") as f:
-        json.dump(agave_context, f, sort_keys=True, indent=4)
+    save_agave_context(agavedb, agave_context)
 
 
 
@@ -75,8 +75,8 @@ def token_refresh(agavedb, endpoint):
         }
         key = agave_context["current"]["apikey"]
         secret = agave_context["current"]["apisecret"]
-        endpoint = "{0}{1}".format(agave_context["current"]["baseurl"], endpoint)
-        resp = requests.post(endpoint, data=data, auth=(key, secret))
+        client = AgaveClient(agave_context["current"]["baseurl"])
+        resp = client.post(endpoint, data=data, auth=(key, secret))
     except requests.exceptions.MissingSchema as err:
         print(err, file=sys.stderr)
         sys.exit(1)
@@ -94,5 +94,4 @@ def token_refresh(agavedb, endpoint):
     agave_context["current"]["expires_at"] = time.strftime("%a %b %-d %H:%M:%S %Z %Y", time.localtime(expires_at))
 
     # Save data to Agave database.
-    with open("{}/agave.json".format(agavedb), "w") as f:
-        json.dump(agave_context, f, sort_keys=True, indent=4)
+    save_agave_context(agavedb, agave_context)
@@ -8,7 +8,12 @@ import json
 import requests
 import sys
 from os import path
-from ..utils import get_agave_context, handle_bad_response_status_code
+from ..utils import AgaveClient, BufferedWriter, RecordFormatter, get_agave_context, \
+        handle_bad_response_status_code, save_agave_context
+
+
+# Fields of the clients printed by "client ls --output jsonl|csv|tsv".
+client_fields = ["name", "description"]
 
 
 
@@ -34,8 +39,8 @@ def client_create(agavedb, endpoint, client_name, description):
             "tier": "Unlimited",
             "callbackUrl": "",
         }
-        endpoint = "{0}{1}".format(agave_context["current"]["baseurl"], endpoint)
-        resp = requests.post(endpoint, data=data, auth=(username, passwd))
+        client = AgaveClient(agave_context["current"]["baseurl"])
+        resp = client.post(endpoint, data=data, auth=(username, passwd))
     except requests.exceptions.MissingSchema as err:
         print(err, file=sys.stderr)
         sys.exit(1)
@@ -54,8 +59,7 @@ def client_create(agavedb, endpoint, client_name, description):
     agave_context["current"]["expires_in"] = ""
 
     # Save data to Agave database.
-    with open("{}/agave.json".format(agavedb), "w") as f:
-        json.dump(agave_context, f, sort_keys=True, indent=4)
+    save_agave_context(agavedb, agave_context)
 
 
 
@@ -72,8 +76,8 @@ def client_delete(agavedb, endpoint, client_name):
             username = input("API username: ")
         passwd = getpass.getpass(prompt="API password: ")
         
-        endpoint = "{0}{1}/{2}".format(agave_context["current"]["baseurl"], endpoint, client_name)
-        resp = requests.delete(endpoint, auth=(username, passwd))
+        client = AgaveClient(agave_context["current"]["baseurl"])
+        resp = client.delete(endpoint, client_name, auth=(username, passwd))
     except requests.exceptions.MissingSchema as err:
         print(err, file=sys.stderr)
         sys.exit(1)
@@ -86,15 +90,16 @@ def client_delete(agavedb, endpoint, client_name):
     agave_context["current"]["apisecret"] = ""
 
     # Save data to Agave database.
-    with open("{}/agave.json".format(agavedb), "w") as f:
-        json.dump(agave_context, f, sort_keys=True, indent=4)
+    save_agave_context(agavedb, agave_context)
 
 
 
-def client_list(agavedb, endpoint):
+def client_list(agavedb, endpoint, output="table"):
     """ List API clients
 
-    List all Agave API clients registered with the current tenant.
+    List all Agave API clients registered with the current tenant. With
+    "output" set to "jsonl", "csv" or "tsv", the fields in client_fields are
+    printed as records (see RecordFormatter).
     """
     # Get baseurl for tenant.
     agave_context = get_agave_context(agavedb)
@@ -106,8 +111,8 @@ def client_list(agavedb, endpoint):
             username = input("API username: ")
         passwd = getpass.getpass(prompt="API password: ")
 
-        endpoint = "{0}{1}".format(agave_context["current"]["baseurl"], endpoint)
-        resp = requests.get(endpoint, auth=(username, passwd))
+        client = AgaveClient(agave_context["current"]["baseurl"])
+        resp = client.get(endpoint, auth=(username, passwd))
     except requests.exceptions.MissingSchema as err:
         print(err, file=sys.stderr)
         sys.exit(1)
@@ -116,6 +121,13 @@ def client_list(agavedb, endpoint):
     handle_bad_response_status_code(resp)
 
     # Print results.
+    if output != "table":
+        formatter = RecordFormatter(output, client_fields)
+        with BufferedWriter() as out:
+            out.write(formatter.format_page(resp.json()["result"]))
+            out.write(formatter.finish())
+        return
+
     print("{0:<30} {1:<80}".format("NAME", "DESCRIPTION"))
     for client in resp.json()["result"]:
         description = client["description"] if client["description"] else ""
@@ -1,3 +1,8 @@
 from .directories import files_mkdir
 from .files import files_list, files_remove
 from .copy import files_copy
+from .batch import files_copy_manifest
+from .sync import files_sync
+from .usage import files_du
+from .index import files_find
+from .listcache import invalidate_listings
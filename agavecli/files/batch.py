@@ -0,0 +1,204 @@
+"""
+    batch.py
+"""
+from __future__ import print_function
+import os
+import sys
+import threading
+from os import path
+from ..utils import get_agave_client
+from .checksums import get_checksum_cache
+from .listcache import invalidate_listings
+from .copy import copy_via_tempfile, download_file, import_remote_to_remote, split_agave_uri, \
+        stream_remote_to_remote, upload_file
+from .ratelimit import RateLimiter
+from .streams import DEFAULT_CHUNK_SIZE
+from .transfers import DEFAULT_JOBS, DEFAULT_RETRIES, DEFAULT_RETRY_DELAY, TransferOptions, \
+        TransferReport, retrying, run_transfers
+
+
+_print_lock = threading.Lock()
+
+
+def print_status(message, file=None):
+    """ Print a status line (lines printed by concurrent transfers do not mix)
+    """
+    file = file or sys.stdout
+    with _print_lock:
+        print(message, file=file)
+        file.flush()
+
+
+
+class ManifestReport(TransferReport):
+    """ Transfer report printing the status of every item as it completes
+    """
+
+    def record(self, name, error=None):
+        super(ManifestReport, self).record(name, error)
+        if error is None:
+            print_status("ok      {0}".format(name))
+        else:
+            print_status("failed  {0}: {1}".format(name, error))
+
+
+
+def read_manifest(f):
+    """ Read (origin, destination) pairs from a manifest
+
+    Each line holds an origin and a destination separated by a tab, in the
+    same form as the arguments of "fs cp". Blank lines and lines starting
+    with "#" are skipped.
+
+    RETURNS
+    -------
+    pairs : generator
+        (line number, origin, destination) tuples. Origin and destination
+        are None if the line is malformed.
+    """
+    for number, line in enumerate(f, 1):
+        line = line.rstrip("\r\n")
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        fields = line.split("\t")
+        if len(fields) != 2 or not fields[0] or not fields[1]:
+            yield number, None, None
+        else:
+            yield number, fields[0], fields[1]
+
+
+
+def download_into(client, endpoint, agave_system, remote_path, local_path, params,
+                  options=None):
+    """ Download a file, making the directory it goes into if needed
+    """
+    local_dir = path.dirname(local_path)
+    if local_dir and not path.isdir(local_dir):
+        try:
+            os.makedirs(local_dir)
+        except OSError:
+            # Made by a concurrent download.
+            if not path.isdir(local_dir):
+                raise
+    download_file(client, endpoint, agave_system, remote_path, local_path, params, options)
+
+
+
+def plan_copy(origin, destination, client, endpoint, params, mode="stream",
+              history_endpoint="files/v2/history/system", poll_interval=5, options=None):
+    """ Work out how to copy a single file
+
+    Origin and destination follow the conventions of "fs cp": a destination
+    ending in "/" (or an existing local directory) gets a file of the same
+    name as the origin.
+
+    RETURNS
+    -------
+    function, args : tuple
+        Calling function(*args) copies the file.
+
+    Raise ValueError if the copy is not possible (local to local).
+    """
+    origin_remote = "agave://" in origin[:8]
+    destination_remote = "agave://" in destination[:8]
+    if not origin_remote and not destination_remote:
+        raise ValueError("Local to local copies are not supported")
+
+    if origin_remote:
+        origin_system, origin_path = split_agave_uri(origin)
+        origin_path = origin_path.strip("/")
+        origin_name = origin_path.split("/")[-1]
+    else:
+        origin_name = path.basename(origin)
+
+    if not destination_remote:
+        local_path = destination
+        if destination.endswith(("/", os.sep)) or path.isdir(destination):
+            local_path = path.join(destination, origin_name)
+        return download_into, (client, endpoint, origin_system, origin_path, local_path,
+                               params, options)
+
+    destination_system, destination_path = split_agave_uri(destination)
+    destination_dir, _, filename = destination_path.rpartition("/")
+    destination_dir = destination_dir.strip("/")
+    filename = filename or origin_name
+
+    if not origin_remote:
+        return upload_file, (client, endpoint, origin, destination_system, destination_dir,
+                             params, options, filename)
+    if mode == "import":
+        return import_remote_to_remote, (client, endpoint, history_endpoint, origin,
+                                         destination_system, destination_dir, filename, params,
+                                         poll_interval)
+    if mode == "tempfile":
+        return copy_via_tempfile, (client, endpoint, origin_system, origin_path,
+                                   destination_system, destination_dir, params, options,
+                                   filename)
+    return stream_remote_to_remote, (client, endpoint, origin_system, origin_path,
+                                     destination_system, destination_dir, filename, params,
+                                     options)
+
+
+
+def files_copy_manifest(agavedb, token_endpoint, endpoint, manifest, jobs=DEFAULT_JOBS,
+                        retries=DEFAULT_RETRIES, mode="stream",
+                        history_endpoint="files/v2/history/system", poll_interval=5,
+                        chunk_size=DEFAULT_CHUNK_SIZE, verify=False, limit_rate=None,
+                        retry_delay=DEFAULT_RETRY_DELAY):
+    """ Copy every (origin, destination) pair listed in a manifest
+
+    The manifest (a file, "-" for stdin) is read as it goes (see
+    read_manifest) and the copies are run by a pool of "jobs" workers, in a
+    single process. Failed copies are tried again up to "retries" times,
+    waiting "retry_delay" seconds (doubled at each retry) in between, unless
+    the server rejected them for good. The outcome of every copy is printed
+    as it completes, failures do not stop the batch. Cached listings of the
+    remote destinations are invalidated at the end.
+    """
+    # Get an authenticated client for the current tenant.
+    client = get_agave_client(agavedb, token_endpoint, pool_maxsize=jobs)
+
+    params  = {"pretty": "true"}
+    rate_limiter = RateLimiter(limit_rate) if limit_rate else None
+    options = TransferOptions(chunk_size, get_checksum_cache(agavedb), verify, rate_limiter)
+    report  = ManifestReport()
+    # Remote destinations, to invalidate their cached listings.
+    destinations = set()
+
+    def transfers(f):
+        for number, origin, destination in read_manifest(f):
+            if origin is None:
+                report.record("{0}, line {1}".format(manifest, number),
+                              ValueError("expected <origin><TAB><destination>"))
+                continue
+
+            name = "{0} -> {1}".format(origin, destination)
+            if "agave://" in destination[:8]:
+                destinations.add(destination)
+            try:
+                function, args = plan_copy(origin, destination, client, endpoint, params, mode,
+                                           history_endpoint, poll_interval, options)
+            except ValueError as err:
+                report.record(name, err)
+                continue
+
+            def on_retry(attempt, err, name=name):
+                print_status("retry {0}  {1}: {2}".format(attempt, name, err), file=sys.stderr)
+
+            yield name, retrying(function, retries, retry_delay, on_retry), args
+
+    try:
+        if manifest == "-":
+            run_transfers(transfers(sys.stdin), jobs, report)
+        else:
+            with open(manifest, "r") as f:
+                run_transfers(transfers(f), jobs, report)
+    except IOError as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        invalidate_listings(agavedb, *destinations)
+
+    report.print_summary()
+    if not report.ok:
+        sys.exit(1)
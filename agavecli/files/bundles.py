@@ -0,0 +1,217 @@
+"""
+    bundles.py
+"""
+from __future__ import print_function
+import os
+import stat
+import tarfile
+import zlib
+from os import path
+from .checksums import response_checksum
+from .ratelimit import iter_limited
+from .streams import DEFAULT_CHUNK_SIZE, MultipartStream, iter_hashed
+from .transfers import TransferOptions
+try:
+    import zstandard
+except ImportError: # zstd bundles are optional
+    zstandard = None
+
+
+# Compression of bundles, and the extension of the archive uploaded.
+bundle_extensions = {
+    "tar": ".tar",
+    "gzip": ".tar.gz",
+    "zstd": ".tar.zst",
+}
+
+
+
+def check_bundle_format(bundle):
+    """ Raise ValueError if bundles of this format cannot be made here
+    """
+    if bundle not in bundle_extensions:
+        raise ValueError("Unknown bundle format {0}".format(bundle))
+    if bundle == "zstd" and zstandard is None:
+        raise ValueError("zstd bundles need the zstandard package (pip install zstandard)")
+
+
+
+def iter_tar(root, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Generate a tar archive of a directory tree
+
+    The archive is produced as it is read: a header is made for every
+    directory and file found walking "root" and the contents of files follow
+    "chunk_size" bytes at a time, so that the tree never has to be archived
+    to disk nor held in memory. Members are named relative to the parent of
+    "root" (i.e., "root/sub/file").
+
+    Raise IOError if a file shrinks while it is archived.
+    """
+    root = root.rstrip(os.sep) or os.sep
+    base = path.dirname(root)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        names = [dirpath] + [path.join(dirpath, f) for f in sorted(filenames)]
+        for local_path in names:
+            info = os.stat(local_path)
+            member = tarfile.TarInfo(path.relpath(local_path, base).replace(os.sep, "/"))
+            member.mode = stat.S_IMODE(info.st_mode)
+            member.mtime = int(info.st_mtime)
+            if stat.S_ISDIR(info.st_mode):
+                member.type = tarfile.DIRTYPE
+                yield member.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+                continue
+
+            member.size = info.st_size
+            yield member.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+            remaining = member.size
+            with open(local_path, "rb") as f:
+                while remaining > 0:
+                    chunk = f.read(min(chunk_size, remaining))
+                    if not chunk:
+                        raise IOError("{0} shrank while it was bundled".format(local_path))
+                    remaining -= len(chunk)
+                    yield chunk
+
+            padding = -member.size % tarfile.BLOCKSIZE
+            if padding:
+                yield tarfile.NUL * padding
+
+    # End of archive: two empty blocks, padded to a full record.
+    yield tarfile.NUL * tarfile.RECORDSIZE
+
+
+
+def iter_compressed(chunks, bundle):
+    """ Compress chunks on the fly into the format of a bundle
+    """
+    if bundle == "tar":
+        for chunk in chunks:
+            yield chunk
+        return
+
+    if bundle == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    else:
+        compressor = zstandard.ZstdCompressor().compressobj()
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+
+def upload_bundle(client, endpoint, local_dir, agave_system, remote_dir, filename, params,
+                  bundle="tar", options=None):
+    """ Upload a local directory tree as a single archive
+
+    The archive (see iter_tar), compressed according to "bundle", is
+    streamed straight into the upload with chunked transfer encoding, so a
+    tree of many small files takes one request and no temporary file.
+
+    Raise requests.exceptions.HTTPError if the upload is rejected and
+    IOError if the checksum of the uploaded archive does not match.
+    """
+    options = options or TransferOptions()
+    hasher = options.hasher()
+    chunks = iter_hashed(iter_compressed(iter_tar(local_dir, options.chunk_size), bundle),
+                         hasher)
+    if options.rate_limiter is not None:
+        chunks = iter_limited(chunks, options.rate_limiter)
+    body = MultipartStream("fileToUpload", filename, chunks)
+    resp = client.post(endpoint, agave_system, remote_dir,
+                       data=body, headers=body.headers, params=params)
+    resp.raise_for_status()
+    remote_path = "/".join(filter(None, [remote_dir, filename]))
+    options.record_checksum("agave://{0}/{1}".format(agave_system, remote_path), hasher,
+                            response_checksum(resp, options.algorithm))
+    return resp
+
+
+
+class ResponseReader(object):
+    """ File-like reader over the raw body of a streamed response
+
+    The data read is checksummed with "hasher" and paced by "limiter", if
+    given.
+    """
+
+    def __init__(self, resp, hasher=None, limiter=None):
+        self._raw = resp.raw
+        self._hasher = hasher
+        self._limiter = limiter
+
+    def read(self, size=-1):
+        data = self._raw.read(None if size is None or size < 0 else size,
+                              decode_content=True)
+        if self._hasher is not None:
+            self._hasher.update(data)
+        if self._limiter is not None:
+            self._limiter.consume(len(data))
+        return data
+
+
+
+def check_member(member, local_dir):
+    """ Raise IOError if extracting an archive member would be unsafe
+
+    Members must be plain files or directories that land inside
+    "local_dir".
+    """
+    if not (member.isfile() or member.isdir()):
+        raise IOError("Refusing to unpack {0}: not a file or directory".format(member.name))
+    target = path.realpath(path.join(local_dir, member.name))
+    root = path.realpath(local_dir)
+    if path.isabs(member.name) or not (target == root or target.startswith(root + os.sep)):
+        raise IOError("Refusing to unpack {0}: outside of {1}".format(member.name, local_dir))
+
+
+
+def download_bundle(client, endpoint, agave_system, remote_path, local_dir, params,
+                    bundle="tar", options=None):
+    """ Unpack a remote archive into a local directory as it is downloaded
+
+    The archive, compressed according to "bundle", is read and unpacked
+    sequentially from the response, so it is never stored locally. Only
+    files and directories are unpacked, and only inside "local_dir".
+
+    RETURNS
+    -------
+    count : int
+        Number of members unpacked.
+
+    Raise requests.exceptions.HTTPError if the download is rejected and
+    IOError if the archive is corrupt, unsafe or its checksum does not
+    match.
+    """
+    options = options or TransferOptions()
+    hasher = options.hasher()
+    resp = client.get(endpoint, agave_system, remote_path, params=params, stream=True)
+    try:
+        resp.raise_for_status()
+        if not path.isdir(local_dir):
+            os.makedirs(local_dir)
+
+        reader = ResponseReader(resp, hasher, options.rate_limiter)
+        mode = "r|gz" if bundle == "gzip" else "r|"
+        if bundle == "zstd":
+            reader = zstandard.ZstdDecompressor().stream_reader(reader)
+
+        count = 0
+        try:
+            with tarfile.open(fileobj=reader, mode=mode) as tar:
+                if hasattr(tarfile, "data_filter"):
+                    tar.extraction_filter = tarfile.data_filter
+                for member in tar:
+                    check_member(member, local_dir)
+                    tar.extract(member, local_dir)
+                    count += 1
+        except (tarfile.TarError, zlib.error) as err:
+            raise IOError("Cannot unpack agave://{0}/{1}: {2}".format(
+                agave_system, remote_path, err))
+    finally:
+        resp.close()
+
+    options.record_checksum("agave://{0}/{1}".format(agave_system, remote_path), hasher)
+    return count
@@ -0,0 +1,159 @@
+"""
+    checksums.py
+"""
+from __future__ import print_function
+import hashlib
+import os
+from os import path
+from ..utils import SQLiteStore
+from .streams import DEFAULT_CHUNK_SIZE, iter_file
+
+
+# Hash computed over the data of every transfer.
+DEFAULT_CHECKSUM_ALGORITHM = "sha256"
+
+# Name of the checksum cache, kept next to the local Agave database.
+CHECKSUM_CACHE_FILE = "checksums.db"
+
+
+
+class ChecksumCache(SQLiteStore):
+    """ Checksums of local files, keyed by path, size and modification time
+
+    Checksums are stored in an SQLite database so that files which have not
+    changed since they were last transferred (same size and modification
+    time) never have to be read again to be verified. The cache can be
+    shared by concurrent transfers.
+
+    PARAMETERS
+    ----------
+    db_path : str
+        Location of the database (created if it does not exist).
+    """
+
+    schema = ("""CREATE TABLE IF NOT EXISTS checksums (
+                path TEXT NOT NULL,
+                algorithm TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                digest TEXT NOT NULL,
+                PRIMARY KEY (path, algorithm))""",)
+
+    def get(self, local_path, size, mtime, algorithm=DEFAULT_CHECKSUM_ALGORITHM):
+        """ Get the checksum of a file, None if it is not cached
+
+        A checksum computed when the file had another size or modification
+        time is not returned.
+        """
+        row = self.fetchone(
+            "SELECT size, mtime, digest FROM checksums WHERE path = ? AND algorithm = ?",
+            (path.abspath(local_path), algorithm))
+        if row is None or row[0] != size or row[1] != mtime:
+            return None
+        return row[2]
+
+    def put(self, local_path, size, mtime, digest, algorithm=DEFAULT_CHECKSUM_ALGORITHM):
+        """ Cache the checksum of a file, replacing any previous one
+        """
+        with self.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?)",
+                (path.abspath(local_path), algorithm, size, mtime, digest))
+
+    def put_file(self, local_path, digest, algorithm=DEFAULT_CHECKSUM_ALGORITHM, stat=None):
+        """ Cache the checksum of a file as it is now (or as it was at "stat")
+        """
+        stat = stat or os.stat(local_path)
+        self.put(local_path, stat.st_size, stat.st_mtime, digest, algorithm)
+
+
+
+def get_checksum_cache(agavedb):
+    """ Open the checksum cache kept in the local Agave database directory
+    """
+    return ChecksumCache(path.join(agavedb, CHECKSUM_CACHE_FILE))
+
+
+
+def file_checksum(local_path, cache=None, algorithm=DEFAULT_CHECKSUM_ALGORITHM,
+                  chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Get the checksum of a local file
+
+    The file is only read if its checksum is not cached (the checksum is
+    then cached).
+
+    RETURNS
+    -------
+    digest : str
+        Hex digest of the file's contents.
+    """
+    stat = os.stat(local_path)
+    if cache is not None:
+        digest = cache.get(local_path, stat.st_size, stat.st_mtime, algorithm)
+        if digest is not None:
+            return digest
+
+    hasher = hashlib.new(algorithm)
+    with open(local_path, "rb") as f:
+        for chunk in iter_file(f, chunk_size):
+            hasher.update(chunk)
+    digest = hasher.hexdigest()
+
+    if cache is not None:
+        cache.put_file(local_path, digest, algorithm, stat)
+    return digest
+
+
+
+def remote_checksum(entry, algorithm=DEFAULT_CHECKSUM_ALGORITHM):
+    """ Get the checksum of a remote file from its listing entry
+
+    The checksum may be given as a bare hex digest or prefixed with the
+    name of its algorithm (i.e., "sha256:9f86d0..."). Checksums computed
+    with another algorithm are ignored.
+
+    RETURNS
+    -------
+    digest : str
+        Hex digest, None if the entry has no usable checksum.
+    """
+    value = (entry or {}).get("checksum")
+    if not value:
+        return None
+
+    if ":" in value:
+        value_algorithm, _, value = value.partition(":")
+        if value_algorithm.lower().replace("-", "") != algorithm:
+            return None
+    elif len(value) != 2 * hashlib.new(algorithm).digest_size:
+        return None
+    return value.lower()
+
+
+
+def check_checksum(name, digest, expected):
+    """ Check the checksum of transferred data against the remote one
+
+    Nothing is checked if there is no remote checksum (expected is None).
+
+    Raise IOError if the checksums differ.
+    """
+    if expected is not None and digest != expected:
+        raise IOError("Checksum mismatch for {0}: {1} (transferred) != {2} (remote)".format(
+            name, digest, expected))
+
+
+
+def response_checksum(resp, algorithm=DEFAULT_CHECKSUM_ALGORITHM):
+    """ Get the checksum of an uploaded file from the upload response
+
+    RETURNS
+    -------
+    digest : str
+        Hex digest, None if the response has no usable checksum.
+    """
+    try:
+        result = resp.json().get("result")
+    except ValueError:
+        return None
+    return remote_checksum(result if isinstance(result, dict) else None, algorithm)
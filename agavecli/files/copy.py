@@ -2,17 +2,266 @@
     copy.py
 """
 from __future__ import print_function                                           
+import fnmatch
+import itertools
 import json                                                                     
+import os
+import re
 import requests                                                                 
 import shutil
 import sys                                                                      
 import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from os import path
-from ..utils import get_access_token, get_agave_context, handle_bad_response_status_code
+from ..utils import get_agave_client, handle_bad_response_status_code
+from .bundles import bundle_extensions, check_bundle_format, download_bundle, upload_bundle
+from .checksums import get_checksum_cache, remote_checksum, response_checksum
+from .directories import make_remote_dir
+from .listings import agave_time_to_seconds, list_remote_path, walk_remote
+from .ratelimit import RateLimiter, iter_limited
+from .streams import DEFAULT_CHUNK_SIZE, MultipartStream, StreamPipe, copy_response, \
+        file_multipart_stream, iter_file, iter_hashed
+from .transfers import DEFAULT_JOBS, TransferOptions, TransferReport, run_transfers
 
 
 
-def cp_local_to_remote(origin, destination, tenant_url, headers, params):
+def split_agave_uri(uri):
+    """ Split an agave uri into system id and path
+
+    i.e., "agave://tacc-globalfs-user/dir/file.ext" becomes
+    ("tacc-globalfs-user", "dir/file.ext").
+    """
+    agave_system, _, agave_path = uri[8:].partition("/")
+    return agave_system, agave_path
+
+
+
+def upload_file(client, endpoint, local_path, agave_system, remote_dir, params, options=None,
+                filename=None):
+    """ Upload a local file into a directory on a remote Agave system
+
+    The file is checksummed as it is sent. It is named "filename" on the
+    remote system (defaults to the base name of local_path).
+
+    Raise requests.exceptions.HTTPError if the upload is rejected and
+    IOError if the checksum of the uploaded file does not match.
+    """
+    options = options or TransferOptions()
+    hasher = options.hasher()
+    with open(local_path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        body = file_multipart_stream(f, filename, chunk_size=options.chunk_size,
+                                     hasher=hasher, limiter=options.rate_limiter)
+        resp = client.post(endpoint, agave_system, remote_dir,
+                           data=body, headers=body.headers, params=params)
+    resp.raise_for_status()
+    options.record_checksum(local_path, hasher, response_checksum(resp, options.algorithm),
+                            local_path, stat)
+
+    return resp
+
+
+
+def download_file(client, endpoint, agave_system, remote_path, local_path, params,
+                  options=None, entry=None):
+    """ Download a file from a remote Agave system
+
+    The file is checksummed as it is written.
+
+    PARAMETERS
+    ----------
+    entry : dict
+        Listing entry of the remote file, holding the checksum to verify
+        the download against (if any).
+
+    RETURNS
+    -------
+    digest : str
+        Checksum of the downloaded file.
+
+    Raise requests.exceptions.HTTPError if the download is rejected (the
+    local file is not touched in that case) and IOError if the checksum of
+    the downloaded file does not match.
+    """
+    options = options or TransferOptions()
+    hasher = options.hasher()
+    resp = client.get(endpoint, agave_system, remote_path, params=params, stream=True)
+    try:
+        resp.raise_for_status()
+        with open(local_path, "wb") as f:
+            copy_response(resp, f, options.chunk_size, hasher, options.rate_limiter)
+    finally:
+        resp.close()
+
+    return options.record_checksum("agave://{0}/{1}".format(agave_system, remote_path), hasher,
+                                   remote_checksum(entry, options.algorithm), local_path)
+
+
+
+# Suffix of the file keeping track of a partial download.
+PARTIAL_SUFFIX = ".agavecli-partial"
+
+
+def resume_download(client, endpoint, agave_system, remote_path, local_path, entry, params,
+                    options=None):
+    """ Download a file, picking up from where a previous attempt stopped
+
+    The remote file is described in a sidecar file (local_path +
+    PARTIAL_SUFFIX) while it is downloaded. If the sidecar still describes
+    the remote file (same length and modification time) only the missing
+    bytes are requested, with an HTTP Range header, and appended to the
+    local file. The sidecar is removed once the local file has the length
+    of the remote one. The part downloaded by the previous attempt is read
+    back to checksum the whole file.
+
+    PARAMETERS
+    ----------
+    entry : dict
+        Listing entry of the remote file (see list_remote_path).
+
+    Raise requests.exceptions.HTTPError if the download is rejected and
+    IOError if the downloaded file does not match the remote one.
+    """
+    options = options or TransferOptions()
+    partial = local_path + PARTIAL_SUFFIX
+    state = {
+        "origin": "agave://{0}/{1}".format(agave_system, remote_path),
+        "length": entry["length"],
+        "lastModified": entry["lastModified"],
+    }
+
+    offset = 0
+    if path.isfile(partial) and path.isfile(local_path):
+        try:
+            with open(partial, "r") as f:
+                previous_state = json.load(f)
+        except ValueError:
+            previous_state = None
+        if previous_state == state and path.getsize(local_path) <= state["length"]:
+            offset = path.getsize(local_path)
+    with open(partial, "w") as f:
+        json.dump(state, f, sort_keys=True, indent=4)
+
+    hasher = options.hasher()
+    if offset:
+        with open(local_path, "rb") as f:
+            for chunk in iter_file(f, options.chunk_size):
+                hasher.update(chunk)
+
+    if offset < state["length"] or not path.isfile(local_path):
+        headers = {"Range": "bytes={0}-".format(offset)} if offset else {}
+        resp = client.get(endpoint, agave_system, remote_path,
+                          headers=headers, params=params, stream=True)
+        try:
+            resp.raise_for_status()
+            # The server may ignore the range and send the whole file.
+            mode = "ab" if resp.status_code == 206 else "wb"
+            if mode == "wb":
+                hasher = options.hasher()
+            else:
+                content_range = resp.headers.get("Content-Range", "")
+                if not content_range.startswith("bytes {0}-".format(offset)):
+                    raise IOError("Unexpected range {0} (asked for bytes {1}-)".format(
+                        content_range, offset))
+            with open(local_path, mode) as f:
+                copy_response(resp, f, options.chunk_size, hasher, options.rate_limiter)
+        finally:
+            resp.close()
+
+    size = path.getsize(local_path)
+    if size != state["length"]:
+        raise IOError("{0} has {1} bytes, expected {2}".format(local_path, size, state["length"]))
+    os.remove(partial)
+
+    return options.record_checksum(state["origin"], hasher,
+                                   remote_checksum(entry, options.algorithm), local_path)
+
+
+
+# Files are not split into segments smaller than this.
+MIN_SEGMENT_SIZE = 1024 * 1024
+
+
+def download_segment(client, endpoint, agave_system, remote_path, local_path, start, end, params,
+                     options=None):
+    """ Download bytes start to end (inclusive) of a file into place
+
+    The local file has to exist already, the segment is written at its
+    offset.
+    """
+    options = options or TransferOptions()
+    headers = {"Range": "bytes={0}-{1}".format(start, end)}
+    resp = client.get(endpoint, agave_system, remote_path,
+                      headers=headers, params=params, stream=True)
+    try:
+        resp.raise_for_status()
+        content_range = resp.headers.get("Content-Range", "")
+        if resp.status_code != 206 or not content_range.startswith("bytes {0}-{1}/".format(start, end)):
+            raise IOError("Server did not send bytes {0}-{1} of {2} (got {3})".format(
+                start, end, remote_path, content_range or "the whole file"))
+
+        with open(local_path, "r+b") as f:
+            f.seek(start)
+            copy_response(resp, f, options.chunk_size, limiter=options.rate_limiter)
+            if f.tell() != end + 1:
+                raise IOError("Segment {0}-{1} of {2} ended at byte {3}".format(
+                    start, end, remote_path, f.tell()))
+    finally:
+        resp.close()
+
+
+
+def segmented_download(client, endpoint, agave_system, remote_path, local_path, length,
+                       segments, params, options=None, entry=None):
+    """ Download a file over several connections at once
+
+    The file is split into (at most) "segments" byte ranges which are
+    requested concurrently and written in place into the local file,
+    preallocated to the size of the remote file. Files are not split into
+    segments smaller than MIN_SEGMENT_SIZE: a file too small for two of them
+    (an empty one included) is downloaded whole, without a Range request
+    (see download_file). Segments arrive out of order, so
+    the file is checksummed once it is complete (while it is most likely
+    still in the page cache).
+
+    Raise requests.exceptions.HTTPError if a segment is rejected and IOError
+    if the server does not honour byte ranges or the checksum of the file
+    does not match. The local file is removed if any segment fails.
+    """
+    options = options or TransferOptions()
+    segments = min(segments, length // MIN_SEGMENT_SIZE)
+    if segments <= 1:
+        return download_file(client, endpoint, agave_system, remote_path, local_path, params,
+                             options, entry)
+    segment_size = -(-length // segments)
+    ranges = [(start, min(start + segment_size, length) - 1)
+              for start in range(0, length, segment_size)]
+
+    with open(local_path, "wb") as f:
+        f.truncate(length)
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [executor.submit(download_segment, client, endpoint, agave_system,
+                                       remote_path, local_path, start, end, params, options)
+                       for start, end in ranges]
+            for future in futures:
+                future.result()
+    except Exception:
+        os.remove(local_path)
+        raise
+
+    hasher = options.hasher()
+    with open(local_path, "rb") as f:
+        for chunk in iter_file(f, options.chunk_size):
+            hasher.update(chunk)
+    return options.record_checksum("agave://{0}/{1}".format(agave_system, remote_path), hasher,
+                                   remote_checksum(entry, options.algorithm), local_path)
+
+
+
+def cp_local_to_remote(origin, destination, client, endpoint, params, options=None):
     """ Copy a file from local filesystem to remote Agave system
 
     curl -# -k -H "Authorization: Bearer <access token>" -X POST \
@@ -27,14 +276,20 @@ def cp_local_to_remote(origin, destination, tenant_url, headers, params):
                 file=sys.stderr)
         sys.exit(1)
     
+    options = options or TransferOptions()
+
     # Make request.
     try:
         agave_system = destination[8:] # Remove "agave://"
         
-        # Prep request.
-        files    = {"fileToUpload": open(origin, "rb")}
-        endpoint = "{0}/{1}".format(tenant_url, agave_system)
-        resp = requests.post(endpoint, files=files, headers=headers, params=params)
+        # Prep request (the file is read, and checksummed, as it is sent).
+        hasher = options.hasher()
+        with open(origin, "rb") as f:
+            stat = os.fstat(f.fileno())
+            body = file_multipart_stream(f, chunk_size=options.chunk_size, hasher=hasher,
+                                         limiter=options.rate_limiter)
+            resp = client.post(endpoint, agave_system, data=body, headers=body.headers,
+                               params=params)
     except requests.exceptions.MissingSchema as err:
         print(err, file=sys.stderr)
         sys.exit(1)
@@ -42,13 +297,72 @@ def cp_local_to_remote(origin, destination, tenant_url, headers, params):
     # Handle bad status code.                                               
     handle_bad_response_status_code(resp)
 
+    try:
+        options.record_checksum(origin, hasher, response_checksum(resp, options.algorithm),
+                                origin, stat)
+    except IOError as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
+
     return resp
 
 
 
-def cp_remote_to_local(origin, destination, tenant_url, headers, params):
+def cp_local_dir_to_remote(origin, destination, client, endpoint, params, jobs=DEFAULT_JOBS,
+                           options=None):
+    """ Copy a directory tree from local filesystem to remote Agave system
+
+    Remote directories are created as the local tree is walked and files are
+    uploaded by a pool of "jobs" workers. A destination ending in "/" copies
+    the directory into it, otherwise the destination names the new directory.
+
+    RETURNS
+    -------
+    report : TransferReport
+    """
+    agave_system, remote_root = split_agave_uri(destination)
+    origin = origin.rstrip("/") or "/"
+    if remote_root == "" or remote_root.endswith("/"):
+        remote_root += path.basename(origin)
+
+    report = TransferReport()
+
+    def walk():
+        for dirpath, dirnames, filenames in os.walk(origin):
+            relpath = path.relpath(dirpath, origin)
+            remote_dir = remote_root if relpath == "." else \
+                    "/".join([remote_root] + relpath.split(os.sep))
+
+            # Directories have to exist before uploading files into them.
+            try:
+                resp = make_remote_dir(client, endpoint, agave_system, remote_dir, params)
+                resp.raise_for_status()
+            except requests.exceptions.RequestException as err:
+                report.record(dirpath + "/", err)
+                dirnames[:] = []
+                continue
+
+            dirnames.sort()
+            for filename in sorted(filenames):
+                local_path = path.join(dirpath, filename)
+                yield local_path, upload_file, \
+                        (client, endpoint, local_path, agave_system, remote_dir, params, options)
+
+    return run_transfers(walk(), jobs, report)
+
+
+
+def cp_remote_to_local(origin, destination, client, endpoint, params,
+                       listings_endpoint="files/v2/listings/system", resume=False, segments=1,
+                       options=None):
     """ Copy a file from remote Agave system to local filesystem
 
+    If "resume" is set, an interrupted copy is picked up where it stopped
+    (see resume_download). Otherwise, if "segments" is larger than 1, the
+    file is downloaded in that many byte ranges at once (see
+    segmented_download). The length of the remote file, and its checksum if
+    the download is verified, is obtained from the files-listings service
+    ("listings_endpoint").
 
     curl -k -H "Authorization: Bearer <access token>" \
             -O 'https://tenant/files/v2/media/system/tacc-globalfs-user/dir/file.ext'
@@ -60,17 +374,43 @@ def cp_remote_to_local(origin, destination, tenant_url, headers, params):
                 file=sys.stderr)
         sys.exit(1)
 
+    options = options or TransferOptions()
+
+    if resume or segments > 1 or options.verify:
+        agave_system, remote_path = split_agave_uri(origin)
+        try:
+            entries = list_remote_path(client, listings_endpoint, agave_system, remote_path, params)
+            if len(entries) != 1 or entries[0]["type"] == "dir":
+                print("{0} is not a file".format(origin), file=sys.stderr)
+                sys.exit(1)
+            if resume:
+                resume_download(client, endpoint, agave_system, remote_path, destination,
+                                entries[0], params, options)
+            elif segments > 1:
+                segmented_download(client, endpoint, agave_system, remote_path, destination,
+                                   entries[0]["length"], segments, params, options, entries[0])
+            else:
+                download_file(client, endpoint, agave_system, remote_path, destination,
+                              params, options, entries[0])
+        except requests.exceptions.HTTPError as err:
+            handle_bad_response_status_code(err.response)
+        except requests.exceptions.MissingSchema as err:
+            print(err, file=sys.stderr)
+            sys.exit(1)
+        except IOError as err:
+            print(err, file=sys.stderr)
+            sys.exit(1)
+        return
+
     # Make request.
     try:
         agave_system   = origin[8:] # Remove "agave://"
         local_filename = destination
-        
-        endpoint = "{0}/{1}".format(tenant_url, agave_system)
-        resp = requests.get(endpoint, headers=headers, params=params, stream=True)
+
+        hasher = options.hasher()
+        resp = client.get(endpoint, agave_system, params=params, stream=True)
         with open(local_filename, "wb") as f:
-            for chunk in resp.iter_content(chunk_size=1024):
-                if chunk:
-                    f.write(chunk)
+            copy_response(resp, f, options.chunk_size, hasher, options.rate_limiter)
     except requests.exceptions.MissingSchema as err:
         print(err, file=sys.stderr)
         sys.exit(1)
@@ -78,12 +418,217 @@ def cp_remote_to_local(origin, destination, tenant_url, headers, params):
     # Handle bad status code.                                               
     handle_bad_response_status_code(resp)
 
+    options.record_checksum(origin, hasher, local_path=local_filename)
+
     return resp
 
 
 
-def cp_remote_to_remote(origin, destination, tenant_url, headers, params):
+def cp_remote_dir_to_local(origin, destination, client, endpoint, listings_endpoint,
+                           params, jobs=DEFAULT_JOBS, resume=False, options=None):
+    """ Copy a directory tree from remote Agave system to local filesystem
+
+    The remote tree is crawled through the files-listings service. Local
+    directories are made as soon as they are listed, ahead of the downloads
+    into them, which are run by a pool of "jobs" workers. If the destination
+    is an existing directory the copy is made inside it, otherwise the
+    destination names the new directory. If "resume" is set, files left
+    over by an interrupted copy are completed instead of downloaded again.
+
+    RETURNS
+    -------
+    report : TransferReport
+
+    Raise ValueError, before anything is copied, if origin is not a
+    directory.
+    """
+    agave_system, remote_root = split_agave_uri(origin)
+    remote_root = remote_root.strip("/")
+    local_root = destination
+    if path.isdir(destination):
+        local_root = path.join(destination, remote_root.split("/")[-1] or agave_system)
+
+    report = TransferReport()
+
+    def onerror(remote_dir, err):
+        report.record("agave://{0}/{1}/".format(agave_system, remote_dir), err)
+
+    walked = walk_remote(client, listings_endpoint, agave_system, remote_root, params, onerror)
+    # List the origin now, so that a file is found out before making any directory.
+    first = next(walked, None)
+
+    def walk():
+        if first is None:
+            return
+        for remote_dir, dirnames, files in itertools.chain([first], walked):
+            relpath = remote_dir[len(remote_root):].strip("/")
+            local_dir = path.join(local_root, *relpath.split("/"))
+            try:
+                if not path.isdir(local_dir):
+                    os.makedirs(local_dir)
+            except OSError as err:
+                report.record(local_dir, err)
+                dirnames[:] = []
+                continue
+
+            for entry in files:
+                remote_path = "{0}/{1}".format(remote_dir, entry["name"]).lstrip("/")
+                local_path = path.join(local_dir, entry["name"])
+                name = "agave://{0}/{1}".format(agave_system, remote_path)
+                if resume:
+                    yield name, resume_download, (client, endpoint, agave_system, remote_path,
+                                                  local_path, entry, params, options)
+                else:
+                    yield name, download_file, (client, endpoint, agave_system, remote_path,
+                                                local_path, params, options, entry)
+
+    return run_transfers(walk(), jobs, report)
+
+
+
+def stream_remote_to_remote(client, endpoint, origin_system, origin_path,
+                            destination_system, destination_dir, filename, params,
+                            options=None):
+    """ Pipe a file from a remote Agave system into another
+
+    The download is fed into a streamed multipart upload through a bounded
+    in-memory buffer, so the copy needs neither disk space nor memory
+    proportional to the size of the file, and the upload starts as soon as
+    the first bytes are downloaded. The data is checksummed on its way
+    through.
+
+    Raise requests.exceptions.HTTPError if the download or the upload is
+    rejected and IOError if the checksum of the uploaded file does not
+    match.
+    """
+    options = options or TransferOptions()
+    hasher = options.hasher()
+    resp = client.get(endpoint, origin_system, origin_path, params=params, stream=True)
+    try:
+        resp.raise_for_status()
+
+        # The size of the upload is only known if the download is not being
+        # decoded on the fly.
+        length = None
+        if "Content-Length" in resp.headers and "Content-Encoding" not in resp.headers:
+            length = int(resp.headers["Content-Length"])
+
+        chunks = iter_hashed(resp.iter_content(chunk_size=options.chunk_size), hasher)
+        if options.rate_limiter is not None:
+            chunks = iter_limited(chunks, options.rate_limiter)
+        pipe = StreamPipe(chunks)
+        try:
+            body = MultipartStream("fileToUpload", filename, pipe, length)
+            upload = client.post(endpoint, destination_system, destination_dir,
+                                 data=body, headers=body.headers, params=params)
+        finally:
+            pipe.close()
+    finally:
+        resp.close()
+
+    upload.raise_for_status()
+    destination_path = "/".join(filter(None, [destination_dir, filename]))
+    options.record_checksum("agave://{0}/{1}".format(destination_system, destination_path),
+                            hasher, response_checksum(upload, options.algorithm))
+
+    return upload
+
+
+
+# Statuses that end the import of a file (see the files-history service).
+import_completed_statuses = ("STAGING_COMPLETED", "TRANSFORMING_COMPLETED")
+import_failed_statuses = ("STAGING_FAILED", "TRANSFORMING_FAILED", "CANCELLED")
+
+# Seconds an import is followed for before giving up on it.
+DEFAULT_IMPORT_TIMEOUT = 24 * 60 * 60
+
+
+def import_history(client, history_endpoint, agave_system, remote_path, params):
+    """ Events of the files-history service for a remote path, [] if it has none
+    """
+    resp = client.get(history_endpoint, agave_system, remote_path, params=params)
+    if resp.status_code == 404:
+        return []
+    resp.raise_for_status()
+    return resp.json()["result"]
+
+
+
+def import_remote_to_remote(client, endpoint, history_endpoint, origin, destination_system,
+                            destination_dir, filename, params, poll_interval=5,
+                            timeout=DEFAULT_IMPORT_TIMEOUT):
+    """ Have the files service import a file from another Agave system
+
+    Ask the destination system to ingest "origin" (an agave:// url) and
+    poll the files-history service until the transfer is done. The file is
+    moved between the systems by Agave, it never goes through this machine.
+
+    The history of a path also holds the events of earlier imports and
+    uploads to it, so only events created after the newest one recorded
+    before the request are followed (times are compared on the server's
+    clock).
+
+    RETURNS
+    -------
+    status : str
+        Last status of the import (one of import_completed_statuses).
+
+    Raise requests.exceptions.HTTPError if the import request is rejected
+    and IOError if the import fails or does not end within "timeout"
+    seconds.
+    """
+    destination_path = "/".join(filter(None, [destination_dir, filename]))
+    earlier = [agave_time_to_seconds(event["created"]) for event in import_history(
+        client, history_endpoint, destination_system, destination_path, params)
+               if event.get("created")]
+    since = max(earlier) if earlier else None
+
+    data = {"urlToIngest": origin, "fileName": filename}
+    resp = client.post(endpoint, destination_system, destination_dir, data=data, params=params)
+    resp.raise_for_status()
+
+    deadline = time.time() + timeout
+    status = resp.json()["result"].get("status", "")
+    printed = None
+    while True:
+        if status != printed:
+            print("{0}: {1}".format(destination_path, status))
+            printed = status
+        if status in import_completed_statuses:
+            return status
+        if status in import_failed_statuses:
+            raise IOError("Import of {0} into {1}/{2} ended with status {3}".format(
+                origin, destination_system, destination_path, status))
+        if time.time() >= deadline:
+            raise IOError("Import of {0} into {1}/{2} still {3} after {4} seconds".format(
+                origin, destination_system, destination_path, status, timeout))
+
+        time.sleep(poll_interval)
+        events = import_history(client, history_endpoint, destination_system,
+                                destination_path, params)
+        if since is not None:
+            events = [event for event in events if event.get("created") and
+                      agave_time_to_seconds(event["created"]) > since]
+
+        # Events are not guaranteed to be sorted, but an import reaching an
+        # end status stays there.
+        statuses = [event["status"] for event in events]
+        ended = [s for s in statuses if s in import_completed_statuses + import_failed_statuses]
+        status = ended[-1] if ended else (statuses[-1] if statuses else status)
+
+
+
+def cp_remote_to_remote(origin, destination, client, endpoint, params, mode="stream",
+                        history_endpoint="files/v2/history/system", poll_interval=5,
+                        options=None):
     """ Copy a file from a remote Agave system to another
+
+    By default ("stream" mode) the file is piped from one system to the
+    other. The "tempfile" mode downloads the file into a temporary directory
+    before uploading it. The "import" mode has the files service copy the
+    file between the systems itself, polling its status from the
+    files-history service ("history_endpoint") every "poll_interval"
+    seconds.
     """
     if "agave://" in origin[:8] and "agave://" in destination[:8]:
         pass
@@ -92,13 +637,37 @@ def cp_remote_to_remote(origin, destination, tenant_url, headers, params):
                 file=sys.stderr)
         sys.exit(1)
 
+    options = options or TransferOptions()
+
+    if mode in ("stream", "import"):
+        origin_system, origin_path = split_agave_uri(origin)
+        destination_system, destination_path = split_agave_uri(destination)
+        destination_dir, _, filename = destination_path.rpartition("/")
+        if filename == "": filename = origin_path.split("/")[-1]
+
+        try:
+            if mode == "import":
+                return import_remote_to_remote(client, endpoint, history_endpoint, origin,
+                                               destination_system, destination_dir, filename,
+                                               params, poll_interval)
+            return stream_remote_to_remote(client, endpoint, origin_system, origin_path,
+                                           destination_system, destination_dir, filename,
+                                           params, options)
+        except requests.exceptions.HTTPError as err:
+            handle_bad_response_status_code(err.response)
+        except requests.exceptions.MissingSchema as err:
+            print(err, file=sys.stderr)
+            sys.exit(1)
+        except IOError as err:
+            print(err, file=sys.stderr)
+            sys.exit(1)
+
     try:
         # Download file (stream it).
         origin_system      = origin[8:]      # Remove "agave://"
         destination_system = destination[8:] # Remove "agave://"
-            
-        origin_endpoint = "{0}/{1}".format(tenant_url, origin_system)
-        resp = requests.get(origin_endpoint, headers=headers, params=params, stream=True)
+
+        resp = client.get(endpoint, origin_system, params=params, stream=True)
 
         # Handle bad status code.
         handle_bad_response_status_code(resp)
@@ -109,49 +678,342 @@ def cp_remote_to_remote(origin, destination, tenant_url, headers, params):
             filename = destination.split("/")[-1]
             if filename == "": filename = origin.split("/")[-1]
             filepath = path.join(tmpdir, filename)
+            hasher = options.hasher()
             with open(filepath, "wb") as tmp:
-                for chunk in resp.iter_content(chunk_size=1024):
-                    if chunk:
-                        tmp.write(chunk)
+                copy_response(resp, tmp, options.chunk_size, hasher, options.rate_limiter)
 
             # Upload file from /tmp/? to remote system.
-            destination_endpoint = "{0}/{1}".format(tenant_url, destination_system)
-            files                = {"fileToUpload": open(filepath, "rb")}
-            resp = requests.post(destination_endpoint, files=files, headers=headers, params=params)
+            with open(filepath, "rb") as f:
+                body = file_multipart_stream(f, chunk_size=options.chunk_size,
+                                             limiter=options.rate_limiter)
+                resp = client.post(endpoint, destination_system, data=body,
+                                   headers=body.headers, params=params)
         finally:
             shutil.rmtree(tmpdir)
 
         # Handle bad status code.
         handle_bad_response_status_code(resp)
+
+        options.record_checksum(destination, hasher, response_checksum(resp, options.algorithm))
+    except requests.exceptions.MissingSchema as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
+    except IOError as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
+
+
+
+# Characters that make a path a glob pattern.
+glob_magic = re.compile("[*?[]")
+
+
+def expand_remote_glob(client, listings_endpoint, agave_system, pattern, params):
+    """ Expand a glob pattern against a remote Agave system
+
+    Only the last component of the pattern may hold wildcards (i.e.,
+    "run42/*.h5"), the pattern is matched against a single listing of its
+    parent directory. As in the shell, names starting with "." are only
+    matched by patterns starting with ".".
+
+    RETURNS
+    -------
+    matches : list
+        (remote path, listing entry) tuples, sorted by name.
+
+    Raise requests.exceptions.HTTPError if the parent cannot be listed.
+    """
+    parent, _, name_pattern = pattern.strip("/").rpartition("/")
+    if glob_magic.search(parent):
+        raise ValueError("Wildcards are only supported in the last component of a path: "
+                         "{0}".format(pattern))
+
+    matches = []
+    entries = list_remote_path(client, listings_endpoint, agave_system, parent, params)
+    for entry in sorted(entries, key=lambda entry: entry["name"]):
+        name = entry["name"]
+        if name == "." or (name.startswith(".") and not name_pattern.startswith(".")):
+            continue
+        if fnmatch.fnmatchcase(name, name_pattern):
+            matches.append(("/".join(filter(None, [parent, name])), entry))
+    return matches
+
+
+
+def remote_glob_matches(client, listings_endpoint, origin, params):
+    """ Expand a remote origin holding wildcards (i.e., agave://system/run42/*.h5)
+
+    As in a shell without nullglob, an origin that matches nothing (or
+    cannot be expanded) but exists is not a pattern but the name of a file,
+    i.e., agave://system/data[1].txt.
+
+    RETURNS
+    -------
+    matches : list
+        See expand_remote_glob, None if origin is to be taken literally.
+    """
+    if "agave://" not in origin[:8] or not glob_magic.search(origin):
+        return None
+    agave_system, pattern = split_agave_uri(origin)
+    try:
+        matches = expand_remote_glob(client, listings_endpoint, agave_system, pattern, params)
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+    if matches:
+        return matches
+
+    try:
+        list_remote_path(client, listings_endpoint, agave_system, pattern, params)
+    except requests.exceptions.HTTPError:
+        return matches
+    return None
+
+
+
+def copy_via_tempfile(client, endpoint, origin_system, origin_path, destination_system,
+                      destination_dir, params, options=None, filename=None):
+    """ Copy a file between remote Agave systems through a temporary file
+
+    The copy is named "filename" (defaults to the name of the original).
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        local_path = path.join(tmpdir, origin_path.split("/")[-1])
+        download_file(client, endpoint, origin_system, origin_path, local_path, params, options)
+        upload_file(client, endpoint, local_path, destination_system, destination_dir, params,
+                    options, filename)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+
+def cp_remote_glob(origin, destination, client, endpoint, listings_endpoint, params,
+                   jobs=DEFAULT_JOBS, recursive=False, mode="stream",
+                   history_endpoint="files/v2/history/system", poll_interval=5, resume=False,
+                   options=None, matches=None):
+    """ Copy the remote files matching a glob pattern into a directory
+
+    The pattern is expanded from one listing (see expand_remote_glob),
+    unless its "matches" are given, and
+    the matching files are copied by a pool of "jobs" workers into the
+    destination directory, local or remote ("mode" sets how files are copied
+    between remote systems, see cp_remote_to_remote). Matching directories
+    are only copied if "recursive" is set (into local destinations).
+
+    RETURNS
+    -------
+    report : TransferReport
+    """
+    agave_system, pattern = split_agave_uri(origin)
+    remote_destination = "agave://" in destination[:8]
+    if not remote_destination and not path.isdir(destination):
+        print("{0} is not a directory".format(destination), file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        if matches is None:
+            matches = expand_remote_glob(client, listings_endpoint, agave_system, pattern,
+                                         params)
+    except ValueError as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
+    if not matches:
+        print("No match for {0}".format(origin), file=sys.stderr)
+        sys.exit(1)
+
+    report = TransferReport()
+    directories = [remote_path for remote_path, entry in matches if entry["type"] == "dir"]
+    for remote_path in directories:
+        if not recursive or remote_destination:
+            print("Omitting directory agave://{0}/{1}".format(agave_system, remote_path),
+                  file=sys.stderr)
+
+    def transfers():
+        for remote_path, entry in matches:
+            if entry["type"] == "dir":
+                continue
+            name = "agave://{0}/{1}".format(agave_system, remote_path)
+            if not remote_destination:
+                local_path = path.join(destination, entry["name"])
+                if resume:
+                    yield name, resume_download, (client, endpoint, agave_system, remote_path,
+                                                  local_path, entry, params, options)
+                else:
+                    yield name, download_file, (client, endpoint, agave_system, remote_path,
+                                                local_path, params, options, entry)
+                continue
+
+            destination_system, destination_dir = split_agave_uri(destination)
+            destination_dir = destination_dir.strip("/")
+            if mode == "import":
+                yield name, import_remote_to_remote, (client, endpoint, history_endpoint, name,
+                                                      destination_system, destination_dir,
+                                                      entry["name"], params, poll_interval)
+            elif mode == "tempfile":
+                yield name, copy_via_tempfile, (client, endpoint, agave_system, remote_path,
+                                                destination_system, destination_dir, params,
+                                                options)
+            else:
+                yield name, stream_remote_to_remote, (client, endpoint, agave_system,
+                                                      remote_path, destination_system,
+                                                      destination_dir, entry["name"], params,
+                                                      options)
+
+    run_transfers(transfers(), jobs, report)
+
+    if recursive and not remote_destination:
+        for remote_path in directories:
+            subreport = cp_remote_dir_to_local("agave://{0}/{1}".format(agave_system, remote_path),
+                                               destination, client, endpoint, listings_endpoint,
+                                               params, jobs, resume, options)
+            report.succeeded += subreport.succeeded
+            report.failed.extend(subreport.failed)
+
+    return report
+
+
+
+def cp_bundle(origin, destination, client, endpoint, params, bundle="tar", options=None):
+    """ Copy a directory tree as a single archive
+
+    A local directory is archived, and compressed according to "bundle"
+    (tar, gzip or zstd), as it is uploaded (see upload_bundle). A
+    destination ending in "/" gets an archive named after the directory
+    (i.e., dir.tar.gz), otherwise the destination names the archive. A
+    remote archive is unpacked into a local directory as it is downloaded
+    (see download_bundle).
+    """
+    try:
+        check_bundle_format(bundle)
+    except ValueError as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        if "agave://" not in origin[:8] and "agave://" in destination[:8]:
+            if not path.isdir(origin):
+                print("{0} is not a directory".format(origin), file=sys.stderr)
+                sys.exit(1)
+            agave_system, remote_path = split_agave_uri(destination)
+            remote_dir, _, filename = remote_path.rpartition("/")
+            filename = filename or \
+                    path.basename(origin.rstrip(os.sep)) + bundle_extensions[bundle]
+            upload_bundle(client, endpoint, origin, agave_system, remote_dir.strip("/"),
+                          filename, params, bundle, options)
+        elif "agave://" in origin[:8] and "agave://" not in destination[:8]:
+            agave_system, remote_path = split_agave_uri(origin)
+            download_bundle(client, endpoint, agave_system, remote_path.strip("/"), destination,
+                            params, bundle, options)
+        else:
+            print("Bundles are copied from a local directory to a remote system or back",
+                  file=sys.stderr)
+            sys.exit(1)
+    except requests.exceptions.HTTPError as err:
+        handle_bad_response_status_code(err.response)
     except requests.exceptions.MissingSchema as err:
         print(err, file=sys.stderr)
         sys.exit(1)
+    except IOError as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
 
 
 
-def files_copy(agavedb, token_endpoint, endpoint, origin, destination):
+def files_copy(agavedb, token_endpoint, endpoint, origin, destination,
+               recursive=False, jobs=DEFAULT_JOBS,
+               listings_endpoint="files/v2/listings/system", mode="stream",
+               history_endpoint="files/v2/history/system", poll_interval=5, resume=False,
+               segments=1, chunk_size=DEFAULT_CHUNK_SIZE, verify=False, limit_rate=None,
+               bundle=None):
     """ Copy files via the Agave API
+
+    Directories are copied only if "recursive" is set, transferring up to
+    "jobs" files at a time. Wildcards in the last component of a remote
+    origin (i.e., agave://system/run42/*.h5) are expanded from a single
+    listing and the matching files are copied, "jobs" at a time, into the
+    destination directory (an origin matching nothing is taken as a file
+    name, i.e., agave://system/data[1].txt). Remote directories are crawled through the
+    files-listings service ("listings_endpoint"). "mode" sets how files are
+    copied between remote systems (see cp_remote_to_remote). Downloads are
+    resumed if "resume" is set. Single file downloads are split into
+    "segments" concurrent byte ranges. Data is read and written
+    "chunk_size" bytes at a time, and checksummed on the way (checksums of
+    local files are cached in the local Agave database directory). If
+    "verify" is set, checksums are compared against the remote ones, when
+    the files service provides them. All transfers together are held to
+    "limit_rate" bytes per second, if set. If "bundle" is set, a local
+    directory is uploaded as a single archive of that format, or a remote
+    archive is unpacked into a local directory (see cp_bundle).
     """
-    # Get baseurl for tenant.
-    agave_context = get_agave_context(agavedb)
-    
-    # Get access token from agave database.
-    access_token = get_access_token(agavedb, token_endpoint)
+    # Get an authenticated client for the current tenant.
+    client = get_agave_client(agavedb, token_endpoint, pool_maxsize=max(jobs, segments))
   
-    headers    = {"Authorization":"Bearer {0}".format(access_token)}
-    params     = {"pretty": "true"}
-    tenant_url = "{0}{1}".format(agave_context["current"]["baseurl"], endpoint)
+    params  = {"pretty": "true"}
+    rate_limiter = RateLimiter(limit_rate) if limit_rate else None
+    options = TransferOptions(chunk_size, get_checksum_cache(agavedb), verify, rate_limiter)
+    matches = None
+    if bundle is None:
+        matches = remote_glob_matches(client, listings_endpoint, origin, params)
+
+    # cp bundle local directory -> remote archive, or remote archive -> local directory.
+    if bundle is not None:
+        cp_bundle(origin, destination, client, endpoint, params, bundle, options)
+
+    # cp remote glob -> local or remote directory.
+    elif matches is not None:
+        try:
+            report = cp_remote_glob(origin, destination, client, endpoint, listings_endpoint,
+                                    params, jobs, recursive, mode, history_endpoint,
+                                    poll_interval, resume, options, matches)
+        except requests.exceptions.HTTPError as err:
+            handle_bad_response_status_code(err.response)
+        except requests.exceptions.MissingSchema as err:
+            print(err, file=sys.stderr)
+            sys.exit(1)
+        report.print_summary()
+        if not report.ok:
+            sys.exit(1)
+
     # cp local -> remote.
-    if "agave://" not in origin[:8] and "agave://" in destination[:8]:
-        # Copy file from local system to remote Agave system.
-        resp = cp_local_to_remote(origin, destination, tenant_url, headers, params)
+    elif "agave://" not in origin[:8] and "agave://" in destination[:8]:
+        if path.isdir(origin):
+            if not recursive:
+                print("{0} is a directory (use -r to copy it)".format(origin),
+                        file=sys.stderr)
+                sys.exit(1)
+            # Copy directory tree from local system to remote Agave system.
+            report = cp_local_dir_to_remote(origin, destination, client, endpoint, params, jobs,
+                                            options)
+            report.print_summary()
+            if not report.ok:
+                sys.exit(1)
+        else:
+            # Copy file from local system to remote Agave system.
+            resp = cp_local_to_remote(origin, destination, client, endpoint, params, options)
         
     # cp remote -> local.
     elif "agave://" in origin[:8] and "agave://" not in destination[:8]:
-        # Copy file from remote Agave system to local file system.
-        resp = cp_remote_to_local(origin, destination, tenant_url, headers, params)
+        report = None
+        if recursive:
+            try:
+                # Copy directory tree from remote Agave system to local file system.
+                report = cp_remote_dir_to_local(origin, destination, client, endpoint,
+                                                listings_endpoint, params, jobs, resume,
+                                                options)
+            except ValueError:
+                # The origin is a file, copy it as such.
+                pass
+        if report is not None:
+            report.print_summary()
+            if not report.ok:
+                sys.exit(1)
+        else:
+            # Copy file from remote Agave system to local file system.
+            resp = cp_remote_to_local(origin, destination, client, endpoint, params,
+                                      listings_endpoint, resume, segments, options)
     
     # cp remote -> remote
     elif "agave://" in origin[:8] and "agave://" in destination[:8]:
         # Copy file from a remote agave system to another.
-        cp_remote_to_remote(origin, destination, tenant_url, headers, params)
+        cp_remote_to_remote(origin, destination, client, endpoint, params, mode,
+                            history_endpoint, poll_interval, options)
@@ -6,18 +6,33 @@ import json
 import requests
 import sys
 from os import path
-from ..utils import get_access_token, get_agave_context, handle_bad_response_status_code
+from ..utils import get_agave_client, handle_bad_response_status_code
+
+
+
+def make_remote_dir(client, endpoint, agave_system, dir_path, params):
+    """ Send a request to make a directory on a remote Agave system
+
+    PARAMETERS
+    ----------
+    client : AgaveClient
+    endpoint : str
+        Files-media service endpoint (i.e., files/v2/media/system).
+    agave_system : str
+        System id.
+    dir_path : str
+        Path of the directory to make, relative to the system's root.
+    """
+    data = {"action": "mkdir", "path": dir_path}
+    return client.put(endpoint, agave_system, data=data, params=params)
 
 
 
 def files_mkdir(agavedb, token_endpoint, endpoint, syspath):
     """ Make directries on a remote Agave system
     """
-    # Get baseurl for tenant.                                                   
-    agave_context = get_agave_context(agavedb)
-    
-    # Get access token from agave database.                                     
-    access_token = get_access_token(agavedb, token_endpoint)
+    # Get an authenticated client for the current tenant.
+    client = get_agave_client(agavedb, token_endpoint)
     
     # Make request.                                                             
     try:
@@ -26,12 +41,8 @@ def files_mkdir(agavedb, token_endpoint, endpoint, syspath):
         agave_system = syspath[0]
         dir_path     = "/".join( syspath[1:] )
 
-        # Prep request.
-        endpoint = "{0}{1}/{2}".format(agave_context["current"]["baseurl"], endpoint, agave_system)
-        headers  = {"Authorization":"Bearer {0}".format(access_token)}
-        data     = {"action": "mkdir", "path": dir_path}
-        params   = {"pretty": "true"}
-        resp = requests.put(endpoint, data=data, headers=headers, params=params)
+        params = {"pretty": "true"}
+        resp = make_remote_dir(client, endpoint, agave_system, dir_path, params)
     except requests.exceptions.MissingSchema as err:
         print(err, file=sys.stderr)
         sys.exit(1)
@@ -2,18 +2,26 @@
     files.py
 """
 from __future__ import print_function, division
+import datetime
 import json
 import os
 import requests
 import shutil
 import sys
 import time
-from operator import itemgetter
 from os import path
-from ..utils import get_access_token, get_agave_context, handle_bad_response_status_code
+from ..utils import BufferedWriter, RecordFormatter, get_agave_client, \
+        handle_bad_response_status_code
+from .listcache import DEFAULT_LISTING_CACHE_MAX_ENTRIES, DEFAULT_LISTING_TTL, \
+        get_listing_cache
+from .listings import DEFAULT_CRAWL_JOBS, DEFAULT_PAGE_SIZE, SortedListing, crawl_remote, \
+        iter_listing_pages
 
 
 
+# Fields of the files printed by "fs ls --output jsonl|csv|tsv".
+file_fields = ["system", "path", "name", "type", "length", "permissions", "lastModified"]
+
 file_permissions = {
     "READ"          : "-r--",
     "WRITE"         : "--w-",
@@ -26,139 +34,393 @@ file_permissions = {
 }
 
 
-def parse_agave_time(ftime):
-    """ Convert timestamp from Agave to local time
+# Abbreviated month names, as strftime("%b") gives them.
+month_names = [time.strftime("%b", (2000, month, 1, 0, 0, 0, 0, 1, -1))
+               for month in range(1, 13)]
 
-    Expect format: 2018-07-10T12:28:01.000-05:00
+# Parsed timestamps are memoized, up to this many.
+TIME_CACHE_SIZE = 65536
 
-    """
-    # 2018-07-10T12:28:01.000-05:00 (rm last ':')
-    if ftime[-3] == ":": ftime = ftime[:-3] + ftime[-2:]
+_time_cache = dict()
+_tz_offsets = dict()
+_dates = dict()
+_clocks = dict()
 
-    try:
-        ftime = time.strptime(ftime,'%Y-%m-%dT%H:%M:%S.%f%z')
-    except ValueError:
-        tz = ftime[-5:] # get the timezone part (i.e., -0500)
-        ftime = time.strptime(ftime[:-5],'%Y-%m-%dT%H:%M:%S.%f')
-        if tz.startswith("-"):
-            sign = -1
-            tz = tz[1:] # get the hous offset
-        elif tz.startswith("+"):
-            tz = tz[1:] # get the hous offset
-        seconds = ( int(tz[0:2])*60 + int(tz[2:4]) ) * 60
-        seconds *= sign
-        # Convert ftime to seconds since epoch,
-        ftime = time.mktime(ftime) + seconds
-        # Convert seconds since epoch to localtime.
-        ftime = time.localtime(ftime)
 
-    outtime = time.strftime("%b %d %H:%M", ftime).split()
-
-    return ftime, outtime
+def parse_tz_offset(tz):
+    """ Seconds east of UTC of a time zone offset (i.e., "-05:00", "-0500" or "Z")
 
+    Offsets are cached, a listing only has a handful of them.
+    """
+    offset = _tz_offsets.get(tz)
+    if offset is None:
+        if tz in ("", "Z"):
+            offset = 0
+        else:
+            digits = tz[1:].replace(":", "")
+            offset = (int(digits[0:2]) * 60 + int(digits[2:4])) * 60
+            if tz[0] == "-":
+                offset = -offset
+        _tz_offsets[tz] = offset
+    return offset
+
+
+def parse_date(date):
+    """ Year, month, day, day of the week and day of the year of a date (i.e., "2018-07-10")
+
+    Dates are cached, the files of a listing share a few of them.
+    """
+    fields = _dates.get(date)
+    if fields is None:
+        day = datetime.date(int(date[0:4]), int(date[5:7]), int(date[8:10]))
+        fields = (day.year, day.month, day.day, day.weekday(), day.timetuple().tm_yday)
+        _dates[date] = fields
+    return fields
 
 
+def parse_clock(clock):
+    """ Hour, minute and second of a time of day (i.e., "12:28:01")
 
-def files_list(agavedb, token_endpoint, endpoint, syspath, long_format=False):
-    """ List files on a remote Agave system
+    Times of day are cached (there are 86400 of them).
     """
-    # Open up the local agave database.
-    agave_context = get_agave_context(agavedb)
+    fields = _clocks.get(clock)
+    if fields is None:
+        fields = (int(clock[0:2]), int(clock[3:5]), int(clock[6:8]))
+        _clocks[clock] = fields
+    return fields
 
-    # Get access token from agave database.
-    access_token = get_access_token(agavedb, token_endpoint)
-    
-    # Make request.                                                             
-    try:
-        endpoint = "{0}{1}/{2}".format(agave_context["current"]["baseurl"], endpoint, syspath)
-        headers  = {"Authorization":"Bearer {0}".format(access_token)}
-        params   = {"pretty": "true"}
-        resp = requests.get(endpoint, headers=headers, params=params)
-    except requests.exceptions.MissingSchema as err:
-        print(err, file=sys.stderr)
-        sys.exit(1)
-    
-    # Handle bad status code.
-    handle_bad_response_status_code(resp)
 
+def parse_agave_time(ftime):
+    """ Convert timestamp from Agave to the time it names
 
-    # Sort results alphabetically.
-    resp.json()["result"] = sorted(resp.json()["result"], key=itemgetter("name"), reverse=True)
-
-    # Get the length of the longest filename.
-    longest_name = 8
-    for f in resp.json()["result"]:
-        if len(f["name"]) > longest_name:
-            longest_name = len(f["name"])
-    largest_file = 0
-    for f in resp.json()["result"]:
-        if len(str(f["length"])) > largest_file:
-            largest_file = len(str(f["length"]))
-
-    # Get size of terminal.
-    try: # python3 prefered
-        terminal_size = shutil.get_terminal_size()
-        terminal_size_columns = terminal_size.columns 
-        columns = terminal_size.columns // longest_name
-    except AttributeError:
-        _rows, columns = os.popen('stty size', 'r').read().split()
-        terminal_size_columns = int(columns)
-        columns = int(columns) // longest_name
-
-    if not long_format:
-        files = ""
-        line_length = 0
-        for f in resp.json()["result"]:
-            name   = f["name"]
-            if f["type"] == "dir":
-                name += "/"
-            name += " " * (longest_name - len(name) + 3)
-
-            if line_length + len(name) > terminal_size_columns:
-                files += "\n"
-                line_length = 0
+    Expect format: 2018-07-10T12:28:01.000-05:00
 
-            line_length += len(name)
-            files += name
+    The fields are sliced out of the fixed format (no strptime), the date,
+    time of day and time zone parts are parsed through caches and the
+    result is memoized. The time is given as written, in the time zone of
+    the timestamp, whose offset is kept in tm_gmtoff (where struct_time has
+    it).
+
+    RETURNS
+    -------
+    ftime : time.struct_time
+    outtime : list
+        Month, day and time, as shown by "ls -l" (i.e., ["Jul", "10", "12:28"]).
+    """
+    parsed = _time_cache.get(ftime)
+    if parsed is not None:
+        return parsed
+
+    year, month, mday, wday, yday = parse_date(ftime[0:10])
+    fields = (year, month, mday) + parse_clock(ftime[11:19]) + (wday, yday, -1)
+    if time.struct_time.n_fields > 9:
+        # Time zone name and offset (python 3).
+        fields += (None, parse_tz_offset(ftime[19:].lstrip(".0123456789")))
+    outtime = [month_names[month - 1], ftime[8:10], ftime[11:16]]
+    parsed = (time.struct_time(fields), outtime)
+
+    if len(_time_cache) >= TIME_CACHE_SIZE:
+        _time_cache.clear()
+    _time_cache[ftime] = parsed
+    return parsed
+
+
+def parse_agave_times(ftimes):
+    """ Convert a batch of timestamps from Agave (see parse_agave_time)
+
+    The same as calling parse_agave_time on each of them, without the cost
+    of a few function calls per timestamp.
+
+    RETURNS
+    -------
+    parsed : list
+        (ftime, outtime) tuples, in the order of ftimes.
+    """
+    time_cache, dates, clocks, tz_offsets = _time_cache, _dates, _clocks, _tz_offsets
+    struct_time = time.struct_time
+    with_offset = struct_time.n_fields > 9
+    parsed = []
+    append = parsed.append
+    for ftime in ftimes:
+        result = time_cache.get(ftime)
+        if result is None:
+            date = dates.get(ftime[0:10]) or parse_date(ftime[0:10])
+            clock = clocks.get(ftime[11:19]) or parse_clock(ftime[11:19])
+            fields = date[:3] + clock + (date[3], date[4], -1)
+            if with_offset:
+                tz = ftime[19:].lstrip(".0123456789")
+                offset = tz_offsets.get(tz)
+                fields += (None, parse_tz_offset(tz) if offset is None else offset)
+            result = (struct_time(fields),
+                      [month_names[date[1] - 1], ftime[8:10], ftime[11:16]])
+            if len(time_cache) >= TIME_CACHE_SIZE:
+                time_cache.clear()
+            time_cache[ftime] = result
+        append(result)
+    return parsed
+
+
+
+
+class ListingFormatter(object):
+    """ Format the entries of a listing as "ls" would, a page at a time
+
+    Pages are formatted as they come, so column widths are those of the
+    widest entries seen so far (the name column is at least 8 characters
+    wide). The short format fills lines up to "columns" characters.
+
+    PARAMETERS
+    ----------
+    long_format : bool
+        One entry per line, with permissions, size and modification time.
+    columns : int
+        Width of the terminal.
+    """
 
-        print(files)
-    else:
-        for f in resp.json()["result"]:
+    def __init__(self, long_format=False, columns=80):
+        self.long_format = long_format
+        self.columns = columns
+        self.longest_name = 8
+        self.largest_file = 0
+        self._line_length = 0
+
+    def widen(self, page):
+        """ Grow the column widths to fit the entries of a page
+        """
+        longest_name = self.longest_name
+        largest_file = self.largest_file
+        for f in page:
+            if len(f["name"]) > longest_name:
+                longest_name = len(f["name"])
+            size = len(str(f["length"]))
+            if size > largest_file:
+                largest_file = size
+        self.longest_name = longest_name
+        self.largest_file = largest_file
+
+    def format_page(self, page):
+        """ Text of the entries of a page
+
+        RETURNS
+        -------
+        text : str
+        """
+        self.widen(page)
+        if self.long_format:
+            return self._format_long(page)
+        return self._format_short(page)
+
+    def finish(self):
+        """ Text ending the listing
+        """
+        return "" if self.long_format else "\n"
+
+    def _format_short(self, page):
+        width = self.longest_name + 3
+        columns = self.columns
+        line_length = self._line_length
+        parts = []
+        for f in page:
+            name = f["name"] + "/" if f["type"] == "dir" else f["name"]
+            cell = name.ljust(width)
+            if line_length + len(cell) > columns:
+                parts.append("\n")
+                line_length = 0
+            line_length += len(cell)
+            parts.append(cell)
+        self._line_length = line_length
+        return "".join(parts)
+
+    def _format_long(self, page):
+        width = self.longest_name + 3
+        line = "{0:<4} {1:>{size_width}} {2:<3} {3:>2} {4:<5} {5:}\n"
+        parts = []
+        # Dates created.
+        times = parse_agave_times([f["lastModified"] for f in page])
+        for f, (ftime, outtime) in zip(page, times):
             # File permissions and name.
-            name   = f["name"]
+            name = f["name"]
             perm = file_permissions[f["permissions"]]
             if f["type"] == "dir":
                 perm = "d{}".format(perm[1:])
                 name += "/"
-            name += " " * (longest_name - len(name) + 3)
+            name = name.ljust(width)
 
-            # File size.
-            fsize = f["length"]
+            parts.append(line.format(perm, f["length"], outtime[0], ftime.tm_mday, outtime[2],
+                                     name, size_width=self.largest_file))
+        return "".join(parts)
 
-            # Date created.
-            ftime, outtime = parse_agave_time( f["lastModified"] )
 
-            print("{0:<4} {1:>{size_width}} {2:<3} {3:>2} {4:<5} {5:}".format(
-                    perm, fsize, outtime[0], ftime.tm_mday, outtime[2], name, 
-                    size_width=largest_file))
+
+def files_list(agavedb, token_endpoint, endpoint, syspath, long_format=False,
+               page_size=DEFAULT_PAGE_SIZE, recursive=False, jobs=DEFAULT_CRAWL_JOBS,
+               checkpoint=None, use_cache=True, cache_ttl=DEFAULT_LISTING_TTL, sort=None,
+               top=None, output="table"):
+    """ List files on a remote Agave system
+
+    The listing is requested "page_size" entries at a time and each page is
+    printed as soon as it arrives, while the next one is fetched, so the
+    first entries of a huge directory show up right away and memory use
+    does not grow with the size of the directory. Entries are printed in
+    the order the files-listings service returns them (see
+    ListingFormatter), through a buffered writer.
+
+    Unless "use_cache" is unset, listings are cached in the local Agave
+    database directory and a listing made less than "cache_ttl" seconds ago
+    is printed without contacting Agave (see ListingCache).
+
+    If "recursive" is set, the whole tree is listed, a directory after the
+    other, breadth first, "jobs" directories at a time (see crawl_remote).
+    The crawl can be resumed from "checkpoint", if set.
+
+    If "sort" ("name", "size" or "mtime") or "top" is set, entries are
+    sorted instead (by name if only "top" is set) and only the first "top"
+    are printed, once the whole listing is in. Pages are ranked as they
+    arrive, holding no more than "top" entries (see SortedListing).
+    Recursive listings are sorted a directory at a time.
+
+    With "output" set to "jsonl", "csv" or "tsv", the fields in file_fields
+    of every entry are printed for other programs instead (see
+    RecordFormatter), with no regard for the terminal or column widths.
+    """
+    if top is not None and sort is None:
+        sort = "name"
+
+    if output == "table":
+        # Get size of terminal.
+        try: # python3 prefered
+            terminal_size_columns = shutil.get_terminal_size().columns
+        except AttributeError:
+            _rows, columns = os.popen('stty size', 'r').read().split()
+            terminal_size_columns = int(columns)
+        formatter = ListingFormatter(long_format, terminal_size_columns)
+    else:
+        terminal_size_columns = None
+        formatter = RecordFormatter(output, file_fields)
+
+    cache = get_listing_cache(agavedb) if use_cache and not recursive else None
+    if cache is not None:
+        entries = cache.get(syspath, cache_ttl)
+        if entries is not None:
+            if sort is not None:
+                ranking = SortedListing(sort, top)
+                ranking.add(entries)
+                entries = ranking.entries()
+            with BufferedWriter() as out:
+                out.write(formatter.format_page(entries))
+                out.write(formatter.finish())
+            return
+
+    # Get an authenticated client for the current tenant.
+    client = get_agave_client(agavedb, token_endpoint, pool_maxsize=2 * jobs)
+
+    agave_system, _, remote_path = syspath.partition("/")
+    params = {"pretty": "true"}
+    if recursive:
+        return list_recursive(client, endpoint, agave_system, remote_path, params,
+                              long_format, terminal_size_columns, page_size, jobs, checkpoint,
+                              sort, top, output)
+
+    # Listing kept for the cache, dropped if it grows too large.
+    entries = [] if cache is not None else None
+    ranking = SortedListing(sort, top) if sort is not None else None
+    with BufferedWriter() as out:
+        try:
+            for page in iter_listing_pages(client, endpoint, agave_system, remote_path, params,
+                                           page_size):
+                if ranking is not None:
+                    ranking.add(page)
+                else:
+                    out.write(formatter.format_page(page))
+                    # Show every page as soon as it is in.
+                    out.flush()
+                if entries is not None:
+                    entries.extend(page)
+                    if len(entries) > DEFAULT_LISTING_CACHE_MAX_ENTRIES:
+                        entries = None
+        except requests.exceptions.HTTPError as err:
+            out.flush()
+            handle_bad_response_status_code(err.response)
+        except requests.exceptions.MissingSchema as err:
+            print(err, file=sys.stderr)
+            sys.exit(1)
+
+        if ranking is not None:
+            out.write(formatter.format_page(ranking.entries()))
+        out.write(formatter.finish())
+
+    if entries is not None:
+        cache.put(syspath, entries)
+
+
+
+def list_recursive(client, endpoint, agave_system, remote_path, params, long_format=False,
+                   columns=80, page_size=DEFAULT_PAGE_SIZE, jobs=DEFAULT_CRAWL_JOBS,
+                   checkpoint=None, sort=None, top=None, output="table"):
+    """ List a directory tree on a remote Agave system, as "ls -R" would
+
+    Every directory gets a "system/path:" header followed by its entries,
+    sorted and cut to the first "top" if "sort" is set (see SortedListing).
+    With "output" set to "jsonl", "csv" or "tsv", the entries of all the
+    directories are printed as records instead, with no directory headers
+    (see RecordFormatter).
+    Directories that cannot be listed are reported and skipped, the exit
+    status is then 1.
+    """
+    failed = []
+
+    def onerror(dirpath, err):
+        failed.append(dirpath)
+        print("Cannot list agave://{0}/{1}: {2}".format(agave_system, dirpath, err),
+              file=sys.stderr)
+
+    records = RecordFormatter(output, file_fields) if output != "table" else None
+    first = True
+    with BufferedWriter() as out:
+        try:
+            for dirpath, entries in crawl_remote(client, endpoint, agave_system, remote_path,
+                                                 params, jobs, onerror, checkpoint,
+                                                 page_size=page_size):
+                if sort is not None:
+                    ranking = SortedListing(sort, top)
+                    ranking.add(entries)
+                    entries = ranking.entries()
+                if records is not None:
+                    out.write(records.format_page(entries))
+                    out.flush()
+                    continue
+                formatter = ListingFormatter(long_format, columns)
+                if not first:
+                    out.write("\n")
+                first = False
+                out.write("{0}:\n".format("/".join(filter(None, [agave_system, dirpath]))))
+                out.write(formatter.format_page(entries))
+                if entries:
+                    out.write(formatter.finish())
+                out.flush()
+        except (requests.exceptions.MissingSchema, ValueError, IOError) as err:
+            out.flush()
+            print(err, file=sys.stderr)
+            sys.exit(1)
+
+        if records is not None:
+            out.write(records.finish())
+
+    if failed:
+        sys.exit(1)
 
 
 
 def files_remove(agavedb, token_endpoint, endpoint, syspath):
     """ Remove a file or direcotry from an Agave system
     """
-    # Get baseurl for tenant.
-    agave_context = get_agave_context(agavedb)
-
-    # Get access token from agave database.
-    access_token = get_access_token(agavedb, token_endpoint)
+    # Get an authenticated client for the current tenant.
+    client = get_agave_client(agavedb, token_endpoint)
 
     # Make request.
     try:
-        endpoint = "{0}{1}/{2}".format(agave_context["current"]["baseurl"], endpoint, syspath)
-        headers  = {"Authorization":"Bearer {0}".format(access_token)}
-        params   = {"pretty": "true"}
-        resp = requests.delete(endpoint, headers=headers, params=params)
+        params = {"pretty": "true"}
+        resp = client.delete(endpoint, syspath, params=params)
     except requests.exceptions.MissingSchema as err:
         print(err, file=sys.stderr)
         sys.exit(1)
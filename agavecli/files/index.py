@@ -0,0 +1,323 @@
+"""
+    index.py
+"""
+from __future__ import print_function, division
+import requests
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+from ..utils import BufferedWriter, RecordFormatter, SQLiteStore, get_agave_client, \
+        handle_bad_response_status_code
+from .listcache import current_tenant, normalize_syspath
+from .listings import DEFAULT_CRAWL_JOBS, DEFAULT_PAGE_SIZE, agave_time_to_seconds, \
+        list_remote_path
+
+
+# Name of the index of remote files, kept next to the local Agave database.
+INDEX_FILE = "index.db"
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# Fields of the entries printed by "fs find --output jsonl|csv|tsv".
+found_fields = ["path", "type", "length", "mtime"]
+
+
+
+def subtree_bounds(dirpath):
+    """ Range of the paths under a directory, for "path >= ? AND path < ?"
+
+    "/" is followed by "0" in code point order, so every "dirpath/..." path
+    falls in ["dirpath/", "dirpath0"), which an index on path can serve.
+    """
+    if not dirpath:
+        return "", u"\U0010ffff"
+    return dirpath + "/", dirpath + "0"
+
+
+
+class NamespaceIndex(SQLiteStore):
+    """ Index of the files and directories of remote Agave systems
+
+    Entries are stored in an SQLite database, keyed by tenant, system and
+    path, along with the modification time of every directory listed, so
+    that the index can be searched without contacting Agave and refreshed
+    by listing again only the directories that changed (see refresh). The
+    index can be shared by concurrent threads.
+
+    PARAMETERS
+    ----------
+    db_path : str
+        Location of the database (created if it does not exist).
+    tenant : str
+        Tenant (and user) the entries belong to.
+    """
+
+    schema = ("""CREATE TABLE IF NOT EXISTS dirs (
+                tenant TEXT NOT NULL,
+                system TEXT NOT NULL,
+                path TEXT NOT NULL,
+                modified TEXT NOT NULL,
+                PRIMARY KEY (tenant, system, path))""",
+              """CREATE TABLE IF NOT EXISTS entries (
+                tenant TEXT NOT NULL,
+                system TEXT NOT NULL,
+                path TEXT NOT NULL,
+                dir TEXT NOT NULL,
+                name TEXT NOT NULL,
+                type TEXT NOT NULL,
+                length INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                PRIMARY KEY (tenant, system, path))""",
+              """CREATE INDEX IF NOT EXISTS entries_dir
+                ON entries (tenant, system, dir)""")
+
+    def __init__(self, db_path, tenant):
+        super(NamespaceIndex, self).__init__(db_path)
+        self.tenant = tenant
+
+    def dir_modified(self, agave_system, dirpath):
+        """ Modification time of a directory when it was indexed, None if it is not
+        """
+        row = self.fetchone(
+            "SELECT modified FROM dirs WHERE tenant = ? AND system = ? AND path = ?",
+            (self.tenant, agave_system, dirpath))
+        return None if row is None else row[0]
+
+    def subdirs(self, agave_system, dirpath):
+        """ Paths of the indexed subdirectories of a directory
+        """
+        rows = self.fetchall(
+            """SELECT path FROM entries
+                WHERE tenant = ? AND system = ? AND dir = ? AND type = 'dir'
+                ORDER BY path""",
+            (self.tenant, agave_system, dirpath))
+        return [row[0] for row in rows]
+
+    def put_dir(self, agave_system, dirpath, entries):
+        """ Replace the indexed contents of a directory with a new listing
+
+        Subdirectories that are gone are dropped along with everything that
+        was indexed under them.
+        """
+        modified = ""
+        rows = []
+        for entry in entries:
+            if entry["name"] == ".":
+                modified = entry["lastModified"]
+                continue
+            entry_path = "/".join(filter(None, [dirpath, entry["name"]]))
+            rows.append((self.tenant, agave_system, entry_path, dirpath, entry["name"],
+                         entry["type"], entry["length"],
+                         agave_time_to_seconds(entry["lastModified"])))
+        current = set(row[2] for row in rows if row[5] == "dir")
+
+        with self.transaction() as db:
+            for subdir in self._subdirs(db, agave_system, dirpath):
+                if subdir not in current:
+                    self._drop_subtree(db, agave_system, subdir)
+            db.execute(
+                "DELETE FROM entries WHERE tenant = ? AND system = ? AND dir = ?",
+                (self.tenant, agave_system, dirpath))
+            db.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            db.execute(
+                "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)",
+                (self.tenant, agave_system, dirpath, modified))
+
+    def _subdirs(self, db, agave_system, dirpath):
+        rows = db.execute(
+            """SELECT path FROM entries
+                WHERE tenant = ? AND system = ? AND dir = ? AND type = 'dir'""",
+            (self.tenant, agave_system, dirpath)).fetchall()
+        return [row[0] for row in rows]
+
+    def _drop_subtree(self, db, agave_system, dirpath):
+        low, high = subtree_bounds(dirpath)
+        for table in ("entries", "dirs"):
+            db.execute(
+                """DELETE FROM {0} WHERE tenant = ? AND system = ? AND
+                    (path = ? OR (path >= ? AND path < ?))""".format(table),
+                (self.tenant, agave_system, dirpath, low, high))
+
+    def find(self, agave_system, dirpath, name=None, entry_type=None, size=None, mtime=None,
+             now=None):
+        """ Search the entries indexed under a directory
+
+        PARAMETERS
+        ----------
+        name : str
+            Glob pattern the name must match (i.e., "*.nc"), case sensitive.
+        entry_type : str
+            "file" or "dir".
+        size : tuple
+            (sign, bytes): larger than (+), smaller than (-) or exactly
+            (no sign) that many bytes.
+        mtime : tuple
+            (sign, days): modified more than (+), less than (-) or exactly
+            (no sign, counting whole days) that many days ago.
+        now : float
+            Time the ages are counted from (defaults to the current time).
+
+        RETURNS
+        -------
+        entries : list
+            (path, type, length, mtime) tuples, sorted by path.
+        """
+        low, high = subtree_bounds(dirpath)
+        query = ["""SELECT path, type, length, mtime FROM entries
+                    WHERE tenant = ? AND system = ? AND path >= ? AND path < ?"""]
+        args = [self.tenant, agave_system, low, high]
+        if name is not None:
+            query.append("AND name GLOB ?")
+            args.append(name)
+        if entry_type is not None:
+            query.append("AND type = ?")
+            args.append(entry_type)
+        if size is not None:
+            sign, nbytes = size
+            query.append({"+": "AND length > ?", "-": "AND length < ?"}.get(sign,
+                                                                             "AND length = ?"))
+            args.append(nbytes)
+        if mtime is not None:
+            sign, days = mtime
+            now = time.time() if now is None else now
+            if sign == "+":
+                query.append("AND mtime < ?")
+                args.append(now - (days + 1) * SECONDS_PER_DAY)
+            elif sign == "-":
+                query.append("AND mtime > ?")
+                args.append(now - days * SECONDS_PER_DAY)
+            else:
+                query.append("AND mtime <= ? AND mtime > ?")
+                args.extend([now - days * SECONDS_PER_DAY, now - (days + 1) * SECONDS_PER_DAY])
+        query.append("ORDER BY path")
+
+        return self.fetchall(" ".join(query), args)
+
+
+
+def get_namespace_index(agavedb):
+    """ Open the index of remote files kept in the local Agave database directory
+
+    Entries are indexed for the current tenant and user.
+    """
+    return NamespaceIndex(path.join(agavedb, INDEX_FILE), current_tenant(agavedb))
+
+
+
+def refresh_index(index, client, endpoint, agave_system, remote_path, params,
+                  jobs=DEFAULT_CRAWL_JOBS, onerror=None, page_size=DEFAULT_PAGE_SIZE):
+    """ Bring the index of a remote directory tree up to date
+
+    The tree is walked a level at a time, "jobs" directories at once. A
+    directory that was indexed before is first checked with a one entry
+    listing (its "." entry): if its modification time has not changed its
+    indexed contents are kept, otherwise it is listed again in full.
+    Subdirectories are always checked, since changes deep in a tree do not
+    change the modification time of the directories above.
+
+    PARAMETERS
+    ----------
+    onerror : function
+        Called with the directory path and the exception if a subdirectory
+        cannot be listed (it is then left as it was indexed). Errors listing
+        remote_path itself are raised.
+
+    RETURNS
+    -------
+    listed : int
+        Number of directories listed in full.
+
+    Raise requests.exceptions.HTTPError if remote_path cannot be listed and
+    ValueError if it is not a directory.
+    """
+    remote_path = remote_path.strip("/")
+
+    def refresh_dir(dirpath):
+        modified = index.dir_modified(agave_system, dirpath)
+        if modified is not None:
+            resp = client.get(endpoint, agave_system, dirpath,
+                              params=dict(params, limit=1, offset=0))
+            resp.raise_for_status()
+            head = resp.json()["result"]
+            if head and head[0]["name"] == "." and head[0]["lastModified"] == modified:
+                return False, index.subdirs(agave_system, dirpath)
+
+        entries = list_remote_path(client, endpoint, agave_system, dirpath, params, page_size)
+        if not entries or entries[0]["name"] != ".":
+            raise ValueError("agave://{0}/{1} is not a directory".format(agave_system, dirpath))
+        index.put_dir(agave_system, dirpath, entries)
+        subdirs = ["/".join(filter(None, [dirpath, entry["name"]])) for entry in entries
+                   if entry["type"] == "dir" and entry["name"] != "."]
+        return True, subdirs
+
+    def refresh_subdir(dirpath):
+        try:
+            return refresh_dir(dirpath)
+        except (requests.exceptions.RequestException, ValueError) as err:
+            if onerror is None:
+                raise
+            onerror(dirpath, err)
+            return False, []
+
+    listed, level = refresh_dir(remote_path)
+    listed = int(listed)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while level:
+            next_level = []
+            for was_listed, subdirs in executor.map(refresh_subdir, level):
+                listed += was_listed
+                next_level.extend(subdirs)
+            level = next_level
+
+    return listed
+
+
+
+def files_find(agavedb, token_endpoint, endpoint, syspath, name=None, entry_type=None,
+               size=None, mtime=None, update=False, jobs=DEFAULT_CRAWL_JOBS, output="table"):
+    """ Find files on a remote Agave system, as "find" would
+
+    Entries under syspath matching every test given (see
+    NamespaceIndex.find) are searched in a local index of the remote files
+    kept in the local Agave database directory, and printed as
+    "system/path". The tree is indexed first if it has not been, and
+    refreshed first if "update" is set (see refresh_index), "jobs"
+    directories at a time. With "output" set to "jsonl", "csv" or "tsv",
+    the path, type, length and modification time (seconds since the epoch)
+    of the entries are printed as records (see RecordFormatter).
+    """
+    index = get_namespace_index(agavedb)
+    agave_system, _, remote_path = normalize_syspath(syspath).partition("/")
+
+    if update or index.dir_modified(agave_system, remote_path) is None:
+        # Get an authenticated client for the current tenant.
+        client = get_agave_client(agavedb, token_endpoint, pool_maxsize=2 * jobs)
+
+        def onerror(dirpath, err):
+            print("Cannot list agave://{0}/{1}: {2}".format(agave_system, dirpath, err),
+                  file=sys.stderr)
+
+        try:
+            refresh_index(index, client, endpoint, agave_system, remote_path,
+                          {"pretty": "true"}, jobs, onerror)
+        except requests.exceptions.HTTPError as err:
+            handle_bad_response_status_code(err.response)
+        except (requests.exceptions.MissingSchema, ValueError) as err:
+            print(err, file=sys.stderr)
+            sys.exit(1)
+
+    records = RecordFormatter(output, found_fields) if output != "table" else None
+    with BufferedWriter() as out:
+        for entry_path, found_type, length, modified in index.find(
+                agave_system, remote_path, name, entry_type, size, mtime):
+            syspath = "{0}/{1}".format(agave_system, entry_path)
+            if records is not None:
+                out.write(records.format_page([{"path": syspath, "type": found_type,
+                                                "length": length, "mtime": modified}]))
+            else:
+                out.write(syspath + "\n")
+        if records is not None:
+            out.write(records.finish())
+    index.close()
@@ -0,0 +1,124 @@
+"""
+    listcache.py
+"""
+from __future__ import print_function
+import json
+import time
+from os import path
+from ..utils import SQLiteStore, get_agave_context
+
+
+# Name of the listing cache, kept next to the local Agave database.
+LISTING_CACHE_FILE = "listings.db"
+
+# Seconds a cached listing is served for.
+DEFAULT_LISTING_TTL = 60
+
+# Listings with more entries than this are not cached.
+DEFAULT_LISTING_CACHE_MAX_ENTRIES = 100000
+
+
+
+def normalize_syspath(syspath):
+    """ Key of a remote path in the cache (i.e., "system/dir")
+
+    Accept "system/dir", "system/dir/" or "agave://system/dir".
+    """
+    if syspath.startswith("agave://"):
+        syspath = syspath[len("agave://"):]
+    return syspath.strip("/")
+
+
+
+class ListingCache(SQLiteStore):
+    """ Listings of remote directories, keyed by tenant and system path
+
+    Listings are stored in an SQLite database along with the time they were
+    made, so that listing the same directory again within a few seconds is
+    served locally. Commands that change a remote directory invalidate its
+    listing (see invalidate).
+
+    PARAMETERS
+    ----------
+    db_path : str
+        Location of the database (created if it does not exist).
+    tenant : str
+        Tenant (and user) the listings belong to.
+    """
+
+    schema = ("""CREATE TABLE IF NOT EXISTS listings (
+                tenant TEXT NOT NULL,
+                syspath TEXT NOT NULL,
+                created REAL NOT NULL,
+                entries TEXT NOT NULL,
+                PRIMARY KEY (tenant, syspath))""",)
+
+    def __init__(self, db_path, tenant):
+        super(ListingCache, self).__init__(db_path)
+        self.tenant = tenant
+
+    def get(self, syspath, ttl=DEFAULT_LISTING_TTL):
+        """ Get the listing of a remote path, None if it is not cached
+
+        Listings older than "ttl" seconds are not returned.
+        """
+        row = self.fetchone(
+            "SELECT created, entries FROM listings WHERE tenant = ? AND syspath = ?",
+            (self.tenant, normalize_syspath(syspath)))
+        if row is None or time.time() - row[0] > ttl:
+            return None
+        return json.loads(row[1])
+
+    def put(self, syspath, entries):
+        """ Cache the listing of a remote path, replacing any previous one
+        """
+        with self.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?)",
+                (self.tenant, normalize_syspath(syspath), time.time(), json.dumps(entries)))
+
+    def invalidate(self, syspath):
+        """ Drop the cached listings a change to a remote path makes stale
+
+        That is the listing of the path itself, of its parent directory and
+        of everything under it.
+        """
+        syspath = normalize_syspath(syspath)
+        parent = syspath.rpartition("/")[0]
+        prefix = syspath.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        with self.transaction() as db:
+            db.execute(
+                """DELETE FROM listings WHERE tenant = ? AND
+                    (syspath = ? OR syspath = ? OR syspath LIKE ? ESCAPE '\\')""",
+                (self.tenant, syspath, parent, prefix + "/%"))
+
+
+
+def current_tenant(agavedb):
+    """ Key of the current tenant and user in local caches (i.e., user@baseurl)
+    """
+    current = get_agave_context(agavedb)["current"]
+    return "{0}@{1}".format(current.get("username", ""), current["baseurl"])
+
+
+
+def get_listing_cache(agavedb):
+    """ Open the listing cache kept in the local Agave database directory
+
+    Listings are cached for the current tenant and user.
+    """
+    return ListingCache(path.join(agavedb, LISTING_CACHE_FILE), current_tenant(agavedb))
+
+
+
+def invalidate_listings(agavedb, *syspaths):
+    """ Drop the cached listings made stale by changes to remote paths
+
+    Paths are given as "system/path" or "agave://system/path".
+    """
+    cache = get_listing_cache(agavedb)
+    try:
+        for syspath in syspaths:
+            cache.invalidate(syspath)
+    finally:
+        cache.close()
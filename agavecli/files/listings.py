@@ -0,0 +1,362 @@
+"""
+    listings.py
+"""
+from __future__ import print_function
+import calendar
+import heapq
+import json
+import os
+import requests
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .listcache import DEFAULT_LISTING_CACHE_MAX_ENTRIES, DEFAULT_LISTING_TTL
+
+
+# Number of entries requested per page of a listing.
+DEFAULT_PAGE_SIZE = 1000
+
+# Number of directories listed concurrently by a crawl.
+DEFAULT_CRAWL_JOBS = 8
+
+# Seconds between saves of the checkpoint of a crawl.
+DEFAULT_CHECKPOINT_INTERVAL = 5
+
+
+
+def agave_time_to_seconds(ftime):
+    """ Convert a timestamp from Agave to seconds since the epoch
+
+    Expect format: 2018-07-10T12:28:01.000-05:00
+    """
+    seconds = calendar.timegm((
+        int(ftime[0:4]), int(ftime[5:7]), int(ftime[8:10]),
+        int(ftime[11:13]), int(ftime[14:16]), int(ftime[17:19]), 0, 0, 0))
+
+    # Fraction of a second and time zone (i.e., ".000-05:00" or "Z").
+    rest = ftime[19:]
+    if rest.endswith("Z"):
+        rest, offset = rest[:-1], 0
+    elif len(rest) >= 6 and rest[-6] in "+-":
+        sign = -1 if rest[-6] == "-" else 1
+        offset = sign * (int(rest[-5:-3]) * 3600 + int(rest[-2:]) * 60)
+        rest = rest[:-6]
+    else:
+        offset = 0
+    if rest.startswith("."):
+        seconds += float("0" + rest)
+
+    return seconds - offset
+
+
+
+def iter_listing_pages(client, endpoint, agave_system, remote_path, params,
+                       page_size=DEFAULT_PAGE_SIZE):
+    """ List a file or directory on a remote Agave system, a page at a time
+
+    Pages of "page_size" entries are requested through the "limit" and
+    "offset" parameters of the files-listings service. The next page is
+    fetched in the background while the current one is consumed, and only
+    those two are held in memory.
+
+    RETURNS
+    -------
+    pages : generator
+        Lists of file objects, as returned by the Agave API.
+
+    Raise requests.exceptions.HTTPError if the listing is rejected.
+    """
+    def fetch(offset):
+        page_params = dict(params, limit=page_size, offset=offset)
+        resp = client.get(endpoint, agave_system, remote_path, params=page_params)
+        resp.raise_for_status()
+        return resp.json()["result"]
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        offset = 0
+        future = executor.submit(fetch, offset)
+        while future is not None:
+            page = future.result()
+            offset += len(page)
+            # A short (or empty) page is the last one.
+            future = executor.submit(fetch, offset) if page and len(page) >= page_size else None
+            yield page
+
+
+
+def list_remote_path(client, endpoint, agave_system, remote_path, params,
+                     page_size=DEFAULT_PAGE_SIZE):
+    """ List a file or directory on a remote Agave system
+
+    The listing of a directory starts with an entry for the directory itself
+    (named "."), the listing of a file only has the file's entry. Large
+    directories are listed "page_size" entries at a time (see
+    iter_listing_pages).
+
+    PARAMETERS
+    ----------
+    client : AgaveClient
+    endpoint : str
+        Files-listings service endpoint (i.e., files/v2/listings/system).
+    agave_system : str
+        System id.
+    remote_path : str
+        Path relative to the system's root.
+
+    RETURNS
+    -------
+    entries : list
+        File objects, as returned by the Agave API.
+
+    Raise requests.exceptions.HTTPError if the listing is rejected.
+    """
+    entries = []
+    for page in iter_listing_pages(client, endpoint, agave_system, remote_path, params,
+                                   page_size):
+        entries.extend(page)
+
+    return entries
+
+
+
+# Orders a listing can be sorted in: by name, largest first, most recently
+# modified first (ties broken by name).
+sort_keys = {
+    "name"  : lambda entry: entry["name"],
+    "size"  : lambda entry: (-entry["length"], entry["name"]),
+    "mtime" : lambda entry: (-agave_time_to_seconds(entry["lastModified"]), entry["name"]),
+}
+
+
+
+class SortedListing(object):
+    """ Entries of a listing in sorted order, added a page at a time
+
+    Every entry gets its sort key once, as it is added. With "top" set,
+    only the first "top" entries are needed: entries are buffered and the
+    buffer is cut back to the first "top" (through a bounded heap) whenever
+    it reaches twice that, so a listing of n entries is ranked in
+    O(n log top) time holding at most 2 * "top" entries and a page.
+    Otherwise all the entries are kept and sorted at the end.
+
+    PARAMETERS
+    ----------
+    sort : str
+        Key of sort_keys ("name", "size" or "mtime").
+    top : int
+        Number of entries to keep (all of them if None).
+    """
+
+    def __init__(self, sort="name", top=None):
+        self.key = sort_keys[sort]
+        self.top = top
+        # (key, position, entry): the position breaks ties, entries are
+        # never compared.
+        self._entries = []
+        self._count = 0
+
+    def add(self, page):
+        key = self.key
+        count = self._count
+        self._entries.extend((key(entry), count + i, entry) for i, entry in enumerate(page))
+        self._count = count + len(page)
+        if self.top is not None and len(self._entries) >= 2 * self.top:
+            self._entries = heapq.nsmallest(self.top, self._entries)
+
+    def entries(self):
+        """ The entries kept, sorted
+        """
+        if self.top is None:
+            ranked = sorted(self._entries)
+        else:
+            ranked = heapq.nsmallest(self.top, self._entries)
+        return [entry for _, _, entry in ranked]
+
+
+
+def walk_remote(client, endpoint, agave_system, remote_path, params, onerror=None):
+    """ Walk a directory tree on a remote Agave system
+
+    Yield a (dirpath, dirnames, files) tuple for each directory, top-down,
+    the same way os.walk does. "files" are the listing entries of the files
+    in dirpath. Removing names from dirnames prunes the walk.
+
+    PARAMETERS
+    ----------
+    onerror : function
+        Called with the directory path and the exception if a directory
+        cannot be listed (the directory is then skipped). By default the
+        exception is raised.
+
+    Raise ValueError if remote_path is not a directory.
+    """
+    remote_path = remote_path.strip("/")
+    try:
+        entries = list_remote_path(client, endpoint, agave_system, remote_path, params)
+    except requests.exceptions.RequestException as err:
+        if onerror is None:
+            raise
+        onerror(remote_path, err)
+        return
+    # The listing of a file only has the file's entry.
+    if not entries or entries[0]["name"] != ".":
+        raise ValueError("agave://{0}/{1} is not a directory".format(agave_system, remote_path))
+
+    dirnames = []
+    files = []
+    for entry in entries:
+        if entry["name"] == ".":
+            continue
+        if entry["type"] == "dir":
+            dirnames.append(entry["name"])
+        else:
+            files.append(entry)
+
+    yield remote_path, dirnames, files
+
+    for dirname in dirnames:
+        subdir = "{0}/{1}".format(remote_path, dirname) if remote_path else dirname
+        for walked in walk_remote(client, endpoint, agave_system, subdir, params, onerror):
+            yield walked
+
+
+
+def load_crawl_checkpoint(checkpoint, agave_system, remote_path):
+    """ Get the directories left to list by an interrupted crawl
+
+    RETURNS
+    -------
+    pending : list
+        Directories, in the order they were to be listed. None if there is
+        no checkpoint.
+
+    Raise ValueError if the checkpoint is unreadable or belongs to the crawl
+    of another tree.
+    """
+    if not os.path.isfile(checkpoint):
+        return None
+    with open(checkpoint, "r") as f:
+        state = json.load(f)
+    if state.get("system") != agave_system or state.get("root") != remote_path:
+        raise ValueError("{0} is the checkpoint of a crawl of agave://{1}/{2}".format(
+            checkpoint, state.get("system"), state.get("root")))
+    return state["pending"]
+
+
+
+def save_crawl_checkpoint(checkpoint, agave_system, remote_path, pending):
+    """ Save the directories left to list by a crawl
+
+    The checkpoint is written next to its final name and moved over it, so
+    that an interrupted save leaves the previous checkpoint in place.
+    """
+    state = {"system": agave_system, "root": remote_path, "pending": list(pending)}
+    tmp = checkpoint + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.rename(tmp, checkpoint)
+
+
+
+def crawl_remote(client, endpoint, agave_system, remote_path, params, jobs=DEFAULT_CRAWL_JOBS,
+                 onerror=None, checkpoint=None, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+                 page_size=DEFAULT_PAGE_SIZE, cache=None, cache_ttl=DEFAULT_LISTING_TTL):
+    """ Crawl a directory tree on a remote Agave system, breadth first
+
+    Up to "jobs" directories are listed at once, ahead of the one being
+    yielded, but directories are yielded in breadth first order (each level
+    in the order of the listings) whatever order their listings complete in.
+
+    If "checkpoint" is set, the directories left to list are saved in that
+    file every "checkpoint_interval" seconds and when the crawl is stopped
+    before the end. A crawl started with an existing checkpoint picks up
+    from it (directories that were already yielded are not yielded again).
+    The checkpoint is removed once the crawl completes.
+
+    If "cache" (a ListingCache) is given, directories listed less than
+    "cache_ttl" seconds ago are taken from it, and new listings are added
+    to it.
+
+    PARAMETERS
+    ----------
+    onerror : function
+        Called with the directory path and the exception if a directory
+        cannot be listed (the directory is then skipped). By default the
+        exception is raised.
+
+    RETURNS
+    -------
+    directories : generator
+        (dirpath, entries) tuples, entries being the file objects in dirpath
+        (without the "." entry).
+
+    Raise ValueError if the checkpoint belongs to another crawl.
+    """
+    remote_path = remote_path.strip("/")
+    pending = None
+    if checkpoint is not None:
+        pending = load_crawl_checkpoint(checkpoint, agave_system, remote_path)
+    # Directories in the order they are yielded, the first ones being listed.
+    queue = deque((dirpath, None) for dirpath in (pending or [remote_path]))
+
+    def list_dir(dirpath):
+        syspath = "{0}/{1}".format(agave_system, dirpath)
+        if cache is not None:
+            entries = cache.get(syspath, cache_ttl)
+            if entries is not None:
+                return entries
+        entries = list_remote_path(client, endpoint, agave_system, dirpath, params, page_size)
+        if cache is not None and len(entries) <= DEFAULT_LISTING_CACHE_MAX_ENTRIES:
+            cache.put(syspath, entries)
+        return entries
+
+    last_save = time.time()
+    completed = False
+    current = None
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        try:
+            while queue:
+                # Keep "jobs" listings in flight.
+                for i in range(min(jobs, len(queue))):
+                    dirpath, future = queue[i]
+                    if future is None:
+                        queue[i] = (dirpath, executor.submit(list_dir, dirpath))
+
+                current, future = queue.popleft()
+                try:
+                    entries = [entry for entry in future.result() if entry["name"] != "."]
+                except requests.exceptions.RequestException as err:
+                    if onerror is None:
+                        raise
+                    onerror(current, err)
+                    current = None
+                    continue
+
+                yield current, entries
+
+                # Subdirectories are queued once the directory is done with,
+                # so that a resumed crawl does not list them twice.
+                for entry in entries:
+                    if entry["type"] == "dir":
+                        queue.append(("{0}/{1}".format(current, entry["name"]).lstrip("/"),
+                                      None))
+                current = None
+
+                if checkpoint is not None and time.time() - last_save >= checkpoint_interval:
+                    save_crawl_checkpoint(checkpoint, agave_system, remote_path,
+                                          [dirpath for dirpath, _ in queue])
+                    last_save = time.time()
+            completed = True
+        finally:
+            for _, future in queue:
+                if future is not None:
+                    future.cancel()
+            if checkpoint is not None:
+                if completed:
+                    if os.path.isfile(checkpoint):
+                        os.remove(checkpoint)
+                else:
+                    # The directory being yielded is listed again on resume.
+                    left = ([current] if current is not None else []) + \
+                            [dirpath for dirpath, _ in queue]
+                    save_crawl_checkpoint(checkpoint, agave_system, remote_path, left)
@@ -0,0 +1,61 @@
+"""
+    ratelimit.py
+"""
+from __future__ import print_function
+import threading
+import time
+
+
+# Seconds of transfer at full rate that may go through without waiting.
+DEFAULT_BURST_SECONDS = 0.25
+
+_clock = getattr(time, "monotonic", time.time)
+
+
+
+class RateLimiter(object):
+    """ Token bucket shared by concurrent transfers
+
+    Every byte sent or received takes a token. Tokens are added at "rate"
+    per second, up to "burst" of them. A transfer taking more tokens than
+    there are goes into debt and waits for as long as it takes the bucket to
+    refill, so the aggregate rate of all the threads sharing the limiter
+    stays at "rate" while a single transfer only waits when it gets ahead
+    of it (not after every chunk).
+
+    PARAMETERS
+    ----------
+    rate : int
+        Bytes per second.
+    burst : int
+        Size of the bucket in bytes (defaults to DEFAULT_BURST_SECONDS worth
+        of transfer).
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate * DEFAULT_BURST_SECONDS)
+        self._tokens = self.burst
+        self._last = _clock()
+        self._lock = threading.Lock()
+
+    def consume(self, size):
+        """ Take "size" tokens, waiting until the bucket can afford them
+        """
+        with self._lock:
+            now = _clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= size
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+
+def iter_limited(chunks, limiter):
+    """ Pass chunks through at the pace allowed by "limiter"
+    """
+    for chunk in chunks:
+        limiter.consume(len(chunk))
+        yield chunk
@@ -0,0 +1,243 @@
+"""
+    streams.py
+"""
+from __future__ import print_function
+import os
+import threading
+import uuid
+from .ratelimit import iter_limited
+try: # python 2
+    import Queue as queue
+except ImportError: # python 3
+    import queue
+
+
+# Size of the chunks data is read and written in.
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Number of chunks that may be buffered in memory between a download and an
+# upload.
+DEFAULT_STREAM_BUFFERED_CHUNKS = 16
+
+
+def copy_response(resp, f, chunk_size=DEFAULT_CHUNK_SIZE, hasher=None, limiter=None):
+    """ Write the body of a streamed response into a file
+
+    The body is read and written "chunk_size" bytes at a time (decoded on
+    the fly if it has a content encoding, i.e., gzip). Large chunks keep
+    the number of reads, writes and loop iterations per file low.
+
+    PARAMETERS
+    ----------
+    resp : requests.Response
+        Response of a request made with stream=True.
+    f : file
+        File opened in binary mode.
+    hasher : hashlib hash
+        Updated with the data as it is written (i.e., hashlib.sha256()).
+    limiter : RateLimiter
+        Limiter to pace the copy with (see ratelimit.py).
+
+    RETURNS
+    -------
+    size : int
+        Number of bytes written.
+    """
+    size = 0
+    for chunk in resp.iter_content(chunk_size=chunk_size):
+        f.write(chunk)
+        if hasher is not None:
+            hasher.update(chunk)
+        if limiter is not None:
+            limiter.consume(len(chunk))
+        size += len(chunk)
+    return size
+
+
+
+class StreamPipe(object):
+    """ Bounded in-memory buffer between a producer and a consumer
+
+    Chunks are pulled from an iterable by a background thread and handed
+    over, in order, to whoever iterates over the pipe. At most
+    "max_buffered" chunks are held in memory, so the producer is throttled
+    to the pace of the consumer. An exception raised by the producer is
+    raised again in the consumer.
+    """
+
+    _end = object()
+
+    def __init__(self, chunks, max_buffered=DEFAULT_STREAM_BUFFERED_CHUNKS):
+        self._queue = queue.Queue(max_buffered)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._produce, args=(chunks,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, chunks):
+        try:
+            for chunk in chunks:
+                if chunk and not self._put(chunk):
+                    return
+        except Exception as err:
+            self._put(err)
+            return
+        self._put(self._end)
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is self._end:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def close(self):
+        """ Stop the producer (i.e., when the consumer gave up)
+        """
+        self._closed.set()
+
+
+
+class MultipartStream(object):
+    """ Streamed multipart/form-data body holding a single file
+
+    The body is generated as it is read, so the file contents never have to
+    be held in memory. If the length of the contents is known the body can be
+    sent with a Content-Length header, otherwise requests sends it with
+    chunked transfer encoding.
+
+    PARAMETERS
+    ----------
+    fieldname : str
+        Name of the form field (i.e., fileToUpload).
+    filename : str
+        Name of the uploaded file.
+    chunks : iterable
+        File contents, as an iterable of bytes.
+    length : int
+        Size of the file contents in bytes (None if unknown).
+    fields : dict
+        Other form fields to send before the file.
+    """
+
+    def __init__(self, fieldname, filename, chunks, length=None, fields=None):
+        boundary = uuid.uuid4().hex
+        self.content_type = "multipart/form-data; boundary={0}".format(boundary)
+
+        head = []
+        for name, value in sorted((fields or {}).items()):
+            head.append("--{0}\r\n".format(boundary))
+            head.append("Content-Disposition: form-data; name=\"{0}\"\r\n\r\n".format(name))
+            head.append("{0}\r\n".format(value))
+        head.append("--{0}\r\n".format(boundary))
+        head.append("Content-Disposition: form-data; name=\"{0}\"; filename=\"{1}\"\r\n".format(
+            fieldname, filename))
+        head.append("Content-Type: application/octet-stream\r\n\r\n")
+        self._head = "".join(head).encode("utf-8")
+        self._tail = "\r\n--{0}--\r\n".format(boundary).encode("utf-8")
+
+        # requests looks for a "len" attribute to set the Content-Length.
+        if length is not None:
+            self.len = len(self._head) + length + len(self._tail)
+
+        self._parts = self._iter_parts(chunks)
+        self._buffer = b""
+        self._offset = 0
+
+    def _iter_parts(self, chunks):
+        yield self._head
+        for chunk in chunks:
+            yield chunk
+        yield self._tail
+
+    def __iter__(self):
+        if self._offset < len(self._buffer):
+            yield self._buffer[self._offset:]
+        self._buffer = b""
+        self._offset = 0
+        for part in self._parts:
+            yield part
+
+    def read(self, size=-1):
+        """ Read up to "size" bytes of the body (all of it if size < 0)
+        """
+        if size is None or size < 0:
+            return b"".join(self)
+
+        while self._offset >= len(self._buffer):
+            try:
+                self._buffer = next(self._parts)
+            except StopIteration:
+                return b""
+            self._offset = 0
+
+        data = self._buffer[self._offset:self._offset + size]
+        self._offset += len(data)
+        return data
+
+    @property
+    def headers(self):
+        return {"Content-Type": self.content_type}
+
+
+
+def iter_file(f, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Iterate over the contents of a file, "chunk_size" bytes at a time
+    """
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+
+def iter_hashed(chunks, hasher):
+    """ Pass chunks through, updating "hasher" with each of them
+    """
+    for chunk in chunks:
+        hasher.update(chunk)
+        yield chunk
+
+
+
+def file_multipart_stream(f, filename=None, fieldname="fileToUpload",
+                          chunk_size=DEFAULT_CHUNK_SIZE, hasher=None, limiter=None):
+    """ Streamed multipart/form-data body to upload an open file
+
+    The file is read "chunk_size" bytes at a time as the body is sent, so
+    uploading a file takes the same amount of memory whatever its size
+    (requests' "files" argument reads the whole file into memory).
+
+    PARAMETERS
+    ----------
+    f : file
+        File opened in binary mode.
+    filename : str
+        Name of the uploaded file (defaults to the base name of f).
+    hasher : hashlib hash
+        Updated with the contents of the file as they are sent.
+    limiter : RateLimiter
+        Limiter to pace the upload with (see ratelimit.py).
+    """
+    if filename is None:
+        filename = os.path.basename(f.name)
+    length = os.fstat(f.fileno()).st_size - f.tell()
+
+    chunks = iter_file(f, chunk_size)
+    if hasher is not None:
+        chunks = iter_hashed(chunks, hasher)
+    if limiter is not None:
+        chunks = iter_limited(chunks, limiter)
+    return MultipartStream(fieldname, filename, chunks, length)
@@ -0,0 +1,424 @@
+"""
+    sync.py
+"""
+from __future__ import print_function
+import os
+import requests
+import shutil
+import sys
+from os import path
+from ..utils import get_agave_client, handle_bad_response_status_code
+from .checksums import file_checksum, get_checksum_cache, remote_checksum
+from .copy import download_file, split_agave_uri, upload_file
+from .directories import make_remote_dir
+from .listings import agave_time_to_seconds, walk_remote
+from .ratelimit import RateLimiter
+from .streams import DEFAULT_CHUNK_SIZE
+from .transfers import DEFAULT_JOBS, TransferOptions, TransferReport, run_transfers, \
+        transfer_errors
+
+
+# Modification times closer than this many seconds are considered the same
+# (Agave reports them to the millisecond, filesystems may round them).
+MTIME_TOLERANCE = 1
+
+
+
+def local_tree(root):
+    """ Describe every file and directory under a local directory
+
+    RETURNS
+    -------
+    tree : dict
+        Path relative to root ("/" separated) to a dict with the "type"
+        ("file" or "dir"), "length", and "mtime" (seconds since the epoch) of
+        the entry. None if root does not exist.
+    """
+    if not path.isdir(root):
+        return None
+
+    tree = dict()
+    for dirpath, dirnames, filenames in os.walk(root):
+        relpath = path.relpath(dirpath, root)
+        prefix = "" if relpath == "." else "/".join(relpath.split(os.sep)) + "/"
+        for name in dirnames:
+            tree[prefix + name] = {"type": "dir", "length": 0, "mtime": 0}
+        for name in filenames:
+            info = os.stat(path.join(dirpath, name))
+            tree[prefix + name] = {
+                "type": "file", "length": info.st_size, "mtime": info.st_mtime}
+    return tree
+
+
+
+def remote_tree(client, endpoint, agave_system, root, params):
+    """ Describe every file and directory under a remote directory
+
+    The tree is crawled through the files-listings service ("endpoint").
+
+    RETURNS
+    -------
+    tree : dict
+        Same as local_tree, files also have the "checksum" of their listing
+        entry (if any). None if root does not exist.
+
+    Raise requests.exceptions.HTTPError if a directory cannot be listed.
+    """
+    root = root.strip("/")
+    tree = dict()
+    try:
+        for dirpath, dirnames, files in walk_remote(client, endpoint, agave_system, root, params):
+            relpath = dirpath[len(root):].strip("/")
+            prefix = relpath + "/" if relpath else ""
+            for name in dirnames:
+                tree[prefix + name] = {"type": "dir", "length": 0, "mtime": 0}
+            for entry in files:
+                tree[prefix + entry["name"]] = {
+                    "type": "file",
+                    "length": entry["length"],
+                    "mtime": agave_time_to_seconds(entry["lastModified"]),
+                    "checksum": entry.get("checksum"),
+                }
+    except requests.exceptions.HTTPError as err:
+        if err.response.status_code == 404 and not tree:
+            return None
+        raise
+    return tree
+
+
+
+def needs_transfer(source, target):
+    """ Tell whether a file has to be copied over its target
+
+    A file is copied if the target is missing, has a different size, or is
+    older than the source.
+    """
+    if target is None or target["type"] != source["type"]:
+        return True
+    return source["length"] != target["length"] or \
+            source["mtime"] > target["mtime"] + MTIME_TOLERANCE
+
+
+
+def plan_sync(source, target, delete=False, changed=None):
+    """ Work out what has to be done to make target mirror source
+
+    PARAMETERS
+    ----------
+    source : dict
+        Tree to mirror (see local_tree).
+    target : dict
+        Tree to update (see local_tree).
+    delete : bool
+        Delete what is in target but not in source.
+    changed : function
+        Called with the path of a file that looks the same in source and
+        target, returns True if the file has to be copied anyway (i.e., the
+        checksums differ).
+
+    RETURNS
+    -------
+    plan : list
+        (action, path) tuples, where action is "mkdir", "copy", or "delete".
+        Paths of the wrong type in target (i.e., a directory where source
+        has a file) are deleted first, then directories are made top-down,
+        then files are copied, and paths missing from source are deleted
+        last. Only the topmost path of a deleted tree is listed.
+    """
+    replaced = []
+    deletes = []
+    removed = set()
+    for relpath in sorted(target):
+        parent = relpath.rpartition("/")[0]
+        while parent and parent not in removed:
+            parent = parent.rpartition("/")[0]
+        if parent:
+            continue
+        if relpath in source:
+            if source[relpath]["type"] == target[relpath]["type"]:
+                continue
+            replaced.append(("delete", relpath))
+        elif delete:
+            deletes.append(("delete", relpath))
+        else:
+            continue
+        removed.add(relpath)
+
+    mkdirs = []
+    copies = []
+    for relpath in sorted(source):
+        current = None if relpath in removed else target.get(relpath)
+        if source[relpath]["type"] == "dir":
+            if current is None:
+                mkdirs.append(("mkdir", relpath))
+        elif needs_transfer(source[relpath], current) or (changed and changed(relpath)):
+            copies.append(("copy", relpath))
+
+    return replaced + mkdirs + copies + deletes
+
+
+
+def run_plan(plan, source, make_dir, copy, remove, jobs=DEFAULT_JOBS, report=None):
+    """ Carry out a sync plan (see plan_sync)
+
+    Deletes that make room for a path of another type and directories are
+    done one at a time, in order. Copies and the remaining deletes are then
+    run through a pool of "jobs" workers.
+
+    PARAMETERS
+    ----------
+    source : dict
+        Tree being mirrored.
+    make_dir : function
+        Called with the path of a directory to make.
+    copy : function
+        Called with the path of a file to copy, returns a (name, function,
+        args) transfer (see run_transfers).
+    remove : function
+        Called with a path to delete, returns a (name, function, args)
+        transfer.
+
+    RETURNS
+    -------
+    report : TransferReport
+    """
+    if report is None:
+        report = TransferReport()
+
+    for action, relpath in plan:
+        if action == "copy" or (action == "delete" and relpath not in source):
+            continue
+        if action == "delete":
+            name, function, args = remove(relpath)
+        else:
+            name, function, args = relpath + "/", make_dir, (relpath,)
+        try:
+            function(*args)
+        except transfer_errors as err:
+            report.record(name, err)
+
+    def transfers():
+        for action, relpath in plan:
+            if action == "copy":
+                yield copy(relpath)
+            elif action == "delete" and relpath not in source:
+                yield remove(relpath)
+
+    return run_transfers(transfers(), jobs, report)
+
+
+
+def contents_differ(local_path, entry, options):
+    """ Tell whether a local file and a remote one have different checksums
+
+    The checksum of the local file comes from the checksum cache if the file
+    has not changed since it was last checksummed. Files are assumed to be
+    the same if the remote one has no checksum.
+    """
+    expected = remote_checksum(entry, options.algorithm)
+    if expected is None:
+        return False
+    return expected != file_checksum(local_path, options.checksum_cache, options.algorithm,
+                                     options.chunk_size)
+
+
+
+def fetch_file(client, endpoint, agave_system, remote_path, local_path, entry, params,
+               options=None):
+    """ Download a file and give it the modification time of the remote one
+
+    PARAMETERS
+    ----------
+    entry : dict
+        Remote file, as described by remote_tree.
+    """
+    options = options or TransferOptions()
+    digest = download_file(client, endpoint, agave_system, remote_path, local_path, params,
+                           options, entry)
+    os.utime(local_path, (entry["mtime"], entry["mtime"]))
+    if options.checksum_cache is not None:
+        options.checksum_cache.put_file(local_path, digest, options.algorithm)
+
+
+
+def remove_local_path(local_path):
+    """ Delete a local file or directory tree
+    """
+    if path.isdir(local_path) and not path.islink(local_path):
+        shutil.rmtree(local_path)
+    else:
+        os.remove(local_path)
+
+
+
+def remove_remote_path(client, endpoint, agave_system, remote_path, params):
+    """ Delete a file or directory tree on a remote Agave system
+
+    Raise requests.exceptions.HTTPError if the delete is rejected.
+    """
+    resp = client.delete(endpoint, agave_system, remote_path, params=params)
+    resp.raise_for_status()
+
+
+
+def sync_local_to_remote(origin, destination, client, endpoint, listings_endpoint, params,
+                         delete=False, dry_run=False, jobs=DEFAULT_JOBS, options=None):
+    """ Mirror the contents of a local directory into a remote one
+
+    If options.verify is set, files that look unchanged are also checked
+    against the checksums of the remote files.
+
+    RETURNS
+    -------
+    report : TransferReport
+    """
+    agave_system, remote_root = split_agave_uri(destination)
+    remote_root = remote_root.strip("/")
+    options = options or TransferOptions()
+
+    def remote(relpath):
+        return "/".join(filter(None, [remote_root, relpath]))
+
+    def make_dir(relpath):
+        resp = make_remote_dir(client, endpoint, agave_system, remote(relpath), params)
+        resp.raise_for_status()
+
+    def copy(relpath):
+        local_path = path.join(origin, *relpath.split("/"))
+        remote_dir = remote(relpath.rpartition("/")[0])
+        return local_path, upload_file, \
+                (client, endpoint, local_path, agave_system, remote_dir, params, options)
+
+    def remove(relpath):
+        return "agave://{0}/{1}".format(agave_system, remote(relpath)), remove_remote_path, \
+                (client, endpoint, agave_system, remote(relpath), params)
+
+    def changed(relpath):
+        return contents_differ(path.join(origin, *relpath.split("/")), target[relpath], options)
+
+    source = local_tree(origin)
+    target = remote_tree(client, listings_endpoint, agave_system, remote_root, params)
+    plan = plan_sync(source, target or {}, delete, changed if options.verify else None)
+    if target is None:
+        plan.insert(0, ("mkdir", ""))
+
+    if dry_run:
+        print_plan(plan, "upload",
+                   lambda relpath: "agave://{0}/{1}".format(agave_system, remote(relpath)))
+        return TransferReport()
+
+    return run_plan(plan, source, make_dir, copy, remove, jobs)
+
+
+
+def sync_remote_to_local(origin, destination, client, endpoint, listings_endpoint, params,
+                         delete=False, dry_run=False, jobs=DEFAULT_JOBS, options=None):
+    """ Mirror the contents of a remote directory into a local one
+
+    Downloaded files get the modification time of the remote files, so the
+    next sync can tell them apart from files changed since. If
+    options.verify is set, files that look unchanged are also checked
+    against the checksums of the remote files.
+
+    RETURNS
+    -------
+    report : TransferReport
+    """
+    agave_system, remote_root = split_agave_uri(origin)
+    remote_root = remote_root.strip("/")
+    options = options or TransferOptions()
+
+    def local(relpath):
+        return path.join(destination, *relpath.split("/")) if relpath else destination
+
+    def make_dir(relpath):
+        if not path.isdir(local(relpath)):
+            os.makedirs(local(relpath))
+
+    def copy(relpath):
+        remote_path = "/".join(filter(None, [remote_root, relpath]))
+        return "agave://{0}/{1}".format(agave_system, remote_path), fetch_file, \
+                (client, endpoint, agave_system, remote_path, local(relpath),
+                 source[relpath], params, options)
+
+    def remove(relpath):
+        return local(relpath), remove_local_path, (local(relpath),)
+
+    source = remote_tree(client, listings_endpoint, agave_system, remote_root, params)
+    if source is None:
+        print("{0} does not exist".format(origin), file=sys.stderr)
+        sys.exit(1)
+    def changed(relpath):
+        return contents_differ(local(relpath), source[relpath], options)
+
+    target = local_tree(destination)
+    plan = plan_sync(source, target or {}, delete, changed if options.verify else None)
+    if target is None:
+        plan.insert(0, ("mkdir", ""))
+
+    if dry_run:
+        print_plan(plan, "download", local)
+        return TransferReport()
+
+    return run_plan(plan, source, make_dir, copy, remove, jobs)
+
+
+
+def print_plan(plan, copy_action, describe):
+    """ Print what a sync would do, one line per action
+    """
+    for action, relpath in plan:
+        action = copy_action if action == "copy" else action
+        print("{0:<8} {1}".format(action, describe(relpath)))
+
+
+
+def files_sync(agavedb, token_endpoint, endpoint, origin, destination,
+               listings_endpoint="files/v2/listings/system", delete=False, dry_run=False,
+               jobs=DEFAULT_JOBS, chunk_size=DEFAULT_CHUNK_SIZE, verify=False,
+               limit_rate=None):
+    """ Mirror a directory to or from a remote Agave system
+
+    Only files that are missing from the destination, differ in size, or
+    are older than in the origin are copied (up to "jobs" at a time). If
+    "verify" is set, files whose checksum differs from the remote checksum
+    are copied as well, and copies are verified. Files and directories that
+    are not in the origin are deleted from the destination if "delete" is
+    set. If "dry_run" is set, what would be done is printed instead. All
+    transfers together are held to "limit_rate" bytes per second, if set.
+    """
+    # Get an authenticated client for the current tenant.
+    client = get_agave_client(agavedb, token_endpoint, pool_maxsize=jobs)
+
+    params  = {"pretty": "true"}
+    rate_limiter = RateLimiter(limit_rate) if limit_rate else None
+    options = TransferOptions(chunk_size, get_checksum_cache(agavedb), verify, rate_limiter)
+    try:
+        # sync local -> remote.
+        if "agave://" not in origin[:8] and "agave://" in destination[:8]:
+            if not path.isdir(origin):
+                print("{0} is not a directory".format(origin), file=sys.stderr)
+                sys.exit(1)
+            report = sync_local_to_remote(origin, destination, client, endpoint,
+                                          listings_endpoint, params, delete, dry_run, jobs,
+                                          options)
+        # sync remote -> local.
+        elif "agave://" in origin[:8] and "agave://" not in destination[:8]:
+            report = sync_remote_to_local(origin, destination, client, endpoint,
+                                          listings_endpoint, params, delete, dry_run, jobs,
+                                          options)
+        else:
+            print("Requesting wrong sync operation (one side has to be a remote agave system)",
+                    file=sys.stderr)
+            sys.exit(1)
+    except requests.exceptions.HTTPError as err:
+        handle_bad_response_status_code(err.response)
+    except (requests.exceptions.MissingSchema, ValueError) as err:
+        # i.e., the remote side is a file, not a directory.
+        print(err, file=sys.stderr)
+        sys.exit(1)
+
+    if not dry_run:
+        report.print_summary()
+        if not report.ok:
+            sys.exit(1)
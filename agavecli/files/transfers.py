@@ -0,0 +1,217 @@
+"""
+    transfers.py
+"""
+from __future__ import print_function
+import hashlib
+import requests
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from .checksums import DEFAULT_CHECKSUM_ALGORITHM, check_checksum
+from .streams import DEFAULT_CHUNK_SIZE
+
+
+# Default number of concurrent transfers.
+DEFAULT_JOBS = 4
+
+# Default number of times a failed transfer is tried again, and seconds
+# before the first retry (doubled for every following one).
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_DELAY = 1
+
+
+
+class TransferOptions(object):
+    """ Settings shared by all the transfers of a copy
+
+    PARAMETERS
+    ----------
+    chunk_size : int
+        Number of bytes read and written at a time.
+    checksum_cache : ChecksumCache
+        Cache to record the checksum of transferred local files to (see
+        checksums.py).
+    verify : bool
+        Check the checksum of transferred data against the remote checksum,
+        when there is one.
+    rate_limiter : RateLimiter
+        Limiter shared by all the transfers (see ratelimit.py), None for no
+        limit. Chunks are then no larger than its burst.
+    algorithm : str
+        Hash algorithm of the checksums (i.e., sha256).
+    """
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, checksum_cache=None, verify=False,
+                 rate_limiter=None, algorithm=DEFAULT_CHECKSUM_ALGORITHM):
+        if rate_limiter is not None:
+            # A chunk larger than the bucket goes out at full speed and is
+            # followed by a stall, instead of being paced.
+            chunk_size = max(1, min(chunk_size, int(rate_limiter.burst)))
+        self.chunk_size = chunk_size
+        self.checksum_cache = checksum_cache
+        self.verify = verify
+        self.rate_limiter = rate_limiter
+        self.algorithm = algorithm
+
+    def hasher(self):
+        """ New hash object to checksum the data of a transfer
+        """
+        return hashlib.new(self.algorithm)
+
+    def record_checksum(self, name, hasher, expected=None, local_path=None, stat=None):
+        """ Finish the checksum of a transfer
+
+        Cache the checksum of the local file the data was read from or
+        written to (local_path, as it is now or at "stat"), and check it
+        against the remote checksum ("expected") if verifying.
+
+        RETURNS
+        -------
+        digest : str
+
+        Raise IOError if the checksums differ.
+        """
+        digest = hasher.hexdigest()
+        if local_path is not None and self.checksum_cache is not None:
+            self.checksum_cache.put_file(local_path, digest, self.algorithm, stat)
+        if self.verify:
+            check_checksum(name, digest, expected)
+        return digest
+
+
+
+class TransferReport(object):
+    """ Aggregate outcome of a batch of transfers
+
+    Keep track of which transfers succeeded and which failed (along with
+    the reason) so that a batch can carry on after a bad transfer and report
+    all failures at the end.
+    """
+
+    def __init__(self):
+        self.succeeded = 0
+        self.failed = []
+
+    @property
+    def ok(self):
+        return len(self.failed) == 0
+
+    def record(self, name, error=None):
+        """ Record the outcome of a transfer
+
+        PARAMETERS
+        ----------
+        name : str
+            Description of the transfer (i.e., source path).
+        error : Exception
+            Reason the transfer failed, None if it succeeded.
+        """
+        if error is None:
+            self.succeeded += 1
+        else:
+            self.failed.append((name, error))
+
+    def print_summary(self):
+        """ Print the number of transfers done and every failure
+        """
+        for name, error in self.failed:
+            print("Failed to copy {0}: {1}".format(name, error), file=sys.stderr)
+        print("{0} copied, {1} failed".format(self.succeeded, len(self.failed)))
+
+
+
+# Errors that make a single transfer fail without aborting the whole batch.
+transfer_errors = (requests.exceptions.RequestException, IOError, OSError)
+
+
+def run_transfers(transfers, jobs=DEFAULT_JOBS, report=None):
+    """ Run transfers through a bounded pool of workers
+
+    Transfers are pulled lazily from the iterable so that only a bounded
+    number of them are queued at any given time, even when walking huge
+    directory trees.
+
+    PARAMETERS
+    ----------
+    transfers : iterable
+        (name, function, args) tuples. A transfer fails if function(*args)
+        raises one of transfer_errors.
+    jobs : int
+        Number of transfers to run concurrently.
+    report : TransferReport
+        Report to record outcomes to (a new one is created if None).
+
+    RETURNS
+    -------
+    report : TransferReport
+    """
+    if report is None:
+        report = TransferReport()
+
+    def collect(futures):
+        for future in futures:
+            error = future.exception()
+            if error is not None and not isinstance(error, transfer_errors):
+                raise error
+            report.record(pending.pop(future), error)
+
+    pending = dict()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for name, function, args in transfers:
+            if len(pending) >= 2 * jobs:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending[executor.submit(function, *args)] = name
+
+        collect(list(pending))
+
+    return report
+
+
+
+
+def is_retryable(error):
+    """ Tell whether a failed transfer may succeed if tried again
+
+    Requests rejected by the server for a reason that will not go away
+    (i.e., 404 or 403) are not retried. Timeouts, throttling, server errors,
+    connection errors and local I/O errors are.
+    """
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status >= 500 or status in (408, 429)
+    return isinstance(error, transfer_errors)
+
+
+
+def retrying(function, retries=DEFAULT_RETRIES, delay=DEFAULT_RETRY_DELAY, on_retry=None):
+    """ Wrap a transfer function so that it is tried again when it fails
+
+    PARAMETERS
+    ----------
+    retries : int
+        Number of times to try again after the first attempt.
+    delay : float
+        Seconds to wait before the first retry, doubled for every retry.
+    on_retry : function
+        Called with the number of the retry and the error, before waiting.
+
+    RETURNS
+    -------
+    retried : function
+        Takes the same arguments as "function".
+    """
+    def retried(*args):
+        attempt = 0
+        while True:
+            try:
+                return function(*args)
+            except transfer_errors as err:
+                if attempt >= retries or not is_retryable(err):
+                    raise
+                attempt += 1
+                if on_retry is not None:
+                    on_retry(attempt, err)
+                time.sleep(delay * 2 ** (attempt - 1))
+
+    return retried
@@ -0,0 +1,111 @@
+"""
+    usage.py
+"""
+from __future__ import print_function
+import requests
+import sys
+from ..utils import BufferedWriter, RecordFormatter, get_agave_client
+from .listcache import DEFAULT_LISTING_TTL, get_listing_cache, normalize_syspath
+from .listings import DEFAULT_CRAWL_JOBS, crawl_remote
+
+
+# Fields of the directories printed by "fs du --output jsonl|csv|tsv".
+usage_fields = ["size", "path"]
+
+
+def disk_usage(client, endpoint, agave_system, remote_path, params, jobs=DEFAULT_CRAWL_JOBS,
+               onerror=None, cache=None, cache_ttl=DEFAULT_LISTING_TTL):
+    """ Add up the size of the files in a remote directory tree
+
+    The tree is crawled "jobs" directories at a time (see crawl_remote),
+    only the size of the files in each directory is kept along the way.
+
+    RETURNS
+    -------
+    usage : list
+        (dirpath, depth, size) tuples, children before their parents (as du
+        prints them). "size" is the total length of the files under dirpath
+        and "depth" the number of levels below remote_path.
+    """
+    remote_path = remote_path.strip("/")
+    # Directory to (size of its own files, subdirectories).
+    sizes = dict()
+    children = dict()
+    for dirpath, entries in crawl_remote(client, endpoint, agave_system, remote_path, params,
+                                         jobs, onerror, cache=cache, cache_ttl=cache_ttl):
+        sizes[dirpath] = sum(entry["length"] for entry in entries if entry["type"] != "dir")
+        children[dirpath] = []
+        if dirpath != remote_path:
+            children.setdefault(dirpath.rpartition("/")[0], []).append(dirpath)
+    if remote_path not in sizes:
+        return []
+
+    # Walk the tree depth first, adding up the sizes on the way back.
+    usage = []
+    totals = dict()
+    stack = [(remote_path, 0, False)]
+    while stack:
+        dirpath, depth, visited = stack.pop()
+        if visited:
+            totals[dirpath] = sizes[dirpath] + sum(totals[c] for c in children[dirpath])
+            usage.append((dirpath, depth, totals[dirpath]))
+            continue
+        stack.append((dirpath, depth, True))
+        for child in reversed(children.get(dirpath, [])):
+            # Subdirectories that could not be listed count as empty.
+            if child in sizes:
+                stack.append((child, depth + 1, False))
+
+    return usage
+
+
+
+def files_du(agavedb, token_endpoint, endpoint, syspath, summarize=False, max_depth=None,
+             jobs=DEFAULT_CRAWL_JOBS, use_cache=True, cache_ttl=DEFAULT_LISTING_TTL,
+             output="table"):
+    """ Print the disk usage of a directory tree on a remote Agave system
+
+    Print the total size, in bytes, of the files under every directory of
+    the tree, down to "max_depth" levels below syspath ("summarize" only
+    prints the total). Directories are listed "jobs" at a time, listings
+    cached less than "cache_ttl" seconds ago are reused unless "use_cache"
+    is unset. Directories that cannot be listed are reported and skipped,
+    the exit status is then 1. With "output" set to "jsonl", "csv" or "tsv"
+    the same is printed as records (see RecordFormatter).
+    """
+    # Get an authenticated client for the current tenant.
+    client = get_agave_client(agavedb, token_endpoint, pool_maxsize=2 * jobs)
+
+    cache = get_listing_cache(agavedb) if use_cache else None
+    agave_system, _, remote_path = normalize_syspath(syspath).partition("/")
+    if summarize:
+        max_depth = 0
+
+    failed = []
+
+    def onerror(dirpath, err):
+        failed.append(dirpath)
+        print("Cannot list agave://{0}/{1}: {2}".format(agave_system, dirpath, err),
+              file=sys.stderr)
+
+    try:
+        usage = disk_usage(client, endpoint, agave_system, remote_path, {"pretty": "true"},
+                           jobs, onerror, cache, cache_ttl)
+    except requests.exceptions.MissingSchema as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
+
+    records = RecordFormatter(output, usage_fields) if output != "table" else None
+    with BufferedWriter() as out:
+        for dirpath, depth, size in usage:
+            if max_depth is None or depth <= max_depth:
+                syspath = "/".join(filter(None, [agave_system, dirpath]))
+                if records is not None:
+                    out.write(records.format_page([{"size": size, "path": syspath}]))
+                else:
+                    out.write("{0}\t{1}\n".format(size, syspath))
+        if records is not None:
+            out.write(records.finish())
+
+    if failed:
+        sys.exit(1)
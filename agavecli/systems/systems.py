@@ -6,25 +6,29 @@ import json
 import requests
 import sys
 from os import path
-from ..utils import get_access_token, get_agave_context, handle_bad_response_status_code
+from ..utils import BufferedWriter, RecordFormatter, get_agave_client, \
+        handle_bad_response_status_code
 
 
+# Fields of the systems printed by "system ls --output jsonl|csv|tsv".
+system_fields = ["id", "type", "default", "public"]
 
-def system_list(agavedb, endpoint, token_endpoint, print_execution, print_storage):
+
+
+def system_list(agavedb, endpoint, token_endpoint, print_execution, print_storage,
+                output="table"):
     """ List all Agave systems available to the authenticated user
-    """
-    # Get baseurl for tenant.
-    agave_context = get_agave_context(agavedb)
 
-    # Get access token from agave database.
-    access_token = get_access_token(agavedb, token_endpoint)
+    With "output" set to "jsonl", "csv" or "tsv", the fields in
+    system_fields are printed as records (see RecordFormatter).
+    """
+    # Get an authenticated client for the current tenant.
+    client = get_agave_client(agavedb, token_endpoint)
 
     # Make request.                                                             
     try:
-        headers  = {"Authorization":"Bearer {0}".format(access_token)}
-        params   = {"pretty": "true"}
-        endpoint = "{0}{1}".format(agave_context["current"]["baseurl"], endpoint)
-        resp = requests.get(endpoint, headers=headers, params=params)   
+        params = {"pretty": "true"}
+        resp = client.get(endpoint, params=params)
     except requests.exceptions.MissingSchema as err:                            
         print(err, file=sys.stderr)                                             
         sys.exit(1)                                                             
@@ -33,6 +37,17 @@ def system_list(agavedb, endpoint, token_endpoint, print_execution, print_storag
     handle_bad_response_status_code(resp)
 
     # Print results.
+    if output != "table":
+        systems = [system for system in resp.json()["result"]
+                   if (print_execution and system["type"].lower() == "execution") or
+                   (print_storage and system["type"].lower() == "storage") or
+                   (not print_execution and not print_storage)]
+        formatter = RecordFormatter(output, system_fields)
+        with BufferedWriter() as out:
+            out.write(formatter.format_page(systems))
+            out.write(formatter.finish())
+        return
+
     print("{0:<30} {1:<10} {2:<5} {3:<5}".format("ID", "TYPE", "DEFAULT", "PUBLIC"))
     for system in resp.json()["result"]:
         sys_type = system["type"].lower()
@@ -6,6 +6,11 @@ import json
 import requests
 import sys
 from os import path
+from ..utils import BufferedWriter, RecordFormatter, get_context, get_session
+
+
+# Fields of the tenants printed by "tenant ls --output jsonl|csv|tsv".
+tenant_fields = ["code", "name", "baseUrl"]
 
 
 def get_tenants(hosturl):
@@ -21,7 +26,7 @@ def get_tenants(hosturl):
     """
     # Make request.
     try:
-        resp = requests.get(hosturl)
+        resp = get_session().get(hosturl)
     except requests.exceptions.MissingSchema as err:
         print(err, file=sys.stderr)
         sys.exit(1)
@@ -82,12 +87,10 @@ def tenant_init(hosturl, tenant_name, agavedb):
     }
 
     # Agave Database.
-    agavedb = "{}/agave.json".format(agavedb)
+    context = get_context(agavedb)
     # Read in Agave database if it doesn't already exist, else create one.
-    if path.isfile(agavedb):
-        with open(agavedb, "r") as f:
-            agave_context = json.load(f)
-    else:
+    agave_context = context.load()
+    if agave_context is None:
         agave_context = dict()
 
     # "tenant init" is run for the first time so we have to set "current" and
@@ -112,12 +115,11 @@ def tenant_init(hosturl, tenant_name, agavedb):
             tenant_info["code"], tenant_context)
 
     # Save data to Agave database.
-    with open(agavedb, "w") as f:
-        json.dump(agave_context, f, sort_keys=True, indent=4)
+    context.save(agave_context)
 
 
 
-def tenant_list(hosturl):
+def tenant_list(hosturl, output="table"):
     """ List Agave tenants
 
     List all Agave tenants for a given Agave host. Information listed is the
@@ -128,11 +130,21 @@ def tenant_list(hosturl):
     arguments: object (argparse.Namespace)
         This object may contain the following attributes:
         - hosturl: string representing a url (optional).
+    output: string
+        "table", or "jsonl", "csv" or "tsv" to print the fields in
+        tenant_fields as records (see RecordFormatter).
     """
     # Get a json of all AGave tenants.
     tenants = get_tenants(hosturl)
 
     # Print results.
+    if output != "table":
+        formatter = RecordFormatter(output, tenant_fields)
+        with BufferedWriter() as out:
+            out.write(formatter.format_page(tenants["result"]))
+            out.write(formatter.finish())
+        return
+
     print("{0:<20} {1:<40} {2:<50}".format("CODE", "NAME", "URL"))
     for tenant in tenants["result"]:
         print("{0:<20} {1:<40} {2:<50}".format(tenant["code"], tenant["name"],
@@ -1,2 +1,6 @@
-from .agave_utils import get_access_token, get_agave_context, refresh_token, token_expired
+from .agave_utils import AgaveContext, get_access_token, get_agave_client, get_agave_context, \
+        get_context, refresh_token, save_agave_context, token_expired
+from .http_client import AgaveClient, get_session
 from .response_handlers import handle_bad_response_status_code
+from .render import BufferedWriter, RecordFormatter, OUTPUT_FORMATS
+from .sqlite_store import SQLiteStore
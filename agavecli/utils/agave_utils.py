@@ -4,18 +4,100 @@
 from __future__ import print_function                                           
 import getpass                                                                  
 import json                                                                     
+import os
 import requests                                                                 
 import sys                                                                      
+import threading
 import time                                                                     
 from os import path                                                             
+from .http_client import AgaveClient, DEFAULT_POOL_MAXSIZE
 from .response_handlers import handle_bad_response_status_code
 
 
 
+# Name of the local Agave database, in the directory given with -A.
+AGAVE_DB_FILE = "agave.json"
+
+
+
+class AgaveContext(object):
+    """ The local Agave database of a directory, loaded once per process
+
+    The database is parsed the first time it is asked for and kept in
+    memory. Later loads only stat the file: it is read again if its
+    modification time or size changed (i.e., another process saved it).
+    Saving through the context keeps the copy in memory up to date. Use
+    get_context to share one context per directory within a process.
+
+    PARAMETERS
+    ----------
+    agavedb : str
+        Directory location of the local Agave database (default usage: ~/).
+    """
+
+    def __init__(self, agavedb):
+        self.agavedb = agavedb
+        self.db_path = path.join(agavedb, AGAVE_DB_FILE)
+        self._lock = threading.Lock()
+        self._context = None
+        self._stat = None
+
+    def _stat_key(self):
+        try:
+            st = os.stat(self.db_path)
+        except OSError:
+            return None
+        return st.st_mtime, st.st_size
+
+    def load(self):
+        """ The database, None if there is none
+
+        RETURNS
+        -------
+        agave_context : dict
+            Shared by every caller, save changes made to it (see save).
+        """
+        with self._lock:
+            stat = self._stat_key()
+            if stat is None:
+                self._context = self._stat = None
+            elif stat != self._stat:
+                with open(self.db_path, "r") as f:
+                    self._context = json.load(f)
+                self._stat = stat
+            return self._context
+
+    def save(self, agave_context):
+        """ Write the database, and keep it as the copy in memory
+        """
+        with self._lock:
+            with open(self.db_path, "w") as f:
+                json.dump(agave_context, f, sort_keys=True, indent=4)
+            self._context = agave_context
+            self._stat = self._stat_key()
+
+
+_contexts = dict()
+_contexts_lock = threading.Lock()
+
+
+def get_context(agavedb):
+    """ The AgaveContext of a directory, the same one for the whole process
+    """
+    key = path.abspath(agavedb)
+    with _contexts_lock:
+        context = _contexts.get(key)
+        if context is None:
+            context = _contexts[key] = AgaveContext(agavedb)
+    return context
+
+
+
 def get_agave_context(agavedb):
     """ Get the current Agave context
 
-    Look for the local Agave database and return a reference to it.
+    Look for the local Agave database and return a reference to it. The
+    database is only read again if it changed since (see AgaveContext).
 
     INPUTS
     ------
@@ -27,11 +109,8 @@ def get_agave_context(agavedb):
     agave_context : dict
         Dictionary with all usage pertaining to the current user's session.
     """
-    agavedb = "{}/agave.json".format(agavedb)
-    if path.isfile(agavedb):
-        with open(agavedb, "r") as f:
-            agave_context = json.load(f)
-    else:
+    agave_context = get_context(agavedb).load()
+    if agave_context is None:
         print("Please specify an Agave tenant to interact with before trying to create a client",
                 file=sys.stderr)
         sys.exit(1)
@@ -39,6 +118,20 @@ def get_agave_context(agavedb):
     return agave_context
 
 
+
+def save_agave_context(agavedb, agave_context):
+    """ Save the local Agave database
+
+    PARAMETERS
+    ----------
+    agavedb : str
+        Directory localtion of the local Agave database (dedault usage: ~/).
+    agave_context : dict
+        Dictionary with all usage pertaining to the current user's session.
+    """
+    get_context(agavedb).save(agave_context)
+
+
 def get_access_token(agavedb, token_endpoint):
     """ Get the Access Token
     
@@ -73,6 +166,32 @@ def get_access_token(agavedb, token_endpoint):
 
 
 
+def get_agave_client(agavedb, token_endpoint, pool_maxsize=DEFAULT_POOL_MAXSIZE):
+    """ Get an authenticated Agave client
+
+    Return a client for the current tenant which sends the access token
+    (refreshed if expired) along with every request.
+
+    INPUTS
+    ------
+    agavedb : str
+        Directory localtion of the local Agave database (dedault usage: ~/)
+    token_endpoint : str
+        Token service endpoint for agave (defualts to: token).
+    pool_maxsize : int
+        Number of connections to keep open to the tenant.
+
+    RETURNS
+    -------
+    client : AgaveClient
+    """
+    access_token = get_access_token(agavedb, token_endpoint)
+    agave_context = get_agave_context(agavedb)
+
+    return AgaveClient(agave_context["current"]["baseurl"], access_token, pool_maxsize)
+
+
+
 def token_expired(agavedb, token_refresh_endpoint):
     """ Check if access token is expired
 
@@ -91,7 +210,7 @@ def token_expired(agavedb, token_refresh_endpoint):
 
     delta_t = int(time.time()) - expiration_t
     if delta_t > -60:
-        print("Refreshing token...")
+        print("Refreshing token...", file=sys.stderr)
         refresh_token(agavedb, token_refresh_endpoint)
 
 
@@ -120,8 +239,8 @@ def refresh_token(agavedb, endpoint):
 
         key = agave_context["current"].get("apikey", None)
         secret = agave_context["current"].get("apisecret", None)
-        endpoint = "{0}{1}".format(agave_context["current"]["baseurl"], endpoint)
-        resp = requests.post(endpoint, headers=headers, data=data, auth=(key, secret))
+        client = AgaveClient(agave_context["current"]["baseurl"])
+        resp = client.post(endpoint, headers=headers, data=data, auth=(key, secret))
     except requests.exceptions.MissingSchema as err:
         print(err, file=sys.stderr)
         sys.exit(1)
@@ -139,5 +258,4 @@ def refresh_token(agavedb, endpoint):
     agave_context["current"]["expires_at"] = time.strftime("%a %b %-d %H:%M:%S %Z %Y", time.localtime(expires_at))
 
     # Save data to Agave database.
-    with open("{}/agave.json".format(agavedb), "w") as f:
-        json.dump(agave_context, f, sort_keys=True, indent=4)
+    save_agave_context(agavedb, agave_context)
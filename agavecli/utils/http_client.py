@@ -0,0 +1,120 @@
+"""
+    http_client.py
+"""
+from __future__ import print_function
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+try: # python 2
+    from urllib import quote
+except ImportError: # python 3
+    from urllib.parse import quote
+
+
+# Number of hosts for which connection pools are kept around (tenant, auth
+# server, central service) and number of keep-alive connections kept open per
+# host.
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 10
+
+_session = None
+_session_pool_maxsize = 0
+_session_lock = threading.Lock()
+
+
+
+def get_session(pool_maxsize=DEFAULT_POOL_MAXSIZE):
+    """ Get the process-wide HTTP session
+
+    All requests made by agavecli go through a single requests.Session so
+    that TCP and TLS connections are kept alive and reused between calls.
+
+    PARAMETERS
+    ----------
+    pool_maxsize : int
+        Minimum number of connections to keep open per host. The pool is
+        only ever grown, so concurrent transfers can ask for as many
+        connections as they have workers.
+
+    RETURNS
+    -------
+    session : requests.Session
+    """
+    global _session, _session_pool_maxsize
+
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+
+        if pool_maxsize > _session_pool_maxsize:
+            old_adapter = _session.adapters.get("https://")
+            adapter = HTTPAdapter(
+                pool_connections=DEFAULT_POOL_CONNECTIONS,
+                pool_maxsize=pool_maxsize)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+            _session_pool_maxsize = pool_maxsize
+            if old_adapter is not None:
+                old_adapter.close()
+
+    return _session
+
+
+
+class AgaveClient(object):
+    """ HTTP client for an Agave tenant
+
+    Send requests to the services of an Agave tenant through the shared
+    keep-alive session. The tenant's base url and the bearer token are
+    attached once, when the client is created.
+
+    PARAMETERS
+    ----------
+    baseurl : str
+        Base url of the tenant (i.e., https://api.tacc.utexas.edu/).
+    access_token : str
+        Oauth bearer token sent along with every request (optional).
+    pool_maxsize : int
+        Number of connections to keep open to the tenant.
+    """
+
+    def __init__(self, baseurl, access_token=None, pool_maxsize=DEFAULT_POOL_MAXSIZE):
+        self.baseurl = baseurl
+        self.session = get_session(pool_maxsize)
+        self.headers = dict()
+        if access_token:
+            self.headers["Authorization"] = "Bearer {0}".format(access_token)
+
+    def url(self, endpoint, *path):
+        """ Build the url of a resource
+
+        Join the tenant's base url, the service endpoint (i.e., systems/v2),
+        and any path elements (i.e., system id, file path). Path elements
+        are quoted, so names holding "#", "?" or "%" reach the service as
+        they are.
+        """
+        path = tuple(quote(p, safe="/") for p in path)
+        return "/".join(("{0}{1}".format(self.baseurl, endpoint),) + path)
+
+    def request(self, method, endpoint, *path, **kwargs):
+        """ Send a request to an Agave service
+
+        Keyword arguments are passed to requests.Session.request. Headers
+        given here are sent along with the client's headers.
+        """
+        headers = dict(self.headers)
+        headers.update(kwargs.pop("headers", None) or {})
+        return self.session.request(
+            method, self.url(endpoint, *path), headers=headers, **kwargs)
+
+    def get(self, endpoint, *path, **kwargs):
+        return self.request("GET", endpoint, *path, **kwargs)
+
+    def post(self, endpoint, *path, **kwargs):
+        return self.request("POST", endpoint, *path, **kwargs)
+
+    def put(self, endpoint, *path, **kwargs):
+        return self.request("PUT", endpoint, *path, **kwargs)
+
+    def delete(self, endpoint, *path, **kwargs):
+        return self.request("DELETE", endpoint, *path, **kwargs)
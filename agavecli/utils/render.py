@@ -0,0 +1,133 @@
+"""
+    render.py
+"""
+from __future__ import print_function
+import csv
+import itertools
+import json
+import sys
+
+
+# Number of characters of output held before it is written out.
+DEFAULT_OUTPUT_BUFFER_SIZE = 64 * 1024
+
+# Formats listings can be printed in: human readable, JSON Lines, CSV or TSV.
+OUTPUT_FORMATS = ["table", "jsonl", "csv", "tsv"]
+
+
+
+class BufferedWriter(object):
+    """ Collect output and write it out in large blocks
+
+    Text is appended to a list and written (and flushed) once
+    "buffer_size" characters have piled up, instead of one write per line.
+
+    PARAMETERS
+    ----------
+    file : file
+        Where output goes (defaults to sys.stdout at the time of writing).
+    buffer_size : int
+        Number of characters to hold before writing them out.
+    """
+
+    def __init__(self, file=None, buffer_size=DEFAULT_OUTPUT_BUFFER_SIZE):
+        self.file = file
+        self.buffer_size = buffer_size
+        self._parts = []
+        self._size = 0
+
+    def write(self, text):
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """ Write out everything held so far
+        """
+        file = self.file or sys.stdout
+        if self._parts:
+            file.write("".join(self._parts))
+            self._parts = []
+            self._size = 0
+        file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+
+class _TextParts(object):
+    """ File-like list of the strings written to it (for csv.writer)
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+
+
+def tsv_field(value):
+    """ Text of a TSV field, with backslashes, tabs and line breaks escaped
+    """
+    if value is None:
+        return ""
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace(
+        "\n", "\\n").replace("\r", "\\r")
+
+
+
+class RecordFormatter(object):
+    """ Format records for other programs, as JSON Lines, CSV or TSV
+
+    Every record is a line of its own, made of the values of "fields" (a
+    record missing a field gets null, or an empty field). CSV and TSV start
+    with a header line naming the fields. Nothing depends on the records
+    that come after, so each page can be written out as soon as it is in.
+
+    PARAMETERS
+    ----------
+    output : str
+        "jsonl", "csv" or "tsv".
+    fields : list
+        Keys of the records to print, in order.
+    """
+
+    def __init__(self, output, fields):
+        if output not in ("jsonl", "csv", "tsv"):
+            raise ValueError("unknown output format: {0}".format(output))
+        self.output = output
+        self.fields = fields
+        self._header = output != "jsonl"
+
+    def format_page(self, records):
+        """ Text of a page of records
+
+        RETURNS
+        -------
+        text : str
+        """
+        fields = self.fields
+        rows = ([record.get(field) for field in fields] for record in records)
+        if self._header:
+            self._header = False
+            rows = itertools.chain([fields], rows)
+
+        if self.output == "jsonl":
+            return "".join(json.dumps(dict(zip(fields, row))) + "\n" for row in rows)
+        if self.output == "tsv":
+            return "".join("\t".join([tsv_field(value) for value in row]) + "\n"
+                           for row in rows)
+        text = _TextParts()
+        csv.writer(text, lineterminator="\n").writerows(rows)
+        return "".join(text.parts)
+
+    def finish(self):
+        """ Text ending the output (the header if there were no records)
+        """
+        return self.format_page([]) if self._header else ""
@@ -13,6 +13,6 @@ def handle_bad_response_status_code(r):
         print("Bad {0} request to {1}, status code {2}".format(                 
                 r.request.method, r.url, r.status_code),                        
                 file=sys.stderr)
-        print(r.request.body)
-        print(r.json())                                                         
+        print(r.request.body, file=sys.stderr)
+        print(r.json(), file=sys.stderr)
         sys.exit(1)
@@ -0,0 +1,64 @@
+"""
+    sqlite_store.py
+"""
+from __future__ import print_function
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+
+class SQLiteStore(object):
+    """ SQLite database kept next to the local Agave database
+
+    The connection can be shared by concurrent threads: every statement
+    runs under a lock. Subclasses list the statements creating their tables
+    and indexes in "schema", which are run when the database is opened.
+
+    PARAMETERS
+    ----------
+    db_path : str
+        Location of the database (created if it does not exist).
+    """
+    schema = ()
+
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        # Local stores only keep what can be fetched or computed again (remote
+        # listings, checksums of local files), trade durability for speed.
+        self._db.execute("PRAGMA synchronous = OFF")
+        with self.transaction() as db:
+            for statement in self.schema:
+                db.execute(statement)
+
+    @contextmanager
+    def transaction(self):
+        """ Run statements on the database as a single commit
+
+        The connection is yielded with the lock held, and the changes are
+        committed on exit (rolled back if an exception is raised).
+        """
+        with self._lock:
+            try:
+                yield self._db
+            except BaseException:
+                self._db.rollback()
+                raise
+            self._db.commit()
+
+    def fetchone(self, sql, args=()):
+        """ First row returned by a query, None if there is none
+        """
+        with self._lock:
+            return self._db.execute(sql, args).fetchone()
+
+    def fetchall(self, sql, args=()):
+        """ Rows returned by a query
+        """
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
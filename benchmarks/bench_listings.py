@@ -0,0 +1,131 @@
+"""
+    bench_listings.py
+
+Measure how long "fs ls" takes to render a synthetic listing.
+
+Compare the way files_list used to render a listing (the response parsed
+again for the sort, each width pass and the render loop, output built by
+string concatenation or printed line by line) with the paged pipeline (each
+page parsed once, widths taken in one pass, output through a
+BufferedWriter):
+
+    $ python benchmarks/bench_listings.py [number of entries]
+"""
+from __future__ import print_function, division
+import json
+import os
+import sys
+import time
+from operator import itemgetter
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from agavecli.files.files import ListingFormatter, file_permissions, parse_agave_time
+from agavecli.utils import BufferedWriter
+
+
+class Response(object):
+    """ Stand-in for a requests.Response, parsing its body on every json() call
+    """
+
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+
+def make_pages(entries, page_size):
+    """ Bodies of the pages of a synthetic listing
+    """
+    pages = []
+    for offset in range(0, entries, page_size):
+        result = []
+        for i in range(offset, min(offset + page_size, entries)):
+            is_dir = i % 10 == 0
+            result.append({
+                "name": "dir{0:07d}".format(i) if is_dir else "file{0:07d}.h5".format(i),
+                "length": 4096 if is_dir else (i * 7919) % 10000000,
+                "lastModified": "2018-07-10T12:28:01.000-05:00",
+                "permissions": "ALL",
+                "type": "dir" if is_dir else "file",
+            })
+        pages.append(json.dumps({"status": "success", "result": result}))
+    return pages
+
+
+def legacy_list(pages, long_format, out):
+    """ How files_list used to render a listing (all of it in one response)
+    """
+    resp = Response(json.dumps({"status": "success", "result": [
+        entry for page in pages for entry in json.loads(page)["result"]]}))
+
+    resp.json()["result"] = sorted(resp.json()["result"], key=itemgetter("name"), reverse=True)
+    longest_name = 8
+    for f in resp.json()["result"]:
+        if len(f["name"]) > longest_name:
+            longest_name = len(f["name"])
+    largest_file = 0
+    for f in resp.json()["result"]:
+        if len(str(f["length"])) > largest_file:
+            largest_file = len(str(f["length"]))
+    terminal_size_columns = 120
+
+    if not long_format:
+        files = ""
+        line_length = 0
+        for f in resp.json()["result"]:
+            name = f["name"]
+            if f["type"] == "dir":
+                name += "/"
+            name += " " * (longest_name - len(name) + 3)
+            if line_length + len(name) > terminal_size_columns:
+                files += "\n"
+                line_length = 0
+            line_length += len(name)
+            files += name
+        print(files, file=out)
+    else:
+        for f in resp.json()["result"]:
+            name = f["name"]
+            perm = file_permissions[f["permissions"]]
+            if f["type"] == "dir":
+                perm = "d{}".format(perm[1:])
+                name += "/"
+            name += " " * (longest_name - len(name) + 3)
+            fsize = f["length"]
+            ftime, outtime = parse_agave_time(f["lastModified"])
+            print("{0:<4} {1:>{size_width}} {2:<3} {3:>2} {4:<5} {5:}".format(
+                    perm, fsize, outtime[0], ftime.tm_mday, outtime[2], name,
+                    size_width=largest_file), file=out)
+
+
+def paged_list(pages, long_format, out):
+    """ How files_list renders a listing now
+    """
+    formatter = ListingFormatter(long_format, 120)
+    with BufferedWriter(out) as writer:
+        for body in pages:
+            writer.write(formatter.format_page(json.loads(body)["result"]))
+            writer.flush()
+        writer.write(formatter.finish())
+
+
+def bench(render, pages, long_format, out):
+    start = time.time()
+    render(pages, long_format, out)
+    return time.time() - start
+
+
+def main(entries=1000000):
+    pages = make_pages(entries, 1000)
+    print("Rendering a listing of {0} entries".format(entries))
+    print("{0:<10} {1:>12} {2:>12} {3:>10}".format("format", "legacy (s)", "paged (s)", "speedup"))
+    with open(os.devnull, "w") as out:
+        for name, long_format in (("short", False), ("long", True)):
+            legacy = bench(legacy_list, pages, long_format, out)
+            paged = bench(paged_list, pages, long_format, out)
+            print("{0:<10} {1:>12.2f} {2:>12.2f} {3:>9.1f}x".format(
+                name, legacy, paged, legacy / paged))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
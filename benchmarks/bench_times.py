@@ -0,0 +1,63 @@
+"""
+    bench_times.py
+
+Measure how fast Agave timestamps are parsed for "fs ls -l".
+
+Compare the strptime based parse_agave_time agavecli used with the fixed
+format parser, on distinct timestamps (nothing memoized) and on a listing
+where files share modification times:
+
+    $ python benchmarks/bench_times.py [number of timestamps]
+"""
+from __future__ import print_function, division
+import os
+import random
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from agavecli.files import files
+
+
+def legacy_parse_agave_time(ftime):
+    """ How timestamps used to be parsed
+    """
+    if ftime[-3] == ":": ftime = ftime[:-3] + ftime[-2:]
+    ftime = time.strptime(ftime, '%Y-%m-%dT%H:%M:%S.%f%z')
+    outtime = time.strftime("%b %d %H:%M", ftime).split()
+    return ftime, outtime
+
+
+def make_timestamps(count, distinct):
+    """ "count" timestamps, drawn from "distinct" different ones
+    """
+    start = time.time() - 365 * 24 * 3600
+    pool = []
+    for _ in range(distinct):
+        seconds = start + random.random() * 365 * 24 * 3600
+        pool.append("{0}.{1:03d}-05:00".format(
+            time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds)), random.randint(0, 999)))
+    return [random.choice(pool) for _ in range(count)]
+
+
+def bench(parse, timestamps):
+    for cache in (files._time_cache, files._dates, files._clocks, files._tz_offsets):
+        cache.clear()
+    start = time.time()
+    parse(timestamps)
+    return time.time() - start
+
+
+def main(count=1000000):
+    random.seed(42)
+    print("Parsing {0} timestamps".format(count))
+    print("{0:<22} {1:>12} {2:>12} {3:>10}".format("timestamps", "legacy (s)", "new (s)",
+                                                    "speedup"))
+    for name, distinct in (("all distinct", count), ("1000 distinct", 1000)):
+        timestamps = make_timestamps(count, distinct)
+        legacy = bench(lambda ts: [legacy_parse_agave_time(t) for t in ts], timestamps)
+        new = bench(files.parse_agave_times, timestamps)
+        print("{0:<22} {1:>12.2f} {2:>12.2f} {3:>9.1f}x".format(name, legacy, new, legacy / new))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,77 @@
+"""
+    bench_transfers.py
+
+Measure download throughput from a mock Agave server on the local host.
+
+Compare the 1 KiB iter_content loop agavecli used to write downloads with
+the large-chunk copy (copy_response) at several chunk sizes:
+
+    $ python benchmarks/bench_transfers.py [size in MiB]
+"""
+from __future__ import print_function, division
+import os
+import shutil
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from agavecli.files.streams import copy_response
+from agavecli.utils import AgaveClient
+from agavecli_testsuite import MockServer, MockServerFilesystem
+
+
+def legacy_copy(resp, f, chunk_size):
+    """ How downloads used to be written (one write per 1 KiB chunk)
+    """
+    for chunk in resp.iter_content(chunk_size=1024):
+        if chunk:
+            f.write(chunk)
+
+
+def chunked_copy(resp, f, chunk_size):
+    copy_response(resp, f, chunk_size)
+
+
+def bench(client, copy, chunk_size, local_file, repeat=3):
+    """ Best throughput (MiB/s) out of "repeat" downloads
+    """
+    best = 0
+    for _ in range(repeat):
+        start = time.time()
+        resp = client.get("files/v2/media/system", "bench", "data.bin", stream=True)
+        with open(local_file, "wb") as f:
+            copy(resp, f, chunk_size)
+        resp.close()
+        elapsed = time.time() - start
+        best = max(best, os.path.getsize(local_file) / (1024 * 1024) / elapsed)
+    return best
+
+
+def main(size_mib=256):
+    root = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(root, "bench"))
+        with open(os.path.join(root, "bench", "data.bin"), "wb") as f:
+            for _ in range(size_mib):
+                f.write(os.urandom(1024 * 1024))
+
+        MockServer.serve(MockServerFilesystem, threaded=True)
+        MockServer.mock_server.root = root
+        client = AgaveClient("http://localhost:{0}/".format(MockServer.mock_server_port), "token")
+        local_file = os.path.join(root, "download.bin")
+
+        print("Downloading {0} MiB from a mock server on localhost".format(size_mib))
+        print("{0:<30} {1:>10}".format("method", "MiB/s"))
+        results = [("iter_content, 1 KiB chunks", legacy_copy, 1024)]
+        for chunk_size in (64 * 1024, 1024 * 1024, 4 * 1024 * 1024):
+            results.append(("copy_response, {0} KiB chunks".format(chunk_size // 1024),
+                            chunked_copy, chunk_size))
+        for name, copy, chunk_size in results:
+            print("{0:<30} {1:>10.1f}".format(name, bench(client, copy, chunk_size, local_file)))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -7,6 +7,7 @@ setup(
     packages=find_packages(),
     install_requires=[
         'future',  
+        'futures; python_version < "3.0"',
         'requests',
       ],
     entry_points={'console_scripts': ['agavecli = agavecli.__main__:main']})
@@ -3,12 +3,22 @@
 
 Methods used throughout the test suite for testing agavecli.
 """
+import email.parser
+import json
+import os
+import shutil
 import socket
+import time
 from threading import Thread
 try: # python 2
-    from BaseHTTPServer import HTTPServer
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import parse_qs, urlparse
 except ModuleNotFoundError: # python 3
-    from http.server import HTTPServer
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, unquote, urlparse
 
 def get_free_port():
     """ Find a free port
@@ -22,6 +32,12 @@ def get_free_port():
     return port
 
 
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """ HTTP server that handles each connection in its own thread
+    """
+    daemon_threads = True
+
+
 class MockServer(object):
     """ Mock server
 
@@ -29,20 +45,315 @@ class MockServer(object):
     """
 
     @classmethod
-    def serve(cls, http_server):
+    def serve(cls, http_server, threaded=False):
         """ Set up mock server
 
         INPUTS
         -------
         http_server: BaseHTTPRequestHandler
             HTTP server with request handlers specified
+        threaded: bool
+            Handle each connection in its own thread (needed to test
+            concurrent transfers).
         """
         # Find a port to listen to connect.
         cls.mock_server_port = get_free_port()
         # Instantiate server.
+        server_class = ThreadingHTTPServer if threaded else HTTPServer
         cls.mock_server = \
-                HTTPServer(("localhost", cls.mock_server_port), http_server)
+                server_class(("localhost", cls.mock_server_port), http_server)
 
         cls.mock_server_thread = Thread(target=cls.mock_server.serve_forever)
         cls.mock_server_thread.setDaemon(True)
         cls.mock_server_thread.start()
+
+
+def agave_timestamp(seconds):
+    """ Format seconds since the epoch the way the Agave API does
+
+    i.e., 2018-07-10T12:28:01.000+00:00
+    """
+    return "{0}.{1:03d}+00:00".format(
+        time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds)),
+        int(seconds * 1000) % 1000)
+
+
+class MockServerFilesystem(BaseHTTPRequestHandler):
+    """ Mock the Agave files API
+
+    Serve the files-media, files-listings, and files-history services out of
+    a directory on the local host (server.root). A request for system "sys"
+    and path "a/b" operates on "<server.root>/sys/a/b". The token service
+    hands out a new token on every refresh.
+
+    Listings are paged with the "offset" and "limit" query parameters, and
+    counted in server.listing_requests. Imports (urlToIngest) are copied
+    right away but their history goes through one status per files-history
+    request, after the events of earlier imports to the same path, and stay
+    STAGING for server.staging_polls requests (1 if unset). Uploads are read
+    and thrown away if server.discard_uploads is set (to upload large files).
+    Files get the checksum returned by server.checksums(local_path), if set.
+    """
+    protocol_version = "HTTP/1.1"
+
+    media_service = "/files/v2/media/system/"
+    listings_service = "/files/v2/listings/system/"
+    history_service = "/files/v2/history/system/"
+    token_service = "/token"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, result):
+        body = json.dumps({
+            "status": "success" if status < 400 else "error",
+            "message": None,
+            "version": "2.2.21-mock",
+            "result": result
+        }).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", len(body))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_status(self, status):
+        self.send_json(status, None)
+
+    def send_token(self):
+        """ Answer a token refresh (a bare JSON object, like the token service)
+        """
+        self.discard_body()
+        body = json.dumps({
+            "token_type": "bearer",
+            "expires_in": 14400,
+            "refresh_token": "refresh_token",
+            "access_token": "access_token",
+            "scope": "default"
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", len(body))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        """ Read the request body (plain or chunked transfer encoding)
+        """
+        if self.headers.get("Transfer-Encoding", "") == "chunked":
+            body = b""
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return body
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def discard_body(self):
+        """ Read the request body, without keeping it, and return its size
+        """
+        size = 0
+        remaining = int(self.headers.get("Content-Length", 0))
+        while remaining > 0:
+            data = self.rfile.read(min(remaining, 1024 * 1024))
+            remaining -= len(data)
+            size += len(data)
+        return size
+
+    def parse_form(self):
+        """ Parse a urlencoded or multipart form
+
+        RETURNS
+        -------
+        fields : dict
+            Field name to value (str) or to (filename, bytes) for files.
+        """
+        body = self.read_body()
+        content_type = self.headers.get("Content-Type", "")
+        if not content_type.startswith("multipart/form-data"):
+            return dict(
+                (k, v[0]) for k, v in parse_qs(body.decode()).items())
+
+        message = email.parser.BytesParser().parsebytes(
+            "Content-Type: {0}\r\n\r\n".format(content_type).encode() + body)
+        fields = dict()
+        for part in message.get_payload():
+            name = part.get_param("name", header="content-disposition")
+            filename = part.get_filename()
+            payload = part.get_payload(decode=True)
+            if filename is None:
+                fields[name] = payload.decode()
+            else:
+                fields[name] = (filename, payload)
+        return fields
+
+    def local_path(self, service):
+        """ Map the request path onto the directory served as a remote system
+        """
+        url = urlparse(self.path)
+        # Paths are quoted in urls (i.e., "a%231.txt" for "a#1.txt").
+        remote_path = unquote(url.path)[len(service):].strip("/")
+        return os.path.join(self.server.root, remote_path), remote_path
+
+    def file_info(self, local, remote_path, name=None):
+        info = os.stat(local)
+        is_dir = os.path.isdir(local)
+        entry = {
+            "name": os.path.basename(local) if name is None else name,
+            "path": "/" + "/".join(remote_path.split("/")[1:]),
+            "lastModified": agave_timestamp(info.st_mtime),
+            "length": 4096 if is_dir else info.st_size,
+            "permissions": "ALL",
+            "format": "folder" if is_dir else "raw",
+            "mimeType": "text/directory" if is_dir else "application/octet-stream",
+            "type": "dir" if is_dir else "file",
+            "system": remote_path.split("/")[0],
+        }
+        checksums = getattr(self.server, "checksums", None)
+        if checksums is not None and not is_dir:
+            entry["checksum"] = checksums(local)
+        return entry
+
+    def import_history(self):
+        if not hasattr(self.server, "imports"):
+            self.server.imports = dict()
+        return self.server.imports
+
+    def do_GET(self):
+        if self.path.startswith(self.history_service):
+            _, remote_path = self.local_path(self.history_service)
+            if remote_path not in self.import_history():
+                return self.send_status(404)
+            events, pending = self.import_history()[remote_path]
+            if pending:
+                events.append({"status": pending.pop(0), "created": agave_timestamp(time.time())})
+            return self.send_json(200, events)
+
+        if self.path.startswith(self.listings_service):
+            local, remote_path = self.local_path(self.listings_service)
+            if not os.path.exists(local):
+                return self.send_status(404)
+            if not os.path.isdir(local):
+                return self.send_json(200, [self.file_info(local, remote_path)])
+
+            # Pages of the listing, as set by "offset" and "limit".
+            query = parse_qs(urlparse(self.path).query)
+            offset = int(query.get("offset", ["0"])[0])
+            limit = int(query.get("limit", ["0"])[0]) or None
+            self.server.listing_requests = getattr(self.server, "listing_requests", 0) + 1
+
+            names = ["."] + sorted(os.listdir(local))
+            listing = []
+            for name in names[offset:offset + limit if limit else None]:
+                if name == ".":
+                    listing.append(self.file_info(local, remote_path, name="."))
+                else:
+                    listing.append(self.file_info(
+                        os.path.join(local, name), remote_path + "/" + name))
+            return self.send_json(200, listing)
+
+        if self.path.startswith(self.media_service):
+            local, _ = self.local_path(self.media_service)
+            if not os.path.isfile(local):
+                return self.send_status(404)
+
+            # Single byte ranges only (i.e., "bytes=10-" or "bytes=10-19").
+            size = os.path.getsize(local)
+            start, end = 0, size - 1
+            byte_range = self.headers.get("Range")
+            if byte_range is not None and getattr(self.server, "ranges", True):
+                first, _, last = byte_range[len("bytes="):].partition("-")
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+                if start >= size:
+                    return self.send_status(416)
+                self.send_response(206)
+                self.send_header("Content-Range", "bytes {0}-{1}/{2}".format(start, end, size))
+            else:
+                self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", end - start + 1)
+            self.end_headers()
+            with open(local, "rb") as f:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    data = f.read(min(remaining, 65536))
+                    self.wfile.write(data)
+                    remaining -= len(data)
+            return
+
+        self.send_status(404)
+
+    def do_POST(self):
+        """ Upload a file into a directory, or refresh a token
+        """
+        if self.path == self.token_service:
+            return self.send_token()
+        if not self.path.startswith(self.media_service):
+            return self.send_status(404)
+        local, remote_path = self.local_path(self.media_service)
+        if getattr(self.server, "discard_uploads", False):
+            return self.send_json(200, {"length": self.discard_body()})
+        fields = self.parse_form()
+        if not os.path.isdir(local):
+            return self.send_status(404)
+
+        if "urlToIngest" in fields:
+            source = os.path.join(self.server.root, fields["urlToIngest"][len("agave://"):])
+            filename = fields["fileName"]
+            destination = os.path.join(local, filename)
+            staging = ["STAGING"] * getattr(self.server, "staging_polls", 1)
+            statuses = staging + ["STAGING_FAILED"]
+            if os.path.isfile(source):
+                shutil.copyfile(source, destination)
+                statuses = staging + ["STAGING_COMPLETED"]
+            else:
+                open(destination, "wb").close()
+            # Earlier imports stay in the history of the path.
+            events, _ = self.import_history().get(remote_path.rstrip("/") + "/" + filename,
+                                                  ([], []))
+            events.append({"status": "STAGING_QUEUED", "created": agave_timestamp(time.time())})
+            self.import_history()[remote_path.rstrip("/") + "/" + filename] = (events, statuses)
+            info = self.file_info(destination, remote_path + "/" + filename)
+            info["status"] = "STAGING_QUEUED"
+            return self.send_json(200, info)
+
+        filename, payload = fields["fileToUpload"]
+        filename = fields.get("fileName", filename)
+        with open(os.path.join(local, filename), "wb") as f:
+            f.write(payload)
+        self.send_json(200, self.file_info(
+            os.path.join(local, filename), remote_path + "/" + filename))
+
+    def do_PUT(self):
+        """ Make a directory
+        """
+        if not self.path.startswith(self.media_service):
+            return self.send_status(404)
+        local, remote_path = self.local_path(self.media_service)
+        fields = self.parse_form()
+        if fields.get("action") != "mkdir":
+            return self.send_status(400)
+
+        new_dir = os.path.join(local, fields["path"])
+        if os.path.isfile(new_dir):
+            return self.send_status(400)
+        if not os.path.isdir(new_dir):
+            os.makedirs(new_dir)
+        self.send_json(200, self.file_info(
+            new_dir, remote_path + "/" + fields["path"]))
+
+    def do_DELETE(self):
+        if not self.path.startswith(self.media_service):
+            return self.send_status(404)
+        local, _ = self.local_path(self.media_service)
+        if os.path.isdir(local):
+            shutil.rmtree(local)
+        elif os.path.isfile(local):
+            os.remove(local)
+        else:
+            return self.send_status(404)
+        self.send_status(200)
@@ -0,0 +1,839 @@
+"""
+    test_copy.py
+
+    Test "agavecli fs cp" and "agavecli fs sync" transfers of whole directory
+    trees.
+The mock server serves a temporary directory as the remote Agave systems, so
+the result of a copy can be compared against the local tree.
+"""
+import pytest
+import email.parser
+import filecmp
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import agavecli
+from agavecli.files.checksums import ChecksumCache, file_checksum
+from agavecli.files.copy import import_remote_to_remote
+from agavecli.files.ratelimit import RateLimiter
+from agavecli.files.streams import MultipartStream, StreamPipe, copy_response
+from agavecli.files.transfers import TransferOptions
+from agavecli.utils import AgaveClient
+from agavecli_testsuite import MockServer, MockServerFilesystem, agave_timestamp
+
+# Instace of local agave database used for testing the cli against agave api
+# endpoints. Notice that the "baseurl" field points to "localhost."
+sample_agavedb = {
+    "current": {
+        "access_token": "access_token",
+        "apikey": "key",
+        "apisecret": "secret",
+        "baseurl": "http://localhost:{port}/",
+        "created_at": "",
+        "devurl": "",
+        "expires_at": "",
+        "expires_in": 14400,
+        "refresh_token": "refresh_token",
+        "tenantid": "mocked tenant",
+        "username": "user"
+    },
+    "tenants": {}
+}
+
+
+def make_local_tree(root):
+    """ Create a small directory tree to copy around
+    """
+    os.makedirs(os.path.join(root, "sub", "nested"))
+    os.makedirs(os.path.join(root, "empty"))
+    contents = {
+        "a.txt": b"file a\n",
+        "b.dat": os.urandom(100000),
+        os.path.join("sub", "c.txt"): b"file c\n",
+        os.path.join("sub", "nested", "d.txt"): b"file d\n",
+    }
+    for name, data in contents.items():
+        with open(os.path.join(root, name), "wb") as f:
+            f.write(data)
+
+
+def same_tree(left, right):
+    """ Check two directory trees hold the same files and contents
+    """
+    cmp = filecmp.dircmp(left, right)
+    if cmp.left_only or cmp.right_only or cmp.funny_files:
+        return False
+    _, mismatch, errors = filecmp.cmpfiles(left, right, cmp.common_files, shallow=False)
+    if mismatch or errors:
+        return False
+    return all(same_tree(os.path.join(left, d), os.path.join(right, d))
+               for d in cmp.common_dirs)
+
+
+def test_multipart_stream_unknown_length():
+    """ Test a streamed multipart body of unknown length
+
+    The body has no length (so it is sent chunked) and has to parse back
+    into the streamed contents, whatever the size of the reads.
+    """
+    chunks = [os.urandom(1000) for _ in range(50)]
+    body = MultipartStream("fileToUpload", "file.dat", StreamPipe(iter(chunks), 2))
+    assert not hasattr(body, "len")
+
+    data = b""
+    while True:
+        block = body.read(777)
+        if not block:
+            break
+        data += block
+
+    message = email.parser.BytesParser().parsebytes(
+        "Content-Type: {0}\r\n\r\n".format(body.content_type).encode() + data)
+    part = message.get_payload()[0]
+    assert part.get_filename() == "file.dat"
+    assert part.get_payload(decode=True) == b"".join(chunks)
+
+
+def sha256_file(local_path):
+    with open(local_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def test_checksum_cache(tmpdir):
+    """ Test checksums are only computed again for files that changed
+    """
+    cache = ChecksumCache(str(tmpdir.join("checksums.db")))
+    data_file = str(tmpdir.join("data.bin"))
+    with open(data_file, "wb") as f:
+        f.write(b"data")
+
+    assert file_checksum(data_file, cache) == hashlib.sha256(b"data").hexdigest()
+    stat = os.stat(data_file)
+    cache.put(data_file, stat.st_size, stat.st_mtime, "cached")
+    assert file_checksum(data_file, cache) == "cached"
+
+    with open(data_file, "ab") as f:
+        f.write(b" changed")
+    assert file_checksum(data_file, cache) == hashlib.sha256(b"data changed").hexdigest()
+
+
+def test_rate_limiter_shared():
+    """ Test threads sharing a rate limiter are held to its aggregate rate
+    """
+    limiter = RateLimiter(4 * 1024 * 1024, burst=256 * 1024)
+
+    def transfer():
+        for _ in range(16):
+            limiter.consume(64 * 1024)
+
+    start = time.time()
+    threads = [threading.Thread(target=transfer) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    # 4 MiB at 4 MiB/s, minus the burst.
+    assert 0.85 < elapsed < 1.5
+
+
+class TestMockServer(MockServer):
+    """ Test recursive copies to and from the mock files api
+    """
+
+    @classmethod
+    def setup_class(cls):
+        """ Set up an agave mock server
+
+        Listen and serve mock api as a daemon.
+        """
+        MockServer.serve.__func__(cls, MockServerFilesystem, threaded=True)
+
+    def setup_method(self, method):
+        """ Set up a local agave database and an empty remote system
+        """
+        self.agavedb = tempfile.mkdtemp()
+        self.mock_server.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.mock_server.root, "tacc-globalfs-user"))
+        self.remote = os.path.join(self.mock_server.root, "tacc-globalfs-user")
+        self.local = tempfile.mkdtemp()
+        self.mock_server.checksums = None
+        self.mock_server.imports = dict()
+        self.mock_server.staging_polls = 1
+
+        sample_agavedb["current"]["created_at"] = int(time.time())
+        baseurl = sample_agavedb["current"]["baseurl"]
+        sample_agavedb["current"]["baseurl"] = baseurl.format(port=self.mock_server_port)
+        with open(os.path.join(self.agavedb, "agave.json"), "w") as f:
+            json.dump(sample_agavedb, f, sort_keys=True, indent=4)
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.agavedb)
+        shutil.rmtree(self.mock_server.root)
+        shutil.rmtree(self.local)
+
+    def run_cli(self, *argv):
+        args = agavecli.main_parser.parse_args(list(argv) + ["-A", self.agavedb])
+        agavecli.main(args)
+
+    def test_fs_cp_local_dir_to_remote(self, capfd):
+        """ Test "agavecli fs cp -r <dir> agave://<system>/"
+
+        The directory should be recreated inside the remote destination.
+        """
+        tree = os.path.join(self.local, "tree")
+        make_local_tree(tree)
+
+        self.run_cli("fs", "cp", "-r", "-j", "3", tree, "agave://tacc-globalfs-user/")
+
+        out, err = capfd.readouterr()
+        assert "4 copied, 0 failed" in out
+        assert same_tree(tree, os.path.join(self.remote, "tree"))
+
+    def test_fs_cp_local_dir_to_remote_failures(self, capfd):
+        """ Test a recursive upload reports failures at the end
+
+        A file standing where a remote directory should be made makes the
+        directory (and the files in it) fail without stopping the others.
+        """
+        tree = os.path.join(self.local, "tree")
+        make_local_tree(tree)
+        os.makedirs(os.path.join(self.remote, "newtree"))
+        with open(os.path.join(self.remote, "newtree", "sub"), "w") as f:
+            f.write("not a directory\n")
+
+        with pytest.raises(SystemExit) as e:
+            self.run_cli("fs", "cp", "-r", tree, "agave://tacc-globalfs-user/newtree")
+
+        out, err = capfd.readouterr()
+        assert e.value.code == 1
+        assert "2 copied, 1 failed" in out
+        assert "Failed to copy {0}/".format(os.path.join(tree, "sub")) in err
+        assert filecmp.cmp(os.path.join(tree, "b.dat"),
+                           os.path.join(self.remote, "newtree", "b.dat"), shallow=False)
+
+    def test_fs_cp_remote_dir_to_local(self, capfd):
+        """ Test "agavecli fs cp -r agave://<system>/<dir> <dir>"
+
+        The remote tree, empty directories included, should be mirrored in
+        the local destination.
+        """
+        make_local_tree(os.path.join(self.remote, "outputs"))
+
+        self.run_cli("fs", "cp", "-r", "-j", "3",
+                     "agave://tacc-globalfs-user/outputs", self.local)
+
+        out, err = capfd.readouterr()
+        assert "4 copied, 0 failed" in out
+        assert same_tree(os.path.join(self.remote, "outputs"),
+                         os.path.join(self.local, "outputs"))
+
+    def test_fs_cp_special_names(self, capfd):
+        """ Test "agavecli fs cp -r" of names holding "#", "?" and "%"
+
+        Names should be quoted in urls, both ways.
+        """
+        outputs = os.path.join(self.remote, "outputs")
+        os.makedirs(os.path.join(outputs, "d#?%"))
+        for name in ("a#1.txt", "b?2.txt", os.path.join("d#?%", "c%203.txt")):
+            with open(os.path.join(outputs, name), "wb") as f:
+                f.write(name.encode())
+
+        self.run_cli("fs", "cp", "-r", "agave://tacc-globalfs-user/outputs", self.local)
+        self.run_cli("fs", "cp", "-r", os.path.join(self.local, "outputs"),
+                     "agave://tacc-globalfs-user/copies")
+
+        out, err = capfd.readouterr()
+        assert out.count("3 copied, 0 failed") == 2
+        assert same_tree(outputs, os.path.join(self.local, "outputs"))
+        assert same_tree(outputs, os.path.join(self.remote, "copies"))
+
+    def test_fs_cp_recursive_remote_file_to_local(self):
+        """ Test "agavecli fs cp -r agave://<system>/<dir>/<file> <path>"
+
+        A file given to a recursive copy should be downloaded as a file,
+        without making any directory.
+        """
+        make_local_tree(os.path.join(self.remote, "outputs"))
+        destination = os.path.join(self.local, "out")
+
+        self.run_cli("fs", "cp", "-r", "agave://tacc-globalfs-user/outputs/b.dat", destination)
+
+        assert filecmp.cmp(os.path.join(self.remote, "outputs", "b.dat"), destination,
+                           shallow=False)
+
+    def test_fs_cp_remote_to_remote_stream(self):
+        """ Test "agavecli fs cp agave://<system>/<file> agave://<system>/<dir>/<name>"
+
+        The file is streamed from one remote path into another, under a new
+        name.
+        """
+        os.makedirs(os.path.join(self.remote, "inputs"))
+        os.makedirs(os.path.join(self.remote, "copies"))
+        with open(os.path.join(self.remote, "inputs", "data.bin"), "wb") as f:
+            f.write(os.urandom(3 * 1024 * 1024 + 17))
+
+        self.run_cli("fs", "cp", "agave://tacc-globalfs-user/inputs/data.bin",
+                     "agave://tacc-globalfs-user/copies/renamed.bin")
+
+        assert filecmp.cmp(os.path.join(self.remote, "inputs", "data.bin"),
+                           os.path.join(self.remote, "copies", "renamed.bin"), shallow=False)
+
+    def test_fs_cp_remote_to_remote_import(self, capfd):
+        """ Test "agavecli fs cp -m import agave://<system>/<file> agave://<system>/<dir>/"
+
+        Agave is asked to import the file and the transfer is followed
+        until it completes.
+        """
+        os.makedirs(os.path.join(self.remote, "inputs"))
+        os.makedirs(os.path.join(self.remote, "copies"))
+        with open(os.path.join(self.remote, "inputs", "data.bin"), "wb") as f:
+            f.write(os.urandom(1000))
+
+        self.run_cli("fs", "cp", "-m", "import", "--poll-interval", "0",
+                     "agave://tacc-globalfs-user/inputs/data.bin",
+                     "agave://tacc-globalfs-user/copies/")
+
+        out, err = capfd.readouterr()
+        assert out.splitlines() == [
+            "copies/data.bin: STAGING_QUEUED",
+            "copies/data.bin: STAGING",
+            "copies/data.bin: STAGING_COMPLETED"]
+        assert filecmp.cmp(os.path.join(self.remote, "inputs", "data.bin"),
+                           os.path.join(self.remote, "copies", "data.bin"), shallow=False)
+
+    def test_fs_cp_remote_to_remote_import_slow(self, capfd):
+        """ Test a status is printed once however many polls it lasts
+        """
+        os.makedirs(os.path.join(self.remote, "copies"))
+        with open(os.path.join(self.remote, "data.bin"), "wb") as f:
+            f.write(os.urandom(1000))
+        self.mock_server.staging_polls = 4
+
+        self.run_cli("fs", "cp", "-m", "import", "--poll-interval", "0",
+                     "agave://tacc-globalfs-user/data.bin",
+                     "agave://tacc-globalfs-user/copies/")
+
+        out, err = capfd.readouterr()
+        assert out.splitlines() == [
+            "copies/data.bin: STAGING_QUEUED",
+            "copies/data.bin: STAGING",
+            "copies/data.bin: STAGING_COMPLETED"]
+
+    def test_fs_cp_remote_to_remote_import_failed(self, capfd):
+        """ Test a failed import exits with an error
+        """
+        os.makedirs(os.path.join(self.remote, "copies"))
+
+        with pytest.raises(SystemExit) as e:
+            self.run_cli("fs", "cp", "-m", "import", "--poll-interval", "0",
+                         "agave://tacc-globalfs-user/missing.bin",
+                         "agave://tacc-globalfs-user/copies/")
+
+        out, err = capfd.readouterr()
+        assert e.value.code == 1
+        assert "ended with status STAGING_FAILED" in err
+
+    def write_partial_download(self, remote_file, local_file, data, length=None):
+        """ Leave a partial download behind, as an interrupted copy would
+        """
+        with open(local_file, "wb") as f:
+            f.write(data)
+        with open(local_file + ".agavecli-partial", "w") as f:
+            json.dump({
+                "origin": "agave://tacc-globalfs-user/data.bin",
+                "length": os.path.getsize(remote_file) if length is None else length,
+                "lastModified": agave_timestamp(os.stat(remote_file).st_mtime),
+            }, f)
+
+    def test_fs_cp_remote_to_remote_reimport(self, capfd):
+        """ Test importing again over a path imported before
+
+        The events of the first import should not end the second one, which
+        fails (the origin is gone).
+        """
+        os.makedirs(os.path.join(self.remote, "inputs"))
+        os.makedirs(os.path.join(self.remote, "copies"))
+        with open(os.path.join(self.remote, "inputs", "data.bin"), "wb") as f:
+            f.write(os.urandom(1000))
+        self.run_cli("fs", "cp", "-m", "import", "--poll-interval", "0",
+                     "agave://tacc-globalfs-user/inputs/data.bin",
+                     "agave://tacc-globalfs-user/copies/")
+        capfd.readouterr()
+        os.remove(os.path.join(self.remote, "inputs", "data.bin"))
+        # Event times have millisecond resolution.
+        time.sleep(0.01)
+
+        with pytest.raises(SystemExit) as e:
+            self.run_cli("fs", "cp", "-m", "import", "--poll-interval", "0",
+                         "agave://tacc-globalfs-user/inputs/data.bin",
+                         "agave://tacc-globalfs-user/copies/")
+
+        out, err = capfd.readouterr()
+        assert e.value.code == 1
+        assert out.splitlines() == [
+            "copies/data.bin: STAGING_QUEUED",
+            "copies/data.bin: STAGING",
+            "copies/data.bin: STAGING_FAILED"]
+
+    def test_import_remote_to_remote_timeout(self):
+        """ Test an import that does not end in time fails
+        """
+        os.makedirs(os.path.join(self.remote, "copies"))
+        with open(os.path.join(self.remote, "data.bin"), "wb") as f:
+            f.write(b"data")
+        client = AgaveClient("http://localhost:{0}/".format(self.mock_server_port))
+
+        with pytest.raises(IOError) as e:
+            import_remote_to_remote(client, "files/v2/media/system", "files/v2/history/system",
+                                    "agave://tacc-globalfs-user/data.bin", "tacc-globalfs-user",
+                                    "copies", "data.bin", {}, poll_interval=0, timeout=0)
+
+        assert "still STAGING_QUEUED after 0 seconds" in str(e.value)
+
+    def test_fs_cp_remote_to_local_continue(self):
+        """ Test "agavecli fs cp -c agave://<system>/<file> <file>"
+
+        Only the bytes missing from the partial download should be fetched
+        (the partial bytes here differ from the remote ones to tell).
+        """
+        data = os.urandom(1000000)
+        remote_file = os.path.join(self.remote, "data.bin")
+        local_file = os.path.join(self.local, "data.bin")
+        with open(remote_file, "wb") as f:
+            f.write(data)
+        self.write_partial_download(remote_file, local_file, b"\0" * 300000)
+
+        self.run_cli("fs", "cp", "-c", "agave://tacc-globalfs-user/data.bin", local_file)
+
+        with open(local_file, "rb") as f:
+            assert f.read() == b"\0" * 300000 + data[300000:]
+        assert not os.path.exists(local_file + ".agavecli-partial")
+
+    def test_fs_cp_remote_to_local_continue_changed(self):
+        """ Test a partial download of an outdated remote file starts over
+        """
+        data = os.urandom(1000000)
+        remote_file = os.path.join(self.remote, "data.bin")
+        local_file = os.path.join(self.local, "data.bin")
+        with open(remote_file, "wb") as f:
+            f.write(data)
+        self.write_partial_download(remote_file, local_file, b"\0" * 300000, length=2000000)
+
+        self.run_cli("fs", "cp", "-c", "agave://tacc-globalfs-user/data.bin", local_file)
+
+        with open(local_file, "rb") as f:
+            assert f.read() == data
+        assert not os.path.exists(local_file + ".agavecli-partial")
+
+    def test_fs_cp_remote_to_local_segments(self):
+        """ Test "agavecli fs cp -s 4 agave://<system>/<file> <file>"
+
+        The file is fetched in four byte ranges written in place.
+        """
+        data = os.urandom(4 * 1024 * 1024 + 3)
+        remote_file = os.path.join(self.remote, "data.bin")
+        local_file = os.path.join(self.local, "data.bin")
+        with open(remote_file, "wb") as f:
+            f.write(data)
+
+        self.run_cli("fs", "cp", "-s", "4", "agave://tacc-globalfs-user/data.bin", local_file)
+
+        with open(local_file, "rb") as f:
+            assert f.read() == data
+
+    def test_fs_cp_remote_to_local_segments_no_ranges(self, capfd):
+        """ Test a segmented download fails if the server ignores ranges
+        """
+        remote_file = os.path.join(self.remote, "data.bin")
+        local_file = os.path.join(self.local, "data.bin")
+        with open(remote_file, "wb") as f:
+            f.write(os.urandom(4 * 1024 * 1024))
+
+        self.mock_server.ranges = False
+        try:
+            with pytest.raises(SystemExit) as e:
+                self.run_cli("fs", "cp", "-s", "4", "agave://tacc-globalfs-user/data.bin",
+                             local_file)
+        finally:
+            del self.mock_server.ranges
+
+        out, err = capfd.readouterr()
+        assert e.value.code == 1
+        assert "Server did not send bytes" in err
+        assert not os.path.exists(local_file)
+
+    def test_fs_cp_remote_to_local_segments_small(self):
+        """ Test "agavecli fs cp -s 4" of files too small to be split
+
+        An empty file, and a file smaller than two segments from a server
+        that ignores ranges, are downloaded whole.
+        """
+        for name, size in (("empty.bin", 0), ("small.bin", 1024)):
+            with open(os.path.join(self.remote, name), "wb") as f:
+                f.write(os.urandom(size))
+
+        self.mock_server.ranges = False
+        try:
+            for name in ("empty.bin", "small.bin"):
+                self.run_cli("fs", "cp", "-s", "4", "agave://tacc-globalfs-user/" + name,
+                             os.path.join(self.local, name))
+        finally:
+            del self.mock_server.ranges
+
+        for name in ("empty.bin", "small.bin"):
+            assert filecmp.cmp(os.path.join(self.remote, name), os.path.join(self.local, name),
+                               shallow=False)
+        with pytest.raises(SystemExit):
+            self.run_cli("fs", "cp", "-s", "0", "agave://tacc-globalfs-user/small.bin",
+                         self.local)
+
+    def upload_peak_rss(self, size):
+        """ Peak resident memory (in KiB) of "agavecli fs cp" uploading a file
+
+        The upload is run in a child process so that its peak memory can be
+        measured on its own.
+        """
+        resource = pytest.importorskip("resource")
+        local_file = os.path.join(self.local, "upload.bin")
+        with open(local_file, "wb") as f:
+            f.truncate(size)
+
+        package_dir = os.path.dirname(os.path.dirname(agavecli.__file__))
+        env = dict(os.environ, PYTHONPATH=package_dir)
+        script = "import sys, agavecli; agavecli.main(agavecli.main_parser.parse_args(sys.argv[1:]))"
+        subprocess.check_call(
+            [sys.executable, "-c", script, "fs", "cp", local_file,
+             "agave://tacc-globalfs-user/", "-A", self.agavedb],
+            env=env, stdout=subprocess.DEVNULL)
+
+        return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    def test_fs_cp_local_to_remote_memory(self):
+        """ Test uploads take the same memory whatever the size of the file
+
+        Peak memory uploading 256 MiB should be about the same as uploading
+        1 MiB (ru_maxrss of children is a running maximum, so the small
+        upload is measured first).
+        """
+        if not sys.platform.startswith("linux"):
+            pytest.skip("ru_maxrss is reported in KiB only on linux")
+
+        self.mock_server.discard_uploads = True
+        try:
+            small = self.upload_peak_rss(1024 * 1024)
+            large = self.upload_peak_rss(256 * 1024 * 1024)
+        finally:
+            del self.mock_server.discard_uploads
+
+        assert large - small < 32 * 1024
+
+    def test_fs_cp_remote_to_local_chunk_size(self):
+        """ Test "agavecli fs cp --chunk-size 1000 agave://<system>/<file> <file>"
+
+        A chunk size that does not divide the file size should still copy
+        every byte.
+        """
+        data = os.urandom(123457)
+        remote_file = os.path.join(self.remote, "data.bin")
+        local_file = os.path.join(self.local, "data.bin")
+        with open(remote_file, "wb") as f:
+            f.write(data)
+
+        self.run_cli("fs", "cp", "--chunk-size", "1000",
+                     "agave://tacc-globalfs-user/data.bin", local_file)
+
+        with open(local_file, "rb") as f:
+            assert f.read() == data
+
+    def test_fs_sync_local_to_remote(self, capfd):
+        """ Test "agavecli fs sync <dir> agave://<system>/<dir>"
+
+        A second sync should only upload the files that changed, and a dry
+        run should print them without uploading anything.
+        """
+        tree = os.path.join(self.local, "tree")
+        make_local_tree(tree)
+        self.run_cli("fs", "sync", tree, "agave://tacc-globalfs-user/mirror")
+        mirror = os.path.join(self.remote, "mirror")
+        assert same_tree(tree, mirror)
+        out, _ = capfd.readouterr()
+        assert "4 copied, 0 failed" in out
+
+        uploaded = os.stat(os.path.join(mirror, "a.txt")).st_mtime
+        with open(os.path.join(tree, "sub", "c.txt"), "ab") as f:
+            f.write(b"more\n")
+        with open(os.path.join(tree, "new.txt"), "wb") as f:
+            f.write(b"new\n")
+
+        self.run_cli("fs", "sync", "-n", tree, "agave://tacc-globalfs-user/mirror")
+        out, _ = capfd.readouterr()
+        assert out.splitlines() == [
+            "upload   agave://tacc-globalfs-user/mirror/new.txt",
+            "upload   agave://tacc-globalfs-user/mirror/sub/c.txt",
+        ]
+        assert not os.path.exists(os.path.join(mirror, "new.txt"))
+
+        self.run_cli("fs", "sync", tree, "agave://tacc-globalfs-user/mirror")
+        out, _ = capfd.readouterr()
+        assert "2 copied, 0 failed" in out
+        assert same_tree(tree, mirror)
+        assert os.stat(os.path.join(mirror, "a.txt")).st_mtime == uploaded
+
+    def test_fs_sync_remote_to_local_delete(self, capfd):
+        """ Test "agavecli fs sync --delete agave://<system>/<dir> <dir>"
+
+        Files missing from the remote directory should be deleted, and
+        downloaded files should keep the remote modification times so that
+        nothing is left to do afterwards.
+        """
+        tree = os.path.join(self.remote, "tree")
+        make_local_tree(tree)
+        mirror = os.path.join(self.local, "mirror")
+        os.makedirs(os.path.join(mirror, "stale", "dir"))
+        with open(os.path.join(mirror, "stale", "dir", "old.txt"), "wb") as f:
+            f.write(b"old\n")
+        os.makedirs(os.path.join(mirror, "a.txt"))
+
+        self.run_cli("fs", "sync", "--delete", "-j", "3",
+                     "agave://tacc-globalfs-user/tree", mirror)
+        out, _ = capfd.readouterr()
+        assert "5 copied, 0 failed" in out
+        assert same_tree(tree, mirror)
+        remote_mtime = os.stat(os.path.join(tree, "b.dat")).st_mtime
+        assert abs(os.stat(os.path.join(mirror, "b.dat")).st_mtime - remote_mtime) < 0.01
+
+        self.run_cli("fs", "sync", "-n", "--delete",
+                     "agave://tacc-globalfs-user/tree", mirror)
+        out, _ = capfd.readouterr()
+        assert out == ""
+
+    def test_fs_sync_remote_file(self, capfd):
+        """ Test "agavecli fs sync agave://<system>/<file> <dir>" exits with an error
+        """
+        with open(os.path.join(self.remote, "a.txt"), "wb") as f:
+            f.write(b"a\n")
+
+        with pytest.raises(SystemExit) as e:
+            self.run_cli("fs", "sync", "agave://tacc-globalfs-user/a.txt", self.local)
+
+        _, err = capfd.readouterr()
+        assert e.value.code == 1
+        assert err == "agave://tacc-globalfs-user/a.txt is not a directory\n"
+
+    def test_fs_cp_verify(self, capfd):
+        """ Test "agavecli fs cp --verify"
+
+        Uploads and downloads should be checked against the checksums sent
+        by the server, and the checksums of local files should be cached.
+        """
+        self.mock_server.checksums = sha256_file
+        tree = os.path.join(self.local, "tree")
+        make_local_tree(tree)
+        local_file = os.path.join(tree, "b.dat")
+
+        self.run_cli("fs", "cp", "--verify", local_file, "agave://tacc-globalfs-user/")
+        cache = ChecksumCache(os.path.join(self.agavedb, "checksums.db"))
+        stat = os.stat(local_file)
+        assert cache.get(local_file, stat.st_size, stat.st_mtime) == sha256_file(local_file)
+
+        self.run_cli("fs", "cp", "-r", "--verify", tree, "agave://tacc-globalfs-user/")
+        copy = os.path.join(self.local, "copy")
+        self.run_cli("fs", "cp", "-r", "--verify", "agave://tacc-globalfs-user/tree", copy)
+        out, _ = capfd.readouterr()
+        assert "4 copied, 0 failed" in out
+        assert same_tree(tree, copy)
+
+        self.mock_server.checksums = lambda local: "0" * 64
+        with pytest.raises(SystemExit):
+            self.run_cli("fs", "cp", "--verify", "agave://tacc-globalfs-user/b.dat",
+                         os.path.join(self.local, "b.dat"))
+        _, err = capfd.readouterr()
+        assert "Checksum mismatch" in err
+
+    def test_fs_cp_limit_rate(self):
+        """ Test "agavecli fs cp -r --limit-rate 2M <dir> agave://<system>/"
+
+        Concurrent uploads should share the limit.
+        """
+        tree = os.path.join(self.local, "tree")
+        os.makedirs(tree)
+        for name in ("a", "b", "c", "d"):
+            with open(os.path.join(tree, name), "wb") as f:
+                f.write(os.urandom(512 * 1024))
+
+        start = time.time()
+        self.run_cli("fs", "cp", "-r", "-j", "4", "--limit-rate", "2M",
+                     tree, "agave://tacc-globalfs-user/")
+        elapsed = time.time() - start
+
+        assert same_tree(tree, os.path.join(self.remote, "tree"))
+        assert elapsed > 0.75
+
+    def test_limit_rate_below_chunk_size(self):
+        """ Test a rate below the chunk size paces a download evenly
+
+        At 1 MiB/s, 1 MiB chunks would each go at full speed and then stall
+        (0.75s). Chunks are cut to the 0.25s burst of the limiter instead.
+        """
+        with open(os.path.join(self.remote, "data.bin"), "wb") as f:
+            f.write(os.urandom(1024 * 1024))
+        options = TransferOptions(1024 * 1024, rate_limiter=RateLimiter(1024 * 1024))
+        client = AgaveClient("http://localhost:{0}/".format(self.mock_server_port))
+
+        class Recorder(object):
+            times = []
+
+            def write(self, data):
+                self.times.append(time.time())
+
+        resp = client.get("files/v2/media/system", "tacc-globalfs-user", "data.bin",
+                          stream=True)
+        copy_response(resp, Recorder(), options.chunk_size, limiter=options.rate_limiter)
+
+        gaps = [b - a for a, b in zip(Recorder.times, Recorder.times[1:])]
+        assert options.chunk_size == 256 * 1024
+        assert len(Recorder.times) >= 4
+        assert max(gaps) < 0.4
+
+    def make_remote_run(self):
+        run = os.path.join(self.remote, "run42")
+        os.makedirs(os.path.join(run, "sub.h5"))
+        contents = {"a.h5": os.urandom(1000), "b.h5": os.urandom(2000),
+                    ".hidden.h5": b"hidden", "notes.txt": b"notes"}
+        for name, data in contents.items():
+            with open(os.path.join(run, name), "wb") as f:
+                f.write(data)
+        return run
+
+    def test_fs_cp_remote_glob_to_local(self, capfd):
+        """ Test "agavecli fs cp 'agave://<system>/<dir>/*.h5' <dir>"
+
+        Only the visible files matching the pattern should be copied.
+        """
+        run = self.make_remote_run()
+
+        self.run_cli("fs", "cp", "agave://tacc-globalfs-user/run42/*.h5", self.local)
+
+        assert sorted(os.listdir(self.local)) == ["a.h5", "b.h5"]
+        assert filecmp.cmp(os.path.join(run, "b.h5"), os.path.join(self.local, "b.h5"),
+                           shallow=False)
+        out, err = capfd.readouterr()
+        assert "2 copied, 0 failed" in out
+        assert "Omitting directory agave://tacc-globalfs-user/run42/sub.h5" in err
+
+    def test_fs_cp_remote_literal_brackets(self):
+        """ Test "agavecli fs cp agave://<system>/<dir>/data[1].txt <file>"
+
+        A name that looks like a pattern but matches nothing is copied as
+        it is.
+        """
+        os.makedirs(os.path.join(self.remote, "inputs"))
+        with open(os.path.join(self.remote, "inputs", "data[1].txt"), "wb") as f:
+            f.write(b"data\n")
+        destination = os.path.join(self.local, "out.txt")
+
+        self.run_cli("fs", "cp", "agave://tacc-globalfs-user/inputs/data[1].txt", destination)
+
+        assert filecmp.cmp(os.path.join(self.remote, "inputs", "data[1].txt"), destination,
+                           shallow=False)
+
+    def test_fs_cp_remote_glob_to_remote(self, capfd):
+        """ Test "agavecli fs cp 'agave://<system>/<dir>/[ab].h5' agave://<system>/<dir>/"
+        """
+        run = self.make_remote_run()
+        os.makedirs(os.path.join(self.remote, "copy"))
+
+        self.run_cli("fs", "cp", "-j", "2", "agave://tacc-globalfs-user/run42/[ab].h5",
+                     "agave://tacc-globalfs-user/copy/")
+
+        copy = os.path.join(self.remote, "copy")
+        assert sorted(os.listdir(copy)) == ["a.h5", "b.h5"]
+        assert filecmp.cmp(os.path.join(run, "a.h5"), os.path.join(copy, "a.h5"), shallow=False)
+
+        with pytest.raises(SystemExit):
+            self.run_cli("fs", "cp", "agave://tacc-globalfs-user/run42/*.nc", self.local)
+        _, err = capfd.readouterr()
+        assert "No match for agave://tacc-globalfs-user/run42/*.nc" in err
+
+    def test_fs_cp_from_file(self, capfd):
+        """ Test "agavecli fs cp --from-file <manifest>"
+
+        Every pair in the manifest should be copied and reported, a bad
+        line or a missing file should not stop the others.
+        """
+        tree = os.path.join(self.local, "tree")
+        make_local_tree(tree)
+        os.makedirs(os.path.join(self.remote, "copies"))
+        manifest = os.path.join(self.local, "manifest.tsv")
+        with open(manifest, "w") as f:
+            f.write("# origin\tdestination\n")
+            f.write("{0}\tagave://tacc-globalfs-user/copies/\n".format(
+                os.path.join(tree, "a.txt")))
+            f.write("{0}\tagave://tacc-globalfs-user/copies/b.bin\n".format(
+                os.path.join(tree, "b.dat")))
+            f.write("\n")
+            f.write("agave://tacc-globalfs-user/copies/b.bin\t{0}/\n".format(
+                os.path.join(self.local, "back")))
+            f.write("agave://tacc-globalfs-user/missing.txt\t{0}\n".format(self.local))
+            f.write("only an origin\n")
+
+        with pytest.raises(SystemExit) as e:
+            self.run_cli("fs", "cp", "-j", "1", "--retries", "0", "--from-file", manifest)
+
+        out, err = capfd.readouterr()
+        assert e.value.code == 1
+        assert "3 copied, 2 failed" in out
+        assert "failed  {0}, line 7".format(manifest) in out
+        assert "failed  agave://tacc-globalfs-user/missing.txt" in out
+        copies = os.path.join(self.remote, "copies")
+        assert sorted(os.listdir(copies)) == ["a.txt", "b.bin"]
+        assert filecmp.cmp(os.path.join(tree, "b.dat"),
+                           os.path.join(self.local, "back", "b.bin"), shallow=False)
+
+        with pytest.raises(SystemExit):
+            self.run_cli("fs", "cp", "--retries", "-1", "--from-file", manifest)
+
+    def test_fs_cp_bundle(self):
+        """ Test "agavecli fs cp -b <format> <dir> agave://<system>/" and back
+
+        The tree should be uploaded as a single archive and unpacked again,
+        empty directories included.
+        """
+        tree = os.path.join(self.local, "tree")
+        make_local_tree(tree)
+
+        for bundle, extension in [("tar", ".tar"), ("gzip", ".tar.gz")]:
+            self.run_cli("fs", "cp", "-b", bundle, tree, "agave://tacc-globalfs-user/")
+            assert os.path.isfile(os.path.join(self.remote, "tree" + extension))
+
+            copy = os.path.join(self.local, "copy-" + bundle)
+            self.run_cli("fs", "cp", "-b", bundle,
+                         "agave://tacc-globalfs-user/tree" + extension, copy)
+            assert same_tree(tree, os.path.join(copy, "tree"))
+
+    def test_fs_cp_bundle_unsafe(self, capfd):
+        """ Test archives with members outside of the destination are refused
+        """
+        outside = os.path.join(self.local, "outside.txt")
+        with open(outside, "wb") as f:
+            f.write(b"outside\n")
+        archive = os.path.join(self.remote, "evil.tar")
+        with tarfile.open(archive, "w") as tar:
+            tar.add(outside, "../outside.txt")
+
+        copy = os.path.join(self.local, "copy")
+        with pytest.raises(SystemExit) as e:
+            self.run_cli("fs", "cp", "-b", "tar", "agave://tacc-globalfs-user/evil.tar", copy)
+
+        _, err = capfd.readouterr()
+        assert e.value.code == 1
+        assert "Refusing to unpack ../outside.txt" in err
@@ -0,0 +1,423 @@
+"""
+    test_listings.py
+
+    Test "agavecli fs ls" against the mock files api.
+"""
+import pytest
+import json
+import os
+import shutil
+import tempfile
+import time
+import agavecli
+from agavecli.files.files import ListingFormatter, parse_agave_time, parse_agave_times
+from agavecli.files.index import NamespaceIndex, refresh_index
+from agavecli.files.listings import SortedListing, crawl_remote, iter_listing_pages
+from agavecli.utils import AgaveClient
+from agavecli_testsuite import MockServer, MockServerFilesystem
+
+# Instace of local agave database used for testing the cli against agave api
+# endpoints. Notice that the "baseurl" field points to "localhost."
+sample_agavedb = {
+    "current": {
+        "access_token": "access_token",
+        "apikey": "key",
+        "apisecret": "secret",
+        "baseurl": "http://localhost:{port}/",
+        "created_at": "",
+        "devurl": "",
+        "expires_at": "",
+        "expires_in": 14400,
+        "refresh_token": "refresh_token",
+        "tenantid": "mocked tenant",
+        "username": "user"
+    },
+    "tenants": {}
+}
+
+
+def test_listing_formatter_short():
+    """ Test the short format fills lines across pages
+
+    Names are padded to the longest one so far plus 3 (at least 8 + 3).
+    """
+    formatter = ListingFormatter(columns=30)
+    first = [{"name": "a", "length": 1, "type": "file"},
+             {"name": "b", "length": 1, "type": "dir"}]
+    second = [{"name": "c", "length": 1, "type": "file"},
+              {"name": "longer_name", "length": 10, "type": "file"}]
+
+    text = formatter.format_page(first) + formatter.format_page(second) + formatter.finish()
+
+    assert text == "a          b/         \nc             longer_name   \n"
+
+
+def test_parse_agave_time():
+    """ Test timestamps are parsed as strptime parses them
+
+    One by one and in a batch, with and without fractions of a second.
+    """
+    timestamps = ["2018-07-10T12:28:01.000-05:00", "2016-02-29T00:00:59.123+05:30",
+                  "2018-12-31T23:59:59-00:00", "2018-01-01T08:05:00.5Z"]
+
+    for ftime, parsed in zip(timestamps, parse_agave_times(timestamps)):
+        fmt = "%Y-%m-%dT%H:%M:%S.%f%z" if "." in ftime else "%Y-%m-%dT%H:%M:%S%z"
+        expected = time.strptime(ftime.replace("Z", "+00:00"), fmt)
+        assert parsed == parse_agave_time(ftime)
+        assert tuple(parsed[0]) == tuple(expected)
+        assert parsed[0].tm_gmtoff == expected.tm_gmtoff
+        assert parsed[1] == time.strftime("%b %d %H:%M", expected).split()
+
+
+def test_sorted_listing_top():
+    """ Test the top entries of a listing are kept across pages
+
+    Ties in size are broken by name.
+    """
+    pages = [[{"name": "c", "length": 3}, {"name": "a", "length": 1}],
+             [{"name": "d", "length": 3}, {"name": "b", "length": 2}],
+             [{"name": "e", "length": 0}]]
+    ranking = SortedListing("size", top=3)
+    for page in pages:
+        ranking.add(page)
+
+    assert [entry["name"] for entry in ranking.entries()] == ["c", "d", "b"]
+
+
+class TestMockServer(MockServer):
+    """ Test listings of the mock files api
+    """
+
+    @classmethod
+    def setup_class(cls):
+        """ Set up an agave mock server
+
+        Listen and serve mock api as a daemon.
+        """
+        MockServer.serve.__func__(cls, MockServerFilesystem, threaded=True)
+
+    def setup_method(self, method):
+        """ Set up a local agave database and a remote system with a directory
+        """
+        self.agavedb = tempfile.mkdtemp()
+        self.mock_server.root = tempfile.mkdtemp()
+        self.mock_server.checksums = None
+        self.mock_server.listing_requests = 0
+        self.remote = os.path.join(self.mock_server.root, "tacc-globalfs-user")
+        os.makedirs(os.path.join(self.remote, "big", "subdir"))
+        for i in range(25):
+            with open(os.path.join(self.remote, "big", "file{0:02d}.txt".format(i)), "wb") as f:
+                f.write(b"x" * i)
+
+        sample_agavedb["current"]["created_at"] = int(time.time())
+        baseurl = sample_agavedb["current"]["baseurl"]
+        sample_agavedb["current"]["baseurl"] = baseurl.format(port=self.mock_server_port)
+        with open(os.path.join(self.agavedb, "agave.json"), "w") as f:
+            json.dump(sample_agavedb, f, sort_keys=True, indent=4)
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.agavedb)
+        shutil.rmtree(self.mock_server.root)
+
+    def run_cli(self, *argv):
+        args = agavecli.main_parser.parse_args(list(argv) + ["-A", self.agavedb])
+        agavecli.main(args)
+
+    def test_iter_listing_pages(self):
+        """ Test a listing is requested a page at a time
+
+        27 entries (".", 25 files and a directory) in pages of 10 take three
+        requests, and only the last page is short.
+        """
+        client = AgaveClient("http://localhost:{0}/".format(self.mock_server_port))
+        pages = list(iter_listing_pages(client, "files/v2/listings/system",
+                                        "tacc-globalfs-user", "big", {}, page_size=10))
+
+        assert [len(page) for page in pages] == [10, 10, 7]
+        assert self.mock_server.listing_requests == 3
+        names = [entry["name"] for page in pages for entry in page]
+        assert names[0] == "." and names[-1] == "subdir"
+        assert len(set(names)) == 27
+
+    def test_iter_listing_pages_empty(self):
+        """ Test paging stops at the first empty page
+
+        A service returning whole listings whatever the limit must not be
+        asked for pages forever. Page sizes and jobs below 1 are rejected.
+        """
+        client = AgaveClient("http://localhost:{0}/".format(self.mock_server_port))
+        pages = list(iter_listing_pages(client, "files/v2/listings/system",
+                                        "tacc-globalfs-user", "big", {}, page_size=0))
+
+        assert [len(page) for page in pages][-1] == 0
+        assert sum(len(page) for page in pages) == 27
+
+        for option in ("--page-size", "-j"):
+            with pytest.raises(SystemExit):
+                self.run_cli("fs", "ls", option, "0", "tacc-globalfs-user/big")
+
+    def test_fs_ls_long_paged(self, capfd):
+        """ Test "agavecli fs ls -l --page-size 4 <system>/<dir>"
+
+        Every entry should be printed once, in the order of the service.
+        """
+        self.run_cli("fs", "ls", "-l", "--page-size", "4", "tacc-globalfs-user/big")
+
+        out, err = capfd.readouterr()
+        lines = out.splitlines()
+        assert len(lines) == 27
+        assert lines[1].split()[-1] == "file00.txt"
+        assert lines[-1].startswith("drwx") and lines[-1].split()[-1] == "subdir/"
+        assert self.mock_server.listing_requests == 7
+
+    def test_fs_ls_sort_top(self, capfd):
+        """ Test "agavecli fs ls -l --sort mtime --top 3 --page-size 4 <system>/<dir>"
+
+        Only the 3 most recently modified entries should be printed.
+        """
+        for i, name in enumerate(["file03.txt", "file17.txt", "file09.txt"]):
+            os.utime(os.path.join(self.remote, "big", name), (0, time.time() + 3600 * (i + 1)))
+
+        self.run_cli("fs", "ls", "-l", "--sort", "mtime", "--top", "3", "--page-size", "4",
+                     "tacc-globalfs-user/big")
+
+        out, err = capfd.readouterr()
+        names = [line.split()[-1] for line in out.splitlines()]
+        assert names == ["file09.txt", "file17.txt", "file03.txt"]
+
+    def test_fs_ls_output_jsonl(self, capfd):
+        """ Test "agavecli fs ls -o jsonl --page-size 4 <system>/<dir>"
+
+        Every entry should be printed as a JSON object, in the order of the
+        service.
+        """
+        self.run_cli("fs", "ls", "-o", "jsonl", "--page-size", "4", "tacc-globalfs-user/big")
+
+        out, err = capfd.readouterr()
+        records = [json.loads(line) for line in out.splitlines()]
+        assert len(records) == 27
+        assert records[1]["name"] == "file00.txt" and records[1]["length"] == 0
+        assert records[-1]["name"] == "subdir" and records[-1]["type"] == "dir"
+        assert sorted(records[0]) == sorted(["system", "path", "name", "type", "length",
+                                             "permissions", "lastModified"])
+
+    def test_fs_ls_output_jsonl_token_refresh(self, capfd):
+        """ Test "agavecli fs ls -o jsonl <system>/<dir>" with an expired token
+
+        The token is refreshed first, and the notice goes to stderr so every
+        line of the output still parses.
+        """
+        sample_agavedb["current"]["created_at"] = 0
+        with open(os.path.join(self.agavedb, "agave.json"), "w") as f:
+            json.dump(sample_agavedb, f, sort_keys=True, indent=4)
+
+        self.run_cli("fs", "ls", "-o", "jsonl", "tacc-globalfs-user/big")
+
+        out, err = capfd.readouterr()
+        records = [json.loads(line) for line in out.splitlines()]
+        assert len(records) == 27
+        assert "Refreshing token..." in err
+        with open(os.path.join(self.agavedb, "agave.json")) as f:
+            assert json.load(f)["current"]["created_at"] > 0
+
+    def test_fs_ls_top_over_pages(self, capfd):
+        """ Test "agavecli fs ls -o jsonl --sort size --top 12 --page-size 4 <system>/<dir>"
+
+        The top entries span several pages. A --top of 0 is rejected.
+        """
+        self.run_cli("fs", "ls", "-o", "jsonl", "--sort", "size", "--top", "12",
+                     "--page-size", "4", "tacc-globalfs-user/big")
+
+        out, err = capfd.readouterr()
+        names = [json.loads(line)["name"] for line in out.splitlines()]
+        files = ["file{0:02d}.txt".format(i) for i in range(24, 14, -1)]
+        assert sorted(names[:2]) == [".", "subdir"]
+        assert names[2:] == files
+
+        with pytest.raises(SystemExit):
+            self.run_cli("fs", "ls", "--top", "0", "tacc-globalfs-user/big")
+
+    def test_fs_ls_missing(self, capfd):
+        """ Test listing a missing directory exits with an error
+        """
+        with pytest.raises(SystemExit) as e:
+            self.run_cli("fs", "ls", "tacc-globalfs-user/missing")
+
+        assert e.value.code != 0
+
+    def make_remote_tree(self):
+        """ Directories a/{b,c}/d and e, with a file in each
+        """
+        for d in ("tree/a/b/d", "tree/a/c", "tree/e"):
+            os.makedirs(os.path.join(self.remote, d))
+        for d in ("tree", "tree/a", "tree/a/b", "tree/a/b/d", "tree/a/c", "tree/e"):
+            with open(os.path.join(self.remote, d, "f.txt"), "wb") as f:
+                f.write(b"f\n")
+
+    def test_fs_ls_recursive(self, capfd):
+        """ Test "agavecli fs ls -R <system>/<dir>"
+
+        Directories should be listed breadth first, in a stable order.
+        """
+        self.make_remote_tree()
+
+        self.run_cli("fs", "ls", "-R", "-j", "3", "tacc-globalfs-user/tree")
+
+        out, err = capfd.readouterr()
+        headers = [line for line in out.splitlines() if line.endswith(":")]
+        assert headers == ["tacc-globalfs-user/tree:", "tacc-globalfs-user/tree/a:",
+                           "tacc-globalfs-user/tree/e:", "tacc-globalfs-user/tree/a/b:",
+                           "tacc-globalfs-user/tree/a/c:", "tacc-globalfs-user/tree/a/b/d:"]
+        assert out.count("f.txt") == 6
+
+    def test_crawl_remote_checkpoint(self):
+        """ Test a crawl stopped midway resumes from its checkpoint
+
+        Only the directory being yielded when the crawl stopped should be
+        yielded again, and the checkpoint removed at the end.
+        """
+        self.make_remote_tree()
+        client = AgaveClient("http://localhost:{0}/".format(self.mock_server_port))
+        checkpoint = os.path.join(self.agavedb, "crawl.json")
+
+        crawl = crawl_remote(client, "files/v2/listings/system", "tacc-globalfs-user", "tree",
+                             {}, jobs=2, checkpoint=checkpoint)
+        first = [next(crawl)[0], next(crawl)[0]]
+        crawl.close()
+        assert os.path.isfile(checkpoint)
+
+        rest = [dirpath for dirpath, _ in crawl_remote(
+            client, "files/v2/listings/system", "tacc-globalfs-user", "tree", {}, jobs=2,
+            checkpoint=checkpoint)]
+
+        assert first == ["tree", "tree/a"]
+        assert rest == ["tree/a", "tree/e", "tree/a/b", "tree/a/c", "tree/a/b/d"]
+        assert not os.path.exists(checkpoint)
+
+        with pytest.raises(ValueError):
+            with open(checkpoint, "w") as f:
+                json.dump({"system": "other", "root": "tree", "pending": []}, f)
+            list(crawl_remote(client, "files/v2/listings/system", "tacc-globalfs-user",
+                              "tree", {}, checkpoint=checkpoint))
+
+    def test_fs_ls_cache(self, capfd):
+        """ Test listings are cached until they expire or the directory changes
+
+        The second listing should be served from the cache, "--no-cache" and
+        "fs mkdir" in the directory should make the next one go to Agave.
+        """
+        self.run_cli("fs", "ls", "tacc-globalfs-user/big")
+        listing, _ = capfd.readouterr()
+        self.run_cli("fs", "ls", "tacc-globalfs-user/big/")
+        cached, _ = capfd.readouterr()
+        assert cached == listing
+        assert self.mock_server.listing_requests == 1
+
+        self.run_cli("fs", "ls", "--no-cache", "tacc-globalfs-user/big")
+        assert self.mock_server.listing_requests == 2
+        self.run_cli("fs", "ls", "--cache-ttl", "0", "tacc-globalfs-user/big")
+        assert self.mock_server.listing_requests == 3
+
+        self.run_cli("fs", "mkdir", "tacc-globalfs-user/big/new")
+        capfd.readouterr()
+        self.run_cli("fs", "ls", "tacc-globalfs-user/big")
+        out, _ = capfd.readouterr()
+        assert self.mock_server.listing_requests == 4
+        assert "new/" in out
+
+    def test_fs_du(self, capfd):
+        """ Test "agavecli fs du [-d 1 | -s] agave://<system>/<dir>"
+
+        Every directory should get the size of all the files under it,
+        children first, and listings should come from the cache once made.
+        """
+        self.make_remote_tree()
+        with open(os.path.join(self.remote, "tree", "a", "b", "d", "big.bin"), "wb") as f:
+            f.write(b"x" * 1000)
+
+        self.run_cli("fs", "du", "-j", "2", "agave://tacc-globalfs-user/tree")
+        out, _ = capfd.readouterr()
+        assert out.splitlines() == [
+            "1002\ttacc-globalfs-user/tree/a/b/d",
+            "1004\ttacc-globalfs-user/tree/a/b",
+            "2\ttacc-globalfs-user/tree/a/c",
+            "1008\ttacc-globalfs-user/tree/a",
+            "2\ttacc-globalfs-user/tree/e",
+            "1012\ttacc-globalfs-user/tree",
+        ]
+        requests = self.mock_server.listing_requests
+
+        self.run_cli("fs", "du", "-d", "1", "tacc-globalfs-user/tree")
+        out, _ = capfd.readouterr()
+        assert out.splitlines() == [
+            "1008\ttacc-globalfs-user/tree/a",
+            "2\ttacc-globalfs-user/tree/e",
+            "1012\ttacc-globalfs-user/tree",
+        ]
+        assert self.mock_server.listing_requests == requests
+
+        self.run_cli("fs", "du", "-s", "--no-cache", "tacc-globalfs-user/tree")
+        out, _ = capfd.readouterr()
+        assert out == "1012\ttacc-globalfs-user/tree\n"
+        assert self.mock_server.listing_requests == 2 * requests
+
+        self.run_cli("fs", "du", "-s", "-o", "csv", "tacc-globalfs-user/tree")
+        out, _ = capfd.readouterr()
+        assert out == "size,path\n1012,tacc-globalfs-user/tree\n"
+
+        with pytest.raises(SystemExit):
+            self.run_cli("fs", "du", "-d", "-1", "tacc-globalfs-user/tree")
+
+    def test_fs_find(self, capfd):
+        """ Test "agavecli fs find agave://<system>/<dir> -name <pattern> -size +N"
+
+        The tree is indexed by the first search, later searches are served
+        from the index until it is updated.
+        """
+        self.make_remote_tree()
+        with open(os.path.join(self.remote, "tree", "a", "c", "big.nc"), "wb") as f:
+            f.write(b"x" * 2048)
+
+        self.run_cli("fs", "find", "-name", "*.txt", "agave://tacc-globalfs-user/tree/a")
+        out, _ = capfd.readouterr()
+        assert out.splitlines() == ["tacc-globalfs-user/tree/a/b/d/f.txt",
+                                    "tacc-globalfs-user/tree/a/b/f.txt",
+                                    "tacc-globalfs-user/tree/a/c/f.txt",
+                                    "tacc-globalfs-user/tree/a/f.txt"]
+        requests = self.mock_server.listing_requests
+
+        self.run_cli("fs", "find", "-type", "f", "-size", "+1K", "-mtime", "-1",
+                     "tacc-globalfs-user/tree/a")
+        out, _ = capfd.readouterr()
+        assert out == "tacc-globalfs-user/tree/a/c/big.nc\n"
+        self.run_cli("fs", "find", "-type", "d", "tacc-globalfs-user/tree/a")
+        out, _ = capfd.readouterr()
+        assert out.splitlines() == ["tacc-globalfs-user/tree/a/b", "tacc-globalfs-user/tree/a/b/d",
+                                    "tacc-globalfs-user/tree/a/c"]
+        assert self.mock_server.listing_requests == requests
+
+        shutil.rmtree(os.path.join(self.remote, "tree", "a", "b"))
+        self.run_cli("fs", "find", "-u", "-type", "f", "tacc-globalfs-user/tree/a")
+        out, _ = capfd.readouterr()
+        assert out.splitlines() == ["tacc-globalfs-user/tree/a/c/big.nc",
+                                    "tacc-globalfs-user/tree/a/c/f.txt",
+                                    "tacc-globalfs-user/tree/a/f.txt"]
+
+    def test_refresh_index(self):
+        """ Test refreshing the index lists again only the directories that changed
+        """
+        self.make_remote_tree()
+        client = AgaveClient("http://localhost:{0}/".format(self.mock_server_port))
+        index = NamespaceIndex(os.path.join(self.agavedb, "index.db"), "tenant")
+        refresh = lambda: refresh_index(index, client, "files/v2/listings/system",
+                                        "tacc-globalfs-user", "tree", {}, jobs=2)
+
+        assert refresh() == 6
+        assert refresh() == 0
+
+        time.sleep(0.01)
+        with open(os.path.join(self.remote, "tree", "a", "b", "d", "new.txt"), "wb") as f:
+            f.write(b"new\n")
+        assert refresh() == 1
+        found = index.find("tacc-globalfs-user", "tree", name="new.txt")
+        assert [entry[0] for entry in found] == ["tree/a/b/d/new.txt"]
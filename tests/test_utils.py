@@ -0,0 +1,142 @@
+"""
+    test_utils.py
+
+    Test helpers shared by all "agavecli" commands.
+"""
+import pytest
+import json
+import os
+import agavecli
+from agavecli.utils import AgaveClient, RecordFormatter, SQLiteStore, get_agave_context, \
+        get_session, save_agave_context
+from agavecli_testsuite import MockServer
+try: # python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler
+except ImportError: # python 3
+    from http.server import BaseHTTPRequestHandler
+
+
+@pytest.mark.parametrize("output, expected", [
+    ("jsonl", '{"name": "a,b", "length": 1}\n{"name": "c\\td", "length": null}\n'),
+    ("csv", 'name,length\n"a,b",1\nc\td,\n'),
+    ("tsv", "name\tlength\na,b\t1\nc\\td\t\n"),
+])
+def test_record_formatter(output, expected):
+    """ Test records are formatted a page at a time, with a single header
+
+    Separators in values should be quoted or escaped, and missing fields
+    left empty.
+    """
+    formatter = RecordFormatter(output, ["name", "length"])
+
+    text = formatter.format_page([{"name": "a,b", "length": 1}])
+    text += formatter.format_page([{"name": "c\td"}]) + formatter.finish()
+
+    assert text == expected
+
+
+def test_agave_context_memoized(tmpdir):
+    """ Test the local Agave database is read once, and again once it changes
+
+    Changes saved through save_agave_context are seen without reading the
+    file again.
+    """
+    agavedb = str(tmpdir)
+    with open(os.path.join(agavedb, "agave.json"), "w") as f:
+        json.dump({"current": {"baseurl": "http://one/"}}, f)
+
+    context = get_agave_context(agavedb)
+    assert get_agave_context(agavedb) is context
+
+    context["current"]["username"] = "user"
+    save_agave_context(agavedb, context)
+    assert get_agave_context(agavedb) is context
+
+    with open(os.path.join(agavedb, "agave.json"), "w") as f:
+        json.dump({"current": {"baseurl": "http://other-tenant/"}}, f)
+    assert get_agave_context(agavedb)["current"] == {"baseurl": "http://other-tenant/"}
+
+
+def test_sqlite_store_transaction(tmpdir):
+    """ Test a transaction is committed as a whole, or not at all
+    """
+    class Store(SQLiteStore):
+        schema = ("CREATE TABLE IF NOT EXISTS items (name TEXT PRIMARY KEY)",)
+
+    db_path = os.path.join(str(tmpdir), "store.db")
+    store = Store(db_path)
+    with store.transaction() as db:
+        db.execute("INSERT INTO items VALUES ('a')")
+    with pytest.raises(ValueError):
+        with store.transaction() as db:
+            db.execute("INSERT INTO items VALUES ('b')")
+            raise ValueError("interrupted")
+    store.close()
+
+    store = Store(db_path)
+    assert store.fetchall("SELECT name FROM items") == [("a",)]
+    assert store.fetchone("SELECT name FROM items WHERE name = 'b'") is None
+    store.close()
+
+
+class MockServerKeepAliveEndpoints(BaseHTTPRequestHandler):
+    """ Mock the Agave API
+
+    Echo the request path, the authorization header, and the client port the
+    request came from. HTTP/1.1 keeps the connection open between requests.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = json.dumps({
+            "path": self.path,
+            "authorization": self.headers.get("Authorization"),
+            "port": self.client_address[1],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", len(body))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestMockServer(MockServer):
+    """ Test the shared agave http client
+    """
+
+    @classmethod
+    def setup_class(cls):
+        """ Set up an agave mock server
+
+        Listen and serve mock api as a daemon.
+        """
+        MockServer.serve.__func__(cls, MockServerKeepAliveEndpoints)
+
+    def test_client_url_and_token(self):
+        """ Test the client builds urls and sends the bearer token
+        """
+        baseurl = "http://localhost:{}/".format(self.mock_server_port)
+        client = AgaveClient(baseurl, "access_token")
+
+        resp = client.get("files/v2/listings/system", "sys/path")
+
+        assert resp.json()["path"] == "/files/v2/listings/system/sys/path"
+        assert resp.json()["authorization"] == "Bearer access_token"
+
+    def test_clients_share_connections(self):
+        """ Test requests reuse a single keep-alive connection
+
+        Requests sent by different clients to the same host should go
+        through the same pooled connection.
+        """
+        baseurl = "http://localhost:{}/".format(self.mock_server_port)
+        ports = set()
+        for _ in range(5):
+            client = AgaveClient(baseurl, "access_token")
+            ports.add(client.get("systems/v2").json()["port"])
+
+        assert client.session is get_session()
+        assert len(ports) == 1